@@ -9,7 +9,7 @@
 # http://opensource.org/licenses/MIT.
 
 from django.contrib import admin
-from .models import Message, Module, Project, WatchedQuery, QueuedSeries
+from .models import Job, Message, Module, Project, WatchedQuery, QueuedSeries
 from mod import get_module
 
 
@@ -60,3 +60,4 @@ admin_site.register(Message, MessageAdmin)
 admin_site.register(Module, ModuleAdmin)
 admin_site.register(WatchedQuery, admin.ModelAdmin)
 admin_site.register(QueuedSeries, admin.ModelAdmin)
+admin_site.register(Job, admin.ModelAdmin)
@@ -8,6 +8,7 @@
 # This work is licensed under the MIT License.  Please see the LICENSE file or
 # http://opensource.org/licenses/MIT.
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
@@ -15,6 +16,25 @@ class ApiConfig(AppConfig):
     verbose_name = "Patchew Core"
 
     def ready(self):
+        from constants import compute_constants
         from mod import load_modules
 
         load_modules()
+        # Register the handlers that invalidate the cached pages and the
+        # constants used by the views, also in processes that do not serve
+        # web pages
+        import www.views  # noqa: F401
+
+        compute_constants()
+
+        # Drop the cached mboxes of a series when its tags change
+        from event import register_handler
+
+        register_handler(
+            "TagsUpdate", lambda evt, series: series.invalidate_mbox_with_tags()
+        )
+        if settings.EVENT_QUEUE:
+            from event import set_job_queue
+            from .models import Job
+
+            set_job_queue(Job.objects.enqueue)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 Red Hat, Inc.
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+"""Keyset pagination of series lists.
+
+Instead of skipping the first N rows with OFFSET, a page starts right
+after the row that ended the previous one, so that the database can seek
+directly into the (project, topic, date) and (project, topic,
+last_reply_date) indexes of Message and page 1000 costs the same as page 1.
+
+Lists are always sorted from the newest to the oldest series, with NULLs
+last.  The position in the list is passed around as an opaque cursor,
+which records the sort key of a row and whether the page goes towards
+older series (after the row) or newer ones (before the row)."""
+
+import base64
+import datetime
+import json
+from functools import reduce
+import operator
+
+from django.db.models import F, Q
+
+from .models import Message
+
+# Sort keys for each ordering of the series lists; "id" is always last so
+# that the key is unique.
+SERIES_ORDERINGS = {
+    "date": ("date", "id"),
+    "last_reply_date": ("last_reply_date", "date", "id"),
+    "id": ("id",),
+}
+
+
+def _nullable(name):
+    return Message._meta.get_field(name).null
+
+
+def _order_by(name, reverse):
+    # Leave out NULLS FIRST/LAST if possible, so that PostgreSQL can walk
+    # the indexes in either direction.
+    if not _nullable(name):
+        return name if reverse else "-" + name
+    if reverse:
+        return F(name).asc(nulls_first=True)
+    return F(name).desc(nulls_last=True)
+
+
+def order_queryset(queryset, fields, reverse=False):
+    """Sort @queryset from the newest to the oldest row according to
+    @fields, or the other way round if @reverse is True"""
+    return queryset.order_by(*[_order_by(f, reverse) for f in fields])
+
+
+def _follows(name, value, reverse):
+    # Rows that come after @value in a descending, NULLs last ordering
+    # (before @value if @reverse is True).
+    if reverse:
+        if value is None:
+            return Q(**{name + "__isnull": False})
+        return Q(**{name + "__gt": value})
+    if value is None:
+        return None
+    q = Q(**{name + "__lt": value})
+    if _nullable(name):
+        q |= Q(**{name + "__isnull": True})
+    return q
+
+
+def _equals(name, value):
+    if value is None:
+        return Q(**{name + "__isnull": True})
+    return Q(**{name: value})
+
+
+def filter_queryset(queryset, fields, values, reverse=False):
+    """Return the rows of @queryset that come after the key @values, or
+    before it if @reverse is True"""
+    terms = []
+    prefix = Q()
+    for name, value in zip(fields, values):
+        q = _follows(name, value, reverse)
+        if q is not None:
+            terms.append(prefix & q)
+        prefix &= _equals(name, value)
+    if not terms:
+        return queryset.none()
+    return queryset.filter(reduce(operator.or_, terms))
+
+
+def get_key(item, fields):
+    """Return the sort key of @item according to @fields"""
+    return [getattr(item, f) for f in fields]
+
+
+def encode_cursor(fields, values, reverse=False):
+    """Return an opaque string that points after the key @values, or before
+    it if @reverse is True"""
+    key = [v.isoformat() if isinstance(v, datetime.datetime) else v for v in values]
+    data = json.dumps([int(reverse)] + key, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(fields, cursor):
+    """Return the key and the direction recorded in @cursor, or raise
+    ValueError if it is not valid for @fields"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        reverse, *key = json.loads(data.decode("utf-8"))
+    except Exception:
+        raise ValueError("invalid cursor")
+    if reverse not in (0, 1) or len(key) != len(fields):
+        raise ValueError("invalid cursor")
+    values = []
+    for name, value in zip(fields, key):
+        field = Message._meta.get_field(name)
+        if value is None and field.null:
+            values.append(None)
+            continue
+        try:
+            values.append(field.to_python(value))
+        except Exception:
+            raise ValueError("invalid cursor")
+        if values[-1] is None:
+            raise ValueError("invalid cursor")
+    return values, bool(reverse)
+
+
+class KeysetPage:
+    """A page of at most @size rows of @queryset, starting at @cursor
+    (None for the first page) and sorted according to @fields.  After
+    creating the object, @items contains the rows while @next_cursor and
+    @previous_cursor point to the older and newer pages, or are None if
+    there is nothing to show there."""
+
+    def __init__(self, queryset, fields, cursor, size):
+        self.fields = fields
+        if cursor:
+            values, reverse = decode_cursor(fields, cursor)
+            queryset = filter_queryset(queryset, fields, values, reverse)
+        else:
+            values, reverse = None, False
+        items = list(order_queryset(queryset, fields, reverse)[: size + 1])
+        more = len(items) > size
+        del items[size:]
+        if reverse:
+            items.reverse()
+        self.items = items
+
+        first = get_key(items[0], fields) if items else values
+        last = get_key(items[-1], fields) if items else values
+        if reverse:
+            self.previous_cursor = self._cursor(first, True) if more else None
+            self.next_cursor = self._cursor(last, False)
+        else:
+            self.previous_cursor = self._cursor(first, True) if cursor else None
+            self.next_cursor = self._cursor(last, False) if more else None
+
+    def _cursor(self, values, reverse):
+        if values is None:
+            return None
+        return encode_cursor(self.fields, values, reverse)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 Red Hat, Inc.
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Message, MessageText
+
+
+class Command(BaseCommand):
+    help = """Compute the body, preview, diffstat and file list of the
+    messages from their mbox.  New messages get them when they are
+    imported; use this to fill them in for the messages that were imported
+    before, or with --all to compute them again for every message."""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--project", "-p", help="only update this project")
+        parser.add_argument(
+            "--all", action="store_true", help="also update the messages that have one"
+        )
+
+    def handle(self, *args, **options):
+        if options["project"]:
+            q = Message.objects.project_messages(options["project"])
+            if q is None:
+                raise CommandError("unknown project %s" % options["project"])
+        else:
+            q = Message.objects.all()
+        if not options["all"]:
+            q = q.filter(text__isnull=True)
+        n = 0
+        for m in q.order_by("id").iterator():
+            MessageText.objects.build(m).save()
+            n += 1
+        self.stdout.write("Updated %d messages" % n)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 Red Hat, Inc.
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Message, SearchDocument
+
+
+class Command(BaseCommand):
+    help = """Index again the text of the series for keyword searches.  The
+    index is kept up to date as messages are imported; use this to repair
+    it, for example after restoring the messages from a dump."""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--project", "-p", help="only update this project")
+
+    def handle(self, *args, **options):
+        if options["project"]:
+            heads = Message.objects.series_heads(options["project"])
+            if heads is None:
+                raise CommandError("unknown project %s" % options["project"])
+        else:
+            heads = Message.objects.series_heads()
+        n = 0
+        for s in heads.order_by("id").iterator():
+            SearchDocument.objects.update_series(s, force=True)
+            n += 1
+        self.stdout.write("Updated %d series" % n)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 Red Hat, Inc.
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Message
+from mod import get_module
+
+
+class Command(BaseCommand):
+    help = """Parse the tags of all messages again and rebuild the tags of
+    the series and patches.  Use this after changing the tags configuration
+    or to repair the tags computed when the messages were imported."""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--project", "-p", help="only update this project")
+        parser.add_argument("series", nargs="*", help="message ids of the series")
+
+    def handle(self, *args, **options):
+        tags = get_module("tags")
+        if not tags:
+            raise CommandError("the tags module is not loaded")
+        if options["project"]:
+            heads = Message.objects.series_heads(options["project"])
+            if heads is None:
+                raise CommandError("unknown project %s" % options["project"])
+        else:
+            heads = Message.objects.series_heads()
+        if options["series"]:
+            heads = heads.filter(message_id__in=options["series"])
+        n = 0
+        for s in heads.order_by("id").iterator():
+            tags.update_series(s, recompute=True)
+            n += 1
+        self.stdout.write("Updated %d series" % n)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 Red Hat, Inc.
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+import os
+import socket
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from api.models import Job
+
+
+class Command(BaseCommand):
+    help = """Call the event handlers that were queued in the database.
+    Handlers registered with deferred=True are queued instead of being
+    called by the process that emits the event, if the PATCHEW_EVENT_QUEUE
+    environment variable is set."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--jobs", "-j", type=int, default=1, help="number of jobs to run at once"
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="seconds to wait when the queue is empty",
+        )
+        parser.add_argument(
+            "--oneshot", action="store_true", help="exit when the queue is empty"
+        )
+
+    def work(self, name, poll_interval, oneshot):
+        try:
+            while True:
+                close_old_connections()
+                job = Job.objects.claim(name)
+                if job is None:
+                    if oneshot:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+                if not Job.objects.run(job):
+                    self.stderr.write("%s failed:\n%s" % (job, job.last_error))
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
+
+    def handle(self, *args, **options):
+        prefix = "%s:%d" % (socket.gethostname(), os.getpid())
+        if options["jobs"] <= 1:
+            self.work(prefix, options["poll_interval"], options["oneshot"])
+            return
+        threads = [
+            threading.Thread(
+                target=self.work,
+                args=(
+                    "%s:%d" % (prefix, i),
+                    options["poll_interval"],
+                    options["oneshot"],
+                ),
+            )
+            for i in range(options["jobs"])
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.14 on 2026-10-17 02:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0071_auto_20220919_1251'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='series_head',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.message'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='thread_depth',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='thread_root',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.message'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def populate_thread_index(apps, schema_editor):
+    Message = apps.get_model("api", "Message")
+    projects = Message.objects.values_list("project_id", flat=True).distinct()
+    for project_id in projects.order_by("project_id"):
+        # message_id -> [id, in_reply_to, is_series_head]
+        msgs = {
+            msgid: [id, in_reply_to, topic_id is not None]
+            for id, msgid, in_reply_to, topic_id in Message.objects.filter(
+                project_id=project_id
+            )
+            .values_list("id", "message_id", "in_reply_to", "topic_id")
+            .iterator()
+        }
+        # message_id -> (thread_root_id, thread_depth, series_head_id)
+        index = {}
+        for msgid in msgs:
+            chain = []
+            m = msgid
+            while m in msgs and m not in index and m not in chain:
+                chain.append(m)
+                m = msgs[m][1]
+            for m in reversed(chain):
+                id, in_reply_to, is_head = msgs[m]
+                if in_reply_to not in index:
+                    index[m] = (None, 0, None)
+                    continue
+                parent_id, _, parent_is_head = msgs[in_reply_to]
+                root, depth, head = index[in_reply_to]
+                index[m] = (
+                    root or parent_id,
+                    depth + 1,
+                    None if is_head else parent_id if parent_is_head else head,
+                )
+
+        updates = [
+            Message(
+                id=msgs[msgid][0],
+                thread_root_id=root,
+                thread_depth=depth,
+                series_head_id=head,
+            )
+            for msgid, (root, depth, head) in index.items()
+            if depth
+        ]
+        Message.objects.bulk_update(
+            updates, ["thread_root", "thread_depth", "series_head"], batch_size=1000
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("api", "0072_message_thread_index")]
+
+    operations = [
+        migrations.RunPython(
+            populate_thread_index, reverse_code=migrations.RunPython.noop
+        )
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.1.14 on 2026-10-17 02:51
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0073_populate_thread_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='body_tags',
+            field=jsonfield.fields.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.1.14 on 2026-10-17 03:16
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0074_message_body_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='logentry',
+            name='segments',
+            field=jsonfield.fields.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-17 03:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0075_logentry_segments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='logentry',
+            name='digest',
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='logentry',
+            name='html_xz',
+            field=models.BinaryField(null=True),
+        ),
+    ]
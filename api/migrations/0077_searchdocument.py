@@ -0,0 +1,53 @@
+# Generated by Django 3.1.14 on 2026-10-17 03:31
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_text_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX api_searchdocument_subject_gin "
+            "ON api_searchdocument USING gin(subject_vector)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX api_searchdocument_body_gin "
+            "ON api_searchdocument USING gin(body_vector)"
+        )
+    elif schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE api_searchdocument_fts "
+            "USING fts5(subject, body, tokenize='porter unicode61')"
+        )
+        schema_editor.execute(
+            "CREATE TRIGGER api_searchdocument_fts_delete "
+            "AFTER DELETE ON api_searchdocument BEGIN "
+            "DELETE FROM api_searchdocument_fts WHERE rowid = old.series_id; END"
+        )
+
+
+def drop_text_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TRIGGER api_searchdocument_fts_delete")
+        schema_editor.execute("DROP TABLE api_searchdocument_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0076_logentry_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('series', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='api.message')),
+                ('num_patches', models.IntegerField(default=0)),
+                ('subject_vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+                ('body_vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+            ],
+        ),
+        migrations.RunPython(create_text_index, reverse_code=drop_text_index),
+    ]
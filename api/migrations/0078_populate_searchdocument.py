@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import Value
+
+from mbox import MboxMessage
+
+
+def get_commit_message(mbox):
+    lines = []
+    for line in MboxMessage(bytes(mbox).decode("utf-8")).get_body().splitlines():
+        if line == "---" or line.startswith("diff --git "):
+            break
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def is_single_patch(m):
+    if not m.is_patch:
+        return False
+    for tag in m.prefixes:
+        if "/" in tag:
+            n, total, _ = (tag + "/").split("/", maxsplit=2)
+            try:
+                return int(n) == int(total)
+            except ValueError:
+                pass
+    return True
+
+
+def populate_search_document(apps, schema_editor):
+    Message = apps.get_model("api", "Message")
+    SearchDocument = apps.get_model("api", "SearchDocument")
+    connection = schema_editor.connection
+    for s in Message.objects.filter(topic__isnull=False).iterator():
+        body = [get_commit_message(s.mbox_bytes)]
+        num_patches = 0
+        if not is_single_patch(s):
+            for p in Message.objects.filter(
+                project_id=s.project_id, in_reply_to=s.message_id, is_patch=True
+            ).order_by("patch_num"):
+                body.append(p.subject)
+                body.append(get_commit_message(p.mbox_bytes))
+                num_patches += 1
+        body = "\n".join(body)
+        if connection.vendor == "postgresql":
+            SearchDocument.objects.create(
+                series_id=s.id,
+                num_patches=num_patches,
+                subject_vector=SearchVector(Value(s.subject), config="english"),
+                body_vector=SearchVector(Value(body), config="english"),
+            )
+        else:
+            SearchDocument.objects.create(series_id=s.id, num_patches=num_patches)
+            schema_editor.execute(
+                "INSERT INTO api_searchdocument_fts(rowid, subject, body) "
+                "VALUES (%s, %s, %s)",
+                [s.id, s.subject, body],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("api", "0077_searchdocument")]
+
+    operations = [
+        migrations.RunPython(
+            populate_search_document, reverse_code=migrations.RunPython.noop
+        )
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.1.14 on 2026-10-17 03:55
+
+import datetime
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0078_populate_searchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('handler', models.CharField(max_length=256)),
+                ('event', models.CharField(max_length=64)),
+                ('params', jsonfield.fields.JSONField(default={})),
+                ('order_key', models.CharField(blank=True, max_length=64)),
+                ('created', models.DateTimeField(default=datetime.datetime.now)),
+                ('run_after', models.DateTimeField(default=datetime.datetime.now)),
+                ('attempts', models.IntegerField(default=0)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('locked_by', models.CharField(blank=True, max_length=256)),
+                ('failed', models.BooleanField(default=False)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+            options={
+                'index_together': {('failed', 'id')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.14 on 2026-10-17 04:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0079_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageText',
+            fields=[
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='text', serialize=False, to='api.message')),
+                ('body', models.TextField(blank=True)),
+                ('preview', models.TextField(blank=True)),
+                ('diff_stat', models.TextField(blank=True)),
+                ('files', jsonfield.fields.JSONField(default=[])),
+            ],
+        ),
+    ]
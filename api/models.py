@@ -7,38 +7,273 @@
 #
 # This work is licensed under the MIT License.  Please see the LICENSE file or
 # http://opensource.org/licenses/MIT.
+import bisect
+from collections import defaultdict
 import datetime
+import hashlib
+import itertools
 import email
+import functools
+import json
 import quopri
 import re
+import traceback
 
+from django.apps import apps
 from django.core import validators
-from django.db import models
-from django.db.models import Q
+from django.core.exceptions import ObjectDoesNotExist
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connection, models, transaction
+from django.db.models import F, Q, Value
 from django.contrib.auth.models import User
 from django.urls import reverse
 import jsonfield
 import lzma
+import uuid
+
+from django.core.cache import cache
 
 from mbox import MboxMessage, decode_payload
 from patchew.tags import lines_iter
-from event import emit_event, declare_event
+from event import emit_event, declare_event, run_deferred_handler
 import mod
 
 
+def get_shared_version(key):
+    """Return a token that changes whenever reset_shared_version() is
+    called for @key, in this or in any other server process.  This lets
+    processes keep derived data in memory and know when to rebuild it."""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def reset_shared_version(key):
+    cache.delete(key)
+
+
+def iter_xz_decompress(chunks, size):
+    """Decompress the concatenated xz streams in @chunks, yielding at most
+    @size bytes at a time"""
+    d = lzma.LZMADecompressor()
+    fed = False
+    for data in chunks:
+        while True:
+            out = d.decompress(data, size)
+            fed = fed or bool(data)
+            data = b""
+            if out:
+                yield out
+            if d.eof:
+                data = d.unused_data
+                d = lzma.LZMADecompressor()
+                fed = False
+                if not data:
+                    break
+            elif d.needs_input:
+                break
+    if fed:
+        raise lzma.LZMAError("Compressed data ended before the end-of-stream marker")
+
+
+def iter_join(sep, chunks):
+    """Like sep.join(chunks), but yield the result one piece at a time"""
+    first = True
+    for chunk in chunks:
+        if not first:
+            yield sep
+        first = False
+        yield chunk
+
+
 class LogEntry(models.Model):
+    XZ_MAGIC = b"\xfd7zXZ\x00"
+    CHUNK_SIZE = 1024 * 1024
+    # Logs are compressed as a sequence of independent xz streams, each
+    # holding SEGMENT_SIZE bytes of text, so that any part of the log can
+    # be read without decompressing what comes before it.
+    SEGMENT_SIZE = 1024 * 1024
+
     data_xz = models.BinaryField()
+    # A [compressed offset, offset, line number] triple for the start of
+    # each xz stream, and one for the end of the log.  Null for logs that
+    # were stored before the index was introduced.
+    segments = jsonfield.JSONField(null=True, blank=True)
+    # SHA-1 of data_xz, used as the ETag of the log
+    digest = models.CharField(max_length=40, blank=True)
+    # The HTML rendering of the log, compressed with xz; Null until the
+    # log is first viewed as HTML, and reset whenever the log changes
+    html_xz = models.BinaryField(null=True)
 
     @property
     def data(self):
         if not hasattr(self, "_data"):
-            self._data = lzma.decompress(self.data_xz).decode("utf-8")
+            self._data = lzma.decompress(self.data_xz).decode("utf-8", "replace")
         return self._data
 
     @data.setter
     def data(self, value):
+        self._compress([value.encode("utf-8")])
         self._data = value
-        self.data_xz = lzma.compress(value.encode("utf-8"))
+
+    def _compress(self, chunks):
+        out = []
+        segments = []
+        offset = line = 0
+        compressor = None
+
+        def write(data):
+            out.append(data)
+            return len(data)
+
+        compressed = 0
+        for chunk in chunks:
+            while chunk:
+                if compressor is None:
+                    segments.append([compressed, offset, line])
+                    compressor = lzma.LZMACompressor()
+                    left = self.SEGMENT_SIZE
+                part, chunk = chunk[:left], chunk[left:]
+                compressed += write(compressor.compress(part))
+                offset += len(part)
+                line += part.count(b"\n")
+                left -= len(part)
+                if not left:
+                    compressed += write(compressor.flush())
+                    compressor = None
+        if not segments:
+            segments.append([0, 0, 0])
+            compressor = lzma.LZMACompressor()
+        if compressor:
+            compressed += write(compressor.flush())
+        segments.append([compressed, offset, line])
+        self.data_xz = b"".join(out)
+        self.segments = segments
+        self.digest = hashlib.sha1(self.data_xz).hexdigest()
+        self.html_xz = None
+        self.__dict__.pop("_data", None)
+
+    def read_from(self, stream, compressed=False):
+        """Set the log to the contents of the binary file object @stream,
+        which is compressed a chunk at a time.  If @compressed is True,
+        @stream must be in xz format; it is recompressed in segments."""
+
+        def read_chunks():
+            while True:
+                chunk = stream.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+        chunks = read_chunks()
+        if compressed:
+            first = next(chunks, b"")
+            if not first.startswith(self.XZ_MAGIC):
+                raise ValueError("log is not in xz format")
+            chunks = iter_xz_decompress(
+                itertools.chain([first], chunks), self.CHUNK_SIZE
+            )
+        try:
+            self._compress(chunks)
+        except lzma.LZMAError as e:
+            raise ValueError("invalid xz data: %s" % e)
+
+    @property
+    def size(self):
+        """The size of the log in bytes, or None if it is not known"""
+        return self.segments[-1][1] if self.segments else None
+
+    def iter_bytes(self, start=0, end=None):
+        """Yield the contents of the log between the byte offsets @start
+        and @end, only decompressing the segments that include them"""
+        segments = self.segments or [[0, 0, 0]]
+        k = max(bisect.bisect_right([x[1] for x in segments], start) - 1, 0)
+        compressed, pos, line = segments[k]
+        data_xz = memoryview(self.data_xz)
+        chunks = (
+            data_xz[i : i + self.CHUNK_SIZE]
+            for i in range(compressed, len(data_xz), self.CHUNK_SIZE)
+        )
+        for out in iter_xz_decompress(chunks, self.CHUNK_SIZE):
+            if end is not None and pos >= end:
+                return
+            if pos + len(out) > start:
+                yield out[max(start - pos, 0) : None if end is None else end - pos]
+            pos += len(out)
+
+    def line_offset(self, n):
+        """Return the byte offset of the start of line @n, counting from
+        zero, or the size of the log if it has fewer lines"""
+        segments = self.segments or [[0, 0, 0]]
+        if n <= 0:
+            return 0
+        # The n-th newline is after the start of segment k
+        k = max(bisect.bisect_left([x[2] for x in segments], n) - 1, 0)
+        compressed, pos, line = segments[k]
+        for out in self.iter_bytes(pos):
+            count = out.count(b"\n")
+            if line + count >= n:
+                i = -1
+                for _ in range(n - line):
+                    i = out.index(b"\n", i + 1)
+                return pos + i + 1
+            line += count
+            pos += len(out)
+        return pos
+
+    def get_digest(self):
+        if not self.digest:
+            self.digest = hashlib.sha1(self.data_xz).hexdigest()
+            LogEntry.objects.filter(pk=self.pk).update(digest=self.digest)
+        return self.digest
+
+    def iter_html(self, render):
+        """Yield the HTML rendering of the log as bytes.  The first time,
+        render() is called with an iterator over the log and must return
+        an iterator of strings; its output is then stored in html_xz for
+        the next calls."""
+        if self.html_xz is not None:
+            yield from iter_xz_decompress([self.html_xz], self.CHUNK_SIZE)
+            return
+
+        digest = self.get_digest()
+        compressor = lzma.LZMACompressor()
+        out = []
+        buf = []
+        size = 0
+        for html in itertools.chain(render(self.iter_bytes()), [None]):
+            if html is not None:
+                buf.append(html)
+                size += len(html)
+                if size < 65536:
+                    continue
+            data = "".join(buf).encode("utf-8")
+            buf = []
+            size = 0
+            if data:
+                out.append(compressor.compress(data))
+                yield data
+        out.append(compressor.flush())
+        # Do not store it if the log changed in the meanwhile
+        LogEntry.objects.filter(pk=self.pk, digest=digest).update(
+            html_xz=b"".join(out)
+        )
+
+    def count_lines(self):
+        """Return the number of lines in the log; the last one need not
+        end with a newline"""
+        if self.segments:
+            size, lines = self.segments[-1][1:]
+        else:
+            size = lines = 0
+            for out in self.iter_bytes():
+                size += len(out)
+                lines += out.count(b"\n")
+        if size and not b"".join(self.iter_bytes(size - 1)).endswith(b"\n"):
+            lines += 1
+        return lines
 
 
 class Result(models.Model):
@@ -87,18 +322,65 @@ class Result(models.Model):
     def is_running(self):
         return self.status == self.RUNNING
 
+    # The fields whose value in the database save() needs to know
+    TRACKED_FIELDS = ("status", "log_entry_id")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._set_loaded_values(dict(zip(field_names, values)))
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        if fields is None:
+            self._set_loaded_values(self.__dict__)
+        elif {"status", "log_entry", "log_entry_id"} & set(fields):
+            self._loaded_values = None
+
+    def _set_loaded_values(self, values):
+        loaded = {f: values.get(f, models.DEFERRED) for f in self.TRACKED_FIELDS}
+        if models.DEFERRED in loaded.values():
+            loaded = None
+        self._loaded_values = loaded
+
+    def _get_loaded_values(self):
+        loaded = getattr(self, "_loaded_values", None)
+        if loaded is None and self.pk is not None:
+            # Not loaded by from_db(), or some fields were deferred
+            loaded = (
+                Result.objects.filter(pk=self.pk).values(*self.TRACKED_FIELDS).first()
+            )
+        return loaded
+
     def save(self, *args, **kwargs):
         self.last_update = datetime.datetime.utcnow()
-        old_result = Result.objects.filter(pk=self.pk).first()
-        old_status = old_result.status if old_result else None
-        old_entry = old_result.log_entry if old_result else None
+        loaded = self._get_loaded_values()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            update_fields = set(update_fields) | {"last_update"}
+        elif loaded and not self._state.adding and not args:
+            # The subclasses only add a foreign key to the object that the
+            # result is about, which does not change.  Update only the
+            # fields of Result, so that saving takes a single UPDATE.
+            update_fields = {
+                f.name for f in Result._meta.concrete_fields if not f.primary_key
+            }
+        if update_fields is not None:
+            kwargs["update_fields"] = update_fields
         super().save(*args, **kwargs)
 
-        if self.log_entry is None and old_entry is not None:
-            # Quick way to check if the field was actually saved to the database
-            new_result = Result.objects.filter(pk=self.pk).first()
-            if new_result.log_entry is None:
-                old_entry.delete()
+        old_status = loaded["status"] if loaded else None
+        old_entry_id = loaded["log_entry_id"] if loaded else None
+        new_status, new_entry_id = self.status, self.log_entry_id
+        if update_fields is not None:
+            if "status" not in update_fields:
+                new_status = old_status
+            if not update_fields & {"log_entry", "log_entry_id"}:
+                new_entry_id = old_entry_id
+        if new_entry_id is None and old_entry_id is not None:
+            LogEntry.objects.filter(pk=old_entry_id).delete()
+        self._loaded_values = {"status": new_status, "log_entry_id": new_entry_id}
 
         emit_event("ResultUpdate", obj=self.obj, old_status=old_status, result=self)
 
@@ -146,7 +428,131 @@ class Result(models.Model):
         return "%s (%s)" % (self.name, self.status)
 
 
-class Project(models.Model):
+class ProjectRouter:
+    """Per-process index from mailing list addresses to the projects that
+    use them, with the prefix rules of each project already compiled.  It
+    finds the projects that recognize a message without loading any of
+    them, and it is rebuilt when any project's mailing_list or prefix_tags
+    change."""
+
+    VERSION_KEY = "project-routing"
+
+    def __init__(self):
+        self._version = None
+        self._by_addr = {}
+
+    def _load(self):
+        version = get_shared_version(self.VERSION_KEY)
+        if version == self._version:
+            return
+        by_addr = defaultdict(list)
+        for id, mailing_list, prefix_tags in Project.objects.values_list(
+            "id", "mailing_list", "prefix_tags"
+        ).order_by("id"):
+            rules = Project.compile_prefix_tags(prefix_tags)
+            for addr in set(Project.split_mailing_lists(mailing_list)):
+                by_addr[addr].append((id, rules))
+        self._by_addr = dict(by_addr)
+        self._version = version
+
+    def route(self, m):
+        """Return the ids of the projects that recognize @m, in ascending
+        order"""
+        self._load()
+        seen = set()
+        ret = []
+        for name, addr in m.get_to() + m.get_cc():
+            for id, rules in self._by_addr.get(addr, []):
+                if id in seen:
+                    continue
+                seen.add(id)
+                if Project.match_prefix_tags(rules, m.get_prefixes()):
+                    ret.append(id)
+        return sorted(ret)
+
+
+project_router = ProjectRouter()
+
+
+class PropertiesMixin:
+    """Access to the "properties" JSON field of Project and Message.  A
+    property name is a dot-separated path into the nested dictionaries."""
+
+    def get_property(self, prop, default=None):
+        x = self.properties
+        *path, last = prop.split(".")
+        for item in path:
+            if not item in x:
+                return default
+            x = x[item]
+        return x.get(last, default)
+
+    def _apply_property(self, prop, value):
+        # Returns whether the property exists after the change, and its
+        # previous value.
+        x = self.properties
+        *path, last = prop.split(".")
+        if value is None:
+            for item in path:
+                if not item in x:
+                    return False, None
+                x = x[item]
+            if not last in x:
+                return False, None
+            return True, x.pop(last)
+        for item in path:
+            x = x.setdefault(item, {})
+        old_val = x.get(last)
+        x[last] = value
+        return True, old_val
+
+    def update_properties(self, properties, **fields):
+        """Set the properties in @properties, deleting those whose value is
+        None, and the model fields in @fields.  Only the changed columns
+        are written, with a single UPDATE statement; SetProperty events
+        are emitted once the current transaction commits."""
+        events = []
+        for prop, value in properties.items():
+            changed, old_val = self._apply_property(prop, value)
+            if changed:
+                events.append((prop, value, old_val))
+        for name, value in fields.items():
+            setattr(self, name, value)
+        update_fields = list(fields)
+        if events:
+            update_fields.append("properties")
+        if not update_fields:
+            return
+        self.save(update_fields=update_fields)
+        for prop, value, old_val in events:
+            transaction.on_commit(
+                functools.partial(
+                    emit_event,
+                    "SetProperty",
+                    obj=self,
+                    name=prop,
+                    value=value,
+                    old_value=old_val,
+                )
+            )
+
+    def delete_property(self, prop):
+        self.update_properties({prop: None})
+
+    def set_property(self, prop, value):
+        self.update_properties({prop: value})
+
+
+class ProjectManager(models.Manager):
+    def recognizing(self, m):
+        """Return the projects that recognize message @m"""
+        ids = project_router.route(m)
+        if not ids:
+            return []
+        return list(self.filter(id__in=ids).order_by("id"))
+
+
+class Project(PropertiesMixin, models.Model):
     name = models.CharField(
         max_length=1024, db_index=True, unique=True, help_text="The name of the project"
     )
@@ -203,6 +609,8 @@ class Project(models.Model):
     config = jsonfield.JSONField(default={})
     properties = jsonfield.JSONField(default={})
 
+    objects = ProjectManager()
+
     def __str__(self):
         return self.name
 
@@ -211,47 +619,29 @@ class Project(models.Model):
         return self.objects.filter(name=project).exists()
 
     def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and not set(update_fields) & {
+            "mailing_list",
+            "prefix_tags",
+            "config",
+        }:
+            super().save(*args, **kwargs)
+            return
         old_project = Project.objects.filter(pk=self.pk).first()
         old_config = old_project.config if old_project else None
         super().save(*args, **kwargs)
+        if not old_project or (old_project.mailing_list, old_project.prefix_tags) != (
+            self.mailing_list,
+            self.prefix_tags,
+        ):
+            reset_shared_version(ProjectRouter.VERSION_KEY)
         if old_config != self.config:
             emit_event("SetProjectConfig", obj=self)
 
-    def get_property(self, prop, default=None):
-        x = self.properties
-        *path, last = prop.split(".")
-        for item in path:
-            if not item in x:
-                return default
-            x = x[item]
-        return x.get(last, default)
-
-    def delete_property(self, prop):
-        x = self.properties
-        *path, last = prop.split(".")
-        for item in path:
-            if not item in x:
-                return
-            x = x[item]
-        if not last in x:
-            return
-        old_val = x[last]
-        del x[last]
-        self.save()
-        emit_event("SetProperty", obj=self, name=prop, value=None, old_value=old_val)
-
-    def set_property(self, prop, value):
-        if value is None:
-            self.delete_property(prop)
-            return
-        x = self.properties
-        *path, last = prop.split(".")
-        for item in path:
-            x = x.setdefault(item, {})
-        old_val = x.get(last)
-        x[last] = value
-        self.save()
-        emit_event("SetProperty", obj=self, name=prop, value=value, old_value=old_val)
+    def delete(self, *args, **kwargs):
+        ret = super().delete(*args, **kwargs)
+        reset_shared_version(ProjectRouter.VERSION_KEY)
+        return ret
 
     def total_series_count(self):
         return Message.objects.series_heads(project=self.name).count()
@@ -265,37 +655,46 @@ class Project(models.Model):
             return True
         return False
 
-    def get_mailing_lists(self):
-        r = self.mailing_list.split()
+    @staticmethod
+    def split_mailing_lists(mailing_list):
+        r = mailing_list.split()
         return [x.rstrip(",;") for x in r]
 
+    def get_mailing_lists(self):
+        return self.split_mailing_lists(self.mailing_list)
+
+    @staticmethod
+    def compile_prefix_tags(prefix_tags):
+        """Return a list of (inversed, match) pairs for the rules in
+        @prefix_tags, where match is a function that tests a prefix"""
+        rules = []
+        for t in prefix_tags.split():
+            inversed = t.startswith("!")
+            if inversed:
+                t = t[1:]
+            if t.startswith("/"):
+                match = re.compile(t[1:]).match
+            else:
+                match = lambda p, t=t.lower(): t == p.lower()
+            rules.append((inversed, match))
+        return rules
+
+    @staticmethod
+    def match_prefix_tags(rules, prefixes):
+        for inversed, match in rules:
+            found = any(match(p) for p in prefixes)
+            if found == inversed:
+                return False
+        return True
+
     def recognizes(self, m):
         """Test if @m is considered a message in this project"""
-        addr_ok = False
+        mailing_lists = self.get_mailing_lists()
         for name, addr in m.get_to() + m.get_cc():
-            if addr in self.get_mailing_lists():
-                addr_ok = True
-                break
-        if addr_ok:
-            for t in self.prefix_tags.split():
-                found = False
-                if t.startswith("!"):
-                    t = t[1:]
-                    inversed = True
-                else:
-                    inversed = False
-                for p in m.get_prefixes():
-                    if t.startswith("/"):
-                        found = re.match(t[1:], p)
-                    else:
-                        found = t.lower() == p.lower()
-                    if found:
-                        if inversed:
-                            return False
-                        break
-                if not found and not inversed:
-                    return False
-            return True
+            if addr in mailing_lists:
+                return self.match_prefix_tags(
+                    self.compile_prefix_tags(self.prefix_tags), m.get_prefixes()
+                )
         return False
 
     def get_subprojects(self):
@@ -413,6 +812,9 @@ declare_event(
 
 
 class MessageManager(models.Manager):
+    # Number of messages that add_messages_from_mbox_many processes at once
+    BULK_IMPORT_BATCH = 500
+
     class DuplicateMessageError(Exception):
         pass
 
@@ -471,14 +873,18 @@ class MessageManager(models.Manager):
         s = msg.get_series_head()
         if not s:
             return
-        if not s.last_reply_date or s.last_reply_date < msg.date:
-            s.last_reply_date = msg.date
-            s.save()
-        if s.get_sender_addr() != msg.get_sender_addr() and (
-            not s.last_comment_date or s.last_comment_date < msg.date
-        ):
-            s.last_comment_date = msg.date
-            s.save()
+        self._update_series(s, [msg])
+
+    def _update_series(self, s, msgs):
+        """Update the record of series @s after @msgs were added to its thread"""
+        sender = s.get_sender_addr()
+        for msg in msgs:
+            if not s.last_reply_date or s.last_reply_date < msg.date:
+                s.last_reply_date = msg.date
+            if sender != msg.get_sender_addr() and (
+                not s.last_comment_date or s.last_comment_date < msg.date
+            ):
+                s.last_comment_date = msg.date
         s.refresh_num_patches()
         cur, total = s.get_num()
         if cur == total and s.is_patch:
@@ -494,10 +900,69 @@ class MessageManager(models.Manager):
         if not find:
             s.set_complete()
 
+    def _update_search(self, s, msgs):
+        """Update the search document of series @s after @msgs were added
+        to its thread; replies do not change it"""
+        if any(m.is_patch or m.is_series_head for m in msgs):
+            SearchDocument.objects.update_series(s)
+
     def delete_subthread(self, msg):
-        for r in msg.get_replies():
-            self.delete_subthread(r)
-        msg.delete()
+        replies = msg.get_thread_replies()
+        todo = [msg]
+        subthread = set()
+        while todo:
+            m = todo.pop()
+            if m.id not in subthread:
+                subthread.add(m.id)
+                todo += replies[m.message_id]
+        self.filter(pk__in=subthread).delete()
+
+    def _index_threads(self, project, msgs):
+        """Fill in the thread index of @msgs, which were just added to
+        @project, and attach the subthreads that were waiting for them"""
+        by_msgid = {m.message_id: m for m in msgs}
+        parents = {
+            p.message_id: p
+            for p in self.filter(
+                project=project,
+                message_id__in={m.in_reply_to for m in msgs if m.in_reply_to}
+                - by_msgid.keys(),
+            )
+        }
+        done = set()
+        linked = []
+        for m in msgs:
+            # Index the ancestors in the batch first
+            chain = []
+            while m is not None and m.message_id not in done:
+                done.add(m.message_id)
+                chain.append(m)
+                m = by_msgid.get(m.in_reply_to)
+            for m in reversed(chain):
+                p = by_msgid.get(m.in_reply_to) or parents.get(m.in_reply_to)
+                if p is None or p is m:
+                    continue
+                m.thread_root_id = p.thread_root_id or p.id
+                m.thread_depth = p.thread_depth + 1
+                if not m.is_series_head:
+                    m.series_head_id = p.id if p.is_series_head else p.series_head_id
+                linked.append(m)
+        if linked:
+            self.bulk_update(linked, ["thread_root", "thread_depth", "series_head"])
+
+        orphans = self.filter(
+            project=project, thread_root=None, in_reply_to__in=by_msgid.keys()
+        ).exclude(pk__in=[m.pk for m in msgs])
+        for o in orphans:
+            p = by_msgid[o.in_reply_to]
+            subthread = self.filter(Q(pk=o.pk) | Q(thread_root=o.pk))
+            head = p.id if p.is_series_head else p.series_head_id
+            if head:
+                subthread.filter(series_head=None, topic=None).update(series_head=head)
+            subthread.update(
+                thread_root=p.thread_root_id or p.id,
+                thread_depth=F("thread_depth") + p.thread_depth + 1,
+            )
 
     def create(self, project, **validated_data):
         mbox = validated_data.pop("mbox")
@@ -521,50 +986,157 @@ class MessageManager(models.Manager):
         msg.project = project
         msg.mbox_bytes = mbox.encode("utf-8")
         msg.save()
+        MessageText.objects.build(msg, m).save()
+        self._index_threads(project, [msg])
+        s = msg.get_series_head()
+        if s:
+            self._update_search(s, [msg])
         emit_event("MessageAdded", message=msg)
         self.update_series(msg)
         return msg
 
-    def add_message_from_mbox(self, mbox, user, project_name=None):
-        def find_message_projects(m):
-            return [p for p in Project.objects.all() if p.recognizes(m)]
+    def _build_message(self, m, project, topic):
+        msg = Message(
+            message_id=m.get_message_id(),
+            in_reply_to=m.get_in_reply_to() or "",
+            date=m.get_date(),
+            subject=m.get_subject(),
+            stripped_subject=m.get_subject(strip_tags=True),
+            version=m.get_version(),
+            sender=m.get_from(),
+            recipients=m.get_to() + m.get_cc(),
+            prefixes=m.get_prefixes(),
+            topic=topic,
+            is_patch=m.is_patch(),
+            patch_num=m.get_num()[0],
+        )
+        msg.project = project
+        msg.mbox_bytes = m.get_mbox().encode("utf-8")
+        return msg
 
+    def add_message_from_mbox(self, mbox, user, project_name=None):
         m = MboxMessage(mbox)
         msgid = m.get_message_id()
         if project_name:
             projects = [Project.object.get(name=project_name)]
         else:
-            projects = find_message_projects(m)
+            projects = Project.objects.recognizing(m)
         stripped_subject = m.get_subject(strip_tags=True)
         is_series_head = m.is_series_head()
         for p in projects:
-            msg = Message(
-                message_id=msgid,
-                in_reply_to=m.get_in_reply_to() or "",
-                date=m.get_date(),
-                subject=m.get_subject(),
-                stripped_subject=stripped_subject,
-                version=m.get_version(),
-                sender=m.get_from(),
-                recipients=m.get_to() + m.get_cc(),
-                prefixes=m.get_prefixes(),
-                topic=(
+            msg = self._build_message(
+                m,
+                p,
+                (
                     Topic.objects.for_stripped_subject(stripped_subject)
                     if is_series_head
                     else None
                 ),
-                is_patch=m.is_patch(),
-                patch_num=m.get_num()[0],
             )
-            msg.project = p
             if self.filter(message_id=msgid, project__name=p.name).first():
                 raise self.DuplicateMessageError(msgid)
-            msg.mbox_bytes = mbox.encode("utf-8")
             msg.save()
+            MessageText.objects.build(msg, m).save()
+            self._index_threads(p, [msg])
+            s = msg.get_series_head()
+            if s:
+                self._update_search(s, [msg])
             emit_event("MessageAdded", message=msg)
             self.update_series(msg)
         return projects
 
+    def add_messages_from_mbox_many(self, mboxes, projects=None):
+        """Import the messages in @mboxes into those of @projects (by
+        default, all projects) that recognize them.  Messages that already
+        exist are skipped.  New messages are inserted in bulk, and the
+        search document, completion and review state of each affected
+        series are updated only once per batch.  MessageAdded is still
+        emitted for every message, because its handlers expect to see each
+        message; the ones that work on the whole series, such as tags,
+        find the later messages already processed and have little left to
+        do.  Return the list of created messages."""
+        allowed = None if projects is None else set(p.id for p in projects)
+        created = []
+        for i in range(0, len(mboxes), self.BULK_IMPORT_BATCH):
+            by_project = defaultdict(list)
+            for x in mboxes[i : i + self.BULK_IMPORT_BATCH]:
+                m = MboxMessage(x)
+                for id in project_router.route(m):
+                    if allowed is None or id in allowed:
+                        by_project[id].append(m)
+            if not by_project:
+                continue
+            topics = {}
+            for p in Project.objects.filter(id__in=by_project).order_by("id"):
+                created += self._add_messages_to_project(by_project[p.id], p, topics)
+        return created
+
+    def _add_messages_to_project(self, batch, project, topics):
+        known = set(
+            self.filter(
+                project=project, message_id__in=[m.get_message_id() for m in batch]
+            ).values_list("message_id", flat=True)
+        )
+        new = []
+        parsed = {}
+        for m in batch:
+            msgid = m.get_message_id()
+            if msgid in known:
+                continue
+            known.add(msgid)
+            parsed[msgid] = m
+            topic = None
+            if m.is_series_head():
+                stripped_subject = m.get_subject(strip_tags=True)
+                if stripped_subject not in topics:
+                    topics[stripped_subject] = Topic.objects.for_stripped_subject(
+                        stripped_subject
+                    )
+                topic = topics[stripped_subject]
+            new.append(self._build_message(m, project, topic))
+        if not new:
+            return []
+        # Another importer might have added some of the messages in the
+        # meantime; that is harmless, the updates below are idempotent.
+        self.bulk_create(new, ignore_conflicts=True)
+        order = {msg.message_id: i for i, msg in enumerate(new)}
+        new = sorted(
+            self.filter(project=project, message_id__in=order.keys()),
+            key=lambda msg: order[msg.message_id],
+        )
+        MessageText.objects.bulk_create(
+            [MessageText.objects.build(msg, parsed[msg.message_id]) for msg in new],
+            ignore_conflicts=True,
+        )
+
+        self._index_threads(project, new)
+
+        # Group the new messages by series
+        by_id = {msg.id: msg for msg in new}
+        series = {}
+        others = []
+        for msg in new:
+            if msg.is_series_head:
+                s = msg
+            else:
+                s = by_id.get(msg.series_head_id) or msg.get_series_head()
+            if s:
+                series.setdefault(s.id, (s, []))[1].append(msg)
+            else:
+                others.append(msg)
+        for s, msgs in series.values():
+            s.refresh_from_db()
+            self._update_search(s, msgs)
+            # MessageAdded is an event about a single message, so it is not
+            # batched; only the series updates are.
+            for msg in msgs:
+                emit_event("MessageAdded", message=msg)
+            s.refresh_from_db()
+            self._update_series(s, msgs)
+        for msg in others:
+            emit_event("MessageAdded", message=msg)
+        return new
+
 
 def HeaderFieldModel(**args):
     return models.CharField(max_length=4096, **args)
@@ -627,7 +1199,7 @@ class Topic(models.Model):
         self.delete()
 
 
-class Message(models.Model):
+class Message(PropertiesMixin, models.Model):
     """Patch email message"""
 
     project = models.ForeignKey("Project", on_delete=models.CASCADE)
@@ -653,6 +1225,10 @@ class Message(models.Model):
     sender = jsonfield.JSONCharField(max_length=4096, db_index=True)
     recipients = jsonfield.JSONField()
     tags = jsonfield.JSONField(default=[])
+    # Tag lines found in the body of this message alone, as opposed to
+    # "tags" which for patches and series heads also includes the tags
+    # from their replies.  Null until the tags module has parsed it.
+    body_tags = jsonfield.JSONField(null=True, blank=True)
     prefixes = jsonfield.JSONField(blank=True)
     is_complete = models.BooleanField(default=False)
     is_patch = models.BooleanField()
@@ -667,6 +1243,19 @@ class Message(models.Model):
         "Topic", on_delete=models.CASCADE, null=True, db_index=True
     )
 
+    # Thread index, filled in by MessageManager when messages are added.
+    # thread_root is Null for the root of the thread, including replies
+    # whose parent has not been received yet; thread_depth is the distance
+    # from the root.  series_head is the closest series head among the
+    # ancestors (Null for series heads themselves).
+    thread_root = models.ForeignKey(
+        "self", on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    thread_depth = models.PositiveIntegerField(default=0)
+    series_head = models.ForeignKey(
+        "self", on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+
     # patch index number if is_patch
     patch_num = models.PositiveSmallIntegerField(null=True, blank=True)
 
@@ -677,6 +1266,10 @@ class Message(models.Model):
 
     objects = MessageManager()
 
+    MBOX_CACHE_KEY_PREFIX = "mbox-with-tags:"
+    MBOX_VERSION_KEY_PREFIX = "mbox-with-tags-version:"
+    MBOX_CACHE_TIMEOUT = 24 * 3600
+
     maintainers = jsonfield.JSONField(blank=True, default=[])
     properties = jsonfield.JSONField(default={})
 
@@ -692,7 +1285,21 @@ class Message(models.Model):
 
     mbox = property(get_mbox)
 
-    def _get_mbox_with_tags(self, series_tags=[]):
+    def _get_mbox_with_tags(self, series_tags=[], version=""):
+        # The result only depends on the (immutable) mbox and on the tags,
+        # so the tags are part of the key.  @version is reset on TagsUpdate,
+        # so that the entries for the old tags of a series are not used
+        # anymore and eventually expire.
+        tags = set(self.tags).union(series_tags)
+        digest = hashlib.sha1("\n".join(sorted(tags)).encode("utf-8")).hexdigest()
+        key = "%s%d:%s:%s" % (self.MBOX_CACHE_KEY_PREFIX, self.id, version, digest)
+        mbox = cache.get(key)
+        if mbox is None:
+            mbox = self._build_mbox_with_tags(tags)
+            cache.set(key, mbox, timeout=self.MBOX_CACHE_TIMEOUT)
+        return mbox
+
+    def _build_mbox_with_tags(self, tags):
         def mbox_with_tags_iter(mbox, tags):
             regex = "^[-A-Za-z]*:"
             old_tags = set()
@@ -731,14 +1338,17 @@ class Message(models.Model):
             container.replace_header("Content-Transfer-Encoding", "quoted-printable")
         except KeyError:
             msg.add_header("Content-Transfer-Encoding", "quoted-printable")
-        payload = "\n".join(
-            mbox_with_tags_iter(payload, set(self.tags).union(series_tags))
-        )
+        payload = "\n".join(mbox_with_tags_iter(payload, tags))
         payload = quopri.encodestring(payload.encode("utf-8"))
         container.set_payload(payload, charset="utf-8")
         return msg.as_bytes(unixfrom=True)
 
     def get_mboxes_with_tags(self):
+        """Return an iterator over the mboxes of the patches, with the tags
+        of the series and of the replies added to the commit message, or
+        None if the series is not complete.  The mboxes are built (or
+        fetched from the cache) one at a time, so that they can be
+        streamed."""
         if not self.is_patch:
             if not self.is_complete:
                 return None
@@ -748,13 +1358,17 @@ class Message(models.Model):
             messages = [self]
             series_tags = set()
 
-        mbox_list = []
-        for message in messages:
-            mbox_list.append(message._get_mbox_with_tags(series_tags))
-        return mbox_list
+        version = get_shared_version(self.MBOX_VERSION_KEY_PREFIX + str(self.id))
+        return (m._get_mbox_with_tags(series_tags, version) for m in messages)
 
     def get_mbox_with_tags(self):
-        return b"\n".join(self.get_mboxes_with_tags())
+        mboxes = self.get_mboxes_with_tags()
+        if mboxes is None:
+            return None
+        return b"\n".join(mboxes)
+
+    def invalidate_mbox_with_tags(self):
+        reset_shared_version(self.MBOX_VERSION_KEY_PREFIX + str(self.id))
 
     def get_num(self):
         assert self.is_patch or self.is_series_head
@@ -793,12 +1407,23 @@ class Message(models.Model):
         return self.topic_id is not None
 
     def get_series_head(self):
-        s = self
-        while s:
-            if s.is_series_head:
-                return s
-            s = s.get_in_reply_to_message()
-        return None
+        if self.is_series_head:
+            return self
+        return self.series_head
+
+    def get_thread_replies(self, with_text=False):
+        """Fetch the whole thread of this message with a single query, and
+        return a dictionary that maps message ids to their replies.  If
+        @with_text is True, the messages come with their MessageText
+        instead of their mbox."""
+        root = self.thread_root_id or self.id
+        q = Message.objects.filter(Q(pk=root) | Q(thread_root=root))
+        if with_text:
+            q = q.select_related("text").defer("mbox_bytes")
+        replies = defaultdict(list)
+        for m in q.order_by("patch_num", "date"):
+            replies[m.in_reply_to].append(m)
+        return replies
 
     def get_patches(self):
         if not self.is_series_head:
@@ -835,42 +1460,6 @@ class Message(models.Model):
             self.refresh_num_patches()
         return self.num_patches
 
-    def get_property(self, prop, default=None):
-        x = self.properties
-        *path, last = prop.split(".")
-        for item in path:
-            if not item in x:
-                return default
-            x = x[item]
-        return x.get(last, default)
-
-    def delete_property(self, prop):
-        x = self.properties
-        *path, last = prop.split(".")
-        for item in path:
-            if not item in x:
-                return
-            x = x[item]
-        if not last in x:
-            return
-        old_val = x[last]
-        del x[last]
-        self.save()
-        emit_event("SetProperty", obj=self, name=prop, value=None, old_value=old_val)
-
-    def set_property(self, prop, value):
-        if value is None:
-            self.delete_property(prop)
-            return
-        x = self.properties
-        *path, last = prop.split(".")
-        for item in path:
-            x = x.setdefault(item, {})
-        old_val = x.get(last)
-        x[last] = value
-        self.save()
-        emit_event("SetProperty", obj=self, name=prop, value=value, old_value=old_val)
-
     def get_sender_addr(self):
         return self.sender[1]
 
@@ -893,41 +1482,30 @@ class Message(models.Model):
     def get_last_reply_date(self):
         return self.last_reply_date or self.date
 
+    def get_text(self):
+        """Return the MessageText of this message.  For messages that were
+        stored before MessageText existed, and were not yet processed by
+        "manage.py rebuild_message_text", it is computed (but not saved)
+        from the mbox."""
+        try:
+            return self.text
+        except MessageText.DoesNotExist:
+            self.text = MessageText.objects.build(self)
+            return self.text
+
     def get_body(self):
-        return self.get_mbox_obj().get_body()
+        return self.get_text().body
 
     def get_preview(self, maxchar=1000):
-        return self.get_mbox_obj().get_preview()
+        return self.get_text().preview
 
     def get_diff_stat(self):
         if not self.is_series_head:
             return None
-        cur = []
-        patterns = [
-            r"\S*\s*\|\s*[0-9]*( \+*-*)?$",
-            r"\S*\s*\|\s*Bin",
-            r"\S* => \S*\s*|\s*[0-9]* \+*-*$",
-            r"[0-9]* files changed",
-            r"1 file changed",
-            r"(create|delete) mode [0-7]+",
-            r"mode change [0-7]+",
-            r"rename .*\([0-9]+%\)$",
-            r"copy .*\([0-9]+%\)$",
-            r"rewrite .*\([0-9]+%\)$",
-        ]
-        ret = []
-        for l in self.get_body().splitlines():
-            line = l.strip()
-            for p in patterns:
-                if re.match(p, line):
-                    cur.append(line)
-                    ret = cur
-                    break
-            else:
-                cur = []
-                if ret and re.match(r"--- \S", line):
-                    break
-        return "\n".join(ret)
+        return self.get_text().diff_stat
+
+    def get_files(self):
+        return self.get_text().files
 
     def get_message_view_url(self):
         assert self.is_patch or self.is_series_head
@@ -1007,12 +1585,119 @@ class MessageResult(Result):
         return log_url
 
 
+class MessageTextManager(models.Manager):
+    def build(self, msg, m=None):
+        """Return a new, unsaved MessageText for @msg.  @m is the parsed
+        mbox of the message, if the caller already has it."""
+        m = m or msg.get_mbox_obj()
+        return MessageText(
+            message=msg,
+            body=m.get_body(),
+            preview=m.get_preview(),
+            diff_stat=m.get_diff_stat(),
+            files=m.get_files(),
+        )
+
+
+class MessageText(models.Model):
+    """Text derived from the mbox of a message.  Messages do not change
+    once stored, so this is computed when a message is imported and the
+    views do not have to parse the mbox again."""
+
+    message = models.OneToOneField(
+        Message, primary_key=True, on_delete=models.CASCADE, related_name="text"
+    )
+    body = models.TextField(blank=True)
+    preview = models.TextField(blank=True)
+    diff_stat = models.TextField(blank=True)
+    files = jsonfield.JSONField(default=[])
+
+    objects = MessageTextManager()
+
+
+class SearchDocumentManager(models.Manager):
+    def _get_patches(self, series):
+        c, n = series.get_num()
+        if c == n and series.is_patch:
+            return []
+        return Message.objects.patches().filter(
+            project_id=series.project_id, in_reply_to=series.message_id
+        )
+
+    def update_series(self, series, force=False):
+        """Index the text of @series, unless it is already up to date
+        with the patches that have been received so far"""
+        patches = self._get_patches(series)
+        num_patches = len(patches) if isinstance(patches, list) else patches.count()
+        doc = self.filter(series=series).first()
+        if doc is None:
+            doc = SearchDocument(series=series)
+        elif doc.num_patches == num_patches and not force:
+            return
+        body = [SearchDocument.get_commit_message(series.get_body())]
+        if num_patches:
+            patches = patches.order_by("patch_num")
+        for p in patches:
+            body.append(p.subject)
+            body.append(SearchDocument.get_commit_message(p.get_body()))
+        doc.num_patches = num_patches
+        doc.store(series.subject, "\n".join(body))
+
+
+class SearchDocument(models.Model):
+    """Text of a series that is looked up by keyword searches: the subject,
+    and the body of the cover letter and the commit messages of the patches.
+    On PostgreSQL the text is stored in the tsvector columns; on SQLite it
+    is stored in the FTS5 table FTS_TABLE, whose rowid is the series id."""
+
+    FTS_TABLE = "api_searchdocument_fts"
+
+    series = models.OneToOneField(
+        Message,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name="search_document",
+    )
+    # number of patches whose commit message is in the document
+    num_patches = models.IntegerField(default=0)
+    subject_vector = SearchVectorField(null=True)
+    body_vector = SearchVectorField(null=True)
+
+    objects = SearchDocumentManager()
+
+    @staticmethod
+    def get_commit_message(body):
+        lines = []
+        for line in body.splitlines():
+            if line == "---" or line.startswith("diff --git "):
+                break
+            lines.append(line)
+        return "\n".join(lines)
+
+    def store(self, subject, body):
+        if connection.vendor == "postgresql":
+            self.subject_vector = SearchVector(Value(subject), config="english")
+            self.body_vector = SearchVector(Value(body), config="english")
+            self.save()
+        else:
+            self.save()
+            sql = "REPLACE INTO %s(rowid, subject, body) VALUES (%%s, %%s, %%s)"
+            with connection.cursor() as cursor:
+                cursor.execute(sql % self.FTS_TABLE, [self.series_id, subject, body])
+
+
 class Module(models.Model):
     """Module information"""
 
     name = models.CharField(max_length=128, unique=True)
     config = models.TextField(blank=True)
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding:
+            mod.module_config_changed(self.name)
+
     def __str__(self):
         return self.name
 
@@ -1027,3 +1712,138 @@ class WatchedQuery(models.Model):
 
     def __str__(self):
         return self.query + " for user " + self.user.username
+
+
+class JobManager(models.Manager):
+    # How long a worker can run a job before other workers consider it dead
+    LOCK_TIMEOUT = datetime.timedelta(minutes=10)
+    # Delay before the first retry; it doubles at every failure
+    RETRY_DELAY = datetime.timedelta(seconds=30)
+    MAX_ATTEMPTS = 5
+    # How many jobs claim() looks at to find one that is not blocked
+    CLAIM_WINDOW = 100
+
+    @staticmethod
+    def _encode_param(value):
+        if isinstance(value, models.Model):
+            # Objects that were not saved, or were deleted, cannot be looked
+            # up by the worker
+            if value.pk is None:
+                raise ValueError("cannot queue unsaved object %r" % value)
+            return {"model": value._meta.label_lower, "pk": value.pk}
+        json.dumps(value)
+        return {"value": value}
+
+    @staticmethod
+    def _decode_param(data):
+        if "model" in data:
+            return apps.get_model(data["model"]).objects.get(pk=data["pk"])
+        return data["value"]
+
+    @staticmethod
+    def _get_order_key(params):
+        # Jobs for the same series, or for the same project if the event
+        # is not about a series, run in the order they were queued
+        for v in params:
+            if isinstance(v, Message):
+                head = v.get_series_head() or v
+                return "series:%d" % head.id
+        for v in params:
+            if isinstance(v, Project):
+                return "project:%d" % v.id
+        return ""
+
+    def enqueue(self, handler, event, params):
+        """Queue a call to the deferred event handler named @handler.
+        Return False if @params cannot be stored in the database."""
+        try:
+            data = {k: self._encode_param(v) for k, v in params.items()}
+        except (TypeError, ValueError):
+            return False
+        self.create(
+            handler=handler,
+            event=event,
+            params=data,
+            order_key=self._get_order_key(params.values()),
+        )
+        return True
+
+    def claim(self, worker):
+        """Lock the oldest job that can run now and return it, or return
+        None if there is none.  A job cannot run while an older job with
+        the same order_key is running or waiting to be retried."""
+        now = datetime.datetime.now()
+        blocked = set()
+        for job in self.filter(failed=False).order_by("id")[: self.CLAIM_WINDOW]:
+            if job.order_key in blocked:
+                continue
+            if job.order_key:
+                blocked.add(job.order_key)
+            if job.run_after > now or (job.locked_until and job.locked_until > now):
+                continue
+            # Another worker may have claimed the job in the meanwhile
+            locked_until = now + self.LOCK_TIMEOUT
+            if self.filter(id=job.id, locked_until=job.locked_until).update(
+                locked_until=locked_until, locked_by=worker
+            ):
+                job.locked_until = locked_until
+                job.locked_by = worker
+                return job
+        return None
+
+    def run(self, job):
+        """Call the handler of @job, which must have been returned by
+        claim().  Delete the job if the handler succeeds, otherwise
+        schedule it to be retried or, after MAX_ATTEMPTS, mark it as
+        failed.  Return True if the handler succeeded.
+
+        Model instances among the parameters are fetched again by primary
+        key, so the handler sees the objects as they are when the job runs,
+        not as they were when the event was emitted.  If one of them was
+        deleted in the meanwhile, the handler is not called and the job is
+        simply deleted."""
+        try:
+            try:
+                params = {k: self._decode_param(v) for k, v in job.params.items()}
+            except ObjectDoesNotExist:
+                job.delete()
+                return True
+            run_deferred_handler(job.handler, job.event, params)
+        except Exception:
+            job.attempts += 1
+            job.last_error = traceback.format_exc()
+            job.failed = job.attempts >= self.MAX_ATTEMPTS
+            job.run_after = datetime.datetime.now() + self.RETRY_DELAY * (
+                2 ** (job.attempts - 1)
+            )
+            job.locked_until = None
+            job.save()
+            return False
+        job.delete()
+        return True
+
+
+class Job(models.Model):
+    """A call to an event handler that was queued by emit_event(), to be
+    made by the "worker" management command"""
+
+    handler = models.CharField(max_length=256)
+    event = models.CharField(max_length=64)
+    params = jsonfield.JSONField(default={})
+    # Jobs with the same non-empty key run one at a time, in order of id
+    order_key = models.CharField(max_length=64, blank=True)
+    created = models.DateTimeField(default=datetime.datetime.now)
+    run_after = models.DateTimeField(default=datetime.datetime.now)
+    attempts = models.IntegerField(default=0)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=256, blank=True)
+    failed = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True)
+
+    objects = JobManager()
+
+    class Meta:
+        index_together = [("failed", "id")]
+
+    def __str__(self):
+        return "%s for %s" % (self.handler, self.event)
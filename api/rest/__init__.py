@@ -10,13 +10,23 @@
 
 from collections import OrderedDict
 from django.contrib.auth.models import User
-from django.http import Http404, HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, StreamingHttpResponse
 from django.template import loader
-from django.db.models import F
 import django.db.utils
+import io
+import json
 
 from mod import dispatch_module_hook
-from ..models import Project, ProjectResult, Message, MessageResult, Result
+from ..models import (
+    LogEntry,
+    Project,
+    ProjectResult,
+    Message,
+    MessageResult,
+    Result,
+    iter_join,
+)
+from ..keyset import SERIES_ORDERINGS, order_queryset
 from ..search import SearchEngine
 from rest_framework import (
     permissions,
@@ -29,6 +39,7 @@ from rest_framework import (
     status,
 )
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
 from rest_framework.fields import (
     SerializerMethodField,
     CharField,
@@ -40,7 +51,7 @@ from rest_framework.relations import HyperlinkedIdentityField
 from rest_framework.response import Response
 from rest_framework.views import APIView
 import rest_framework
-from mbox import addr_db_to_rest, MboxMessage
+from mbox import addr_db_to_rest, split_mbox, MboxMessage
 from rest_framework.parsers import BaseParser
 
 SEARCH_PARAM = "q"
@@ -540,17 +551,16 @@ class PatchewSearchFilter(filters.BaseFilterBackend):
 
 
 class PatchewOrderingFilter(filters.OrderingFilter):
-    def filter_queryset(self, request, queryset, view):
-        # Always use descending ordering
+    def get_keyset_fields(self, request, queryset, view):
+        # Always use descending ordering; the last field wins
+        fields = SERIES_ORDERINGS["id"]
         for i in self.get_ordering(request, queryset, view):
-            if i[0] == "-":
-                i = i[1:]
-            if i == "last_reply_date":
-                queryset = queryset.order_by(F("last_reply_date").desc(nulls_last=True), "-date")
-            else:
-                queryset = queryset.order_by("-" + i)
+            fields = SERIES_ORDERINGS[i.lstrip("-")]
+        return fields
 
-        return queryset
+    def filter_queryset(self, request, queryset, view):
+        fields = self.get_keyset_fields(request, queryset, view)
+        return order_queryset(queryset, fields)
 
     def get_template_context(self, request, queryset, view):
         ordering = self.get_ordering(request, queryset, view)
@@ -571,6 +581,11 @@ class SeriesViewSet(BaseMessageViewSet):
     ordering_fields = ['date', 'id', 'last_reply_date']
     ordering = ['id']
 
+    def get_keyset_fields(self):
+        return PatchewOrderingFilter().get_keyset_fields(
+            self.request, self.get_queryset(), self
+        )
+
 
 class ProjectSeriesViewSet(
     ProjectMessagesViewSetMixin,
@@ -589,16 +604,15 @@ class ProjectSeriesViewSet(
             ).order_by("patch_num")
         return patches
 
-    def collect_replies(self, parent, result):
-        replies = Message.objects.filter(
-            in_reply_to=parent.message_id,
-            project=self.kwargs["projects_pk"],
-            is_patch=False,
-        ).order_by("date")
+    def collect_replies(self, parent, thread, result):
+        replies = sorted(
+            (m for m in thread[parent.message_id] if not m.is_patch),
+            key=lambda m: m.date,
+        )
         for m in replies:
             result.append(m)
         for m in replies:
-            self.collect_replies(m, result)
+            self.collect_replies(m, thread, result)
         return result
 
     def get_serializer_class(self, *args, **kwargs):
@@ -609,10 +623,11 @@ class ProjectSeriesViewSet(
     def get_object(self):
         series = super().get_object()
         series.patches = self.collect_patches(series)
-        series.replies = self.collect_replies(series, [])
+        thread = series.get_thread_replies()
+        series.replies = self.collect_replies(series, thread, [])
         if not series.is_patch:
             for i in series.patches:
-                self.collect_replies(i, series.replies)
+                self.collect_replies(i, thread, series.replies)
         return series
 
     def perform_destroy(self, instance):
@@ -620,11 +635,14 @@ class ProjectSeriesViewSet(
 
     @action(detail=True, renderer_classes=[StaticTextRenderer])
     def mbox(self, request, *args, **kwargs):
-        message = self.get_object()
-        mbox = message.get_mbox_with_tags()
-        if not mbox:
+        # The patches and replies that get_object() collects are not needed
+        message = super().get_object()
+        mboxes = message.get_mboxes_with_tags()
+        if mboxes is None:
             raise Http404("Series not complete")
-        return Response(mbox)
+        return StreamingHttpResponse(
+            iter_join(b"\n", mboxes), content_type="text/plain; charset=utf-8"
+        )
 
 
 # Messages
@@ -667,6 +685,27 @@ class MessagePlainTextParser(BaseParser):
         return MboxMessage(data).get_json()
 
 
+class MboxParser(BaseParser):
+    media_type = "application/mbox"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        data = stream.read().decode("utf-8")
+        return list(split_mbox(data))
+
+
+class NDJSONMessagesParser(BaseParser):
+    """Parse one JSON object with an "mbox" key per line"""
+
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        data = stream.read().decode("utf-8")
+        try:
+            return [json.loads(l)["mbox"] for l in data.splitlines() if l.strip()]
+        except (ValueError, KeyError, TypeError) as exc:
+            raise ParseError("NDJSON parse error - %s" % str(exc))
+
+
 class ProjectMessagesViewSet(
     ProjectMessagesViewSetMixin,
     BaseMessageViewSet,
@@ -710,13 +749,21 @@ class MessagesViewSet(BaseMessageViewSet):
         else:
             return MessageSerializer
 
+    def get_import_projects(self):
+        """Return the projects that the user can import messages into, or
+        None if the user can import messages into all projects"""
+        user = self.request.user
+        if user.is_superuser or user.groups.filter(name="importers").exists():
+            return None
+        return Project.objects.filter(maintainers=user)
+
     def create(self, request, *args, **kwargs):
         m = MboxMessage(request.data["mbox"])
-        projects = [p for p in Project.objects.all() if p.recognizes(m)]
-        grps = request.user.groups.all()
-        grps_name = [grp.name for grp in grps]
-        if "importers" not in grps_name:
-            projects = (p for p in projects if p.maintained_by(self.request.user))
+        projects = Project.objects.recognizing(m)
+        allowed = self.get_import_projects()
+        if allowed is not None:
+            allowed = set(allowed.values_list("id", flat=True))
+            projects = [p for p in projects if p.id in allowed]
         results = []
         for project in projects:
             try:
@@ -732,6 +779,23 @@ class MessagesViewSet(BaseMessageViewSet):
             status=status.HTTP_201_CREATED if results else status.HTTP_200_OK,
         )
 
+    @action(
+        detail=False,
+        methods=["post"],
+        parser_classes=[MboxParser, NDJSONMessagesParser],
+    )
+    def bulk(self, request, *args, **kwargs):
+        messages = Message.objects.add_messages_from_mbox_many(
+            request.data, self.get_import_projects()
+        )
+        serializer = BaseMessageSerializer(
+            messages, many=True, context=self.get_serializer_context()
+        )
+        return Response(
+            OrderedDict([("results", serializer.data)]),
+            status=status.HTTP_201_CREATED if messages else status.HTTP_200_OK,
+        )
+
 
 # Results
 class HyperlinkedResultField(HyperlinkedIdentityField):
@@ -838,10 +902,31 @@ class ResultsViewSet(
         return context
 
     def get_serializer_class(self, *args, **kwargs):
-        if self.lookup_field in self.kwargs:
+        if self.lookup_field in self.kwargs and self.action != "log":
             return ResultSerializerFull
         return ResultSerializer
 
+    @action(detail=True, methods=["put"])
+    def log(self, request, *args, **kwargs):
+        """Upload the log of a result as the raw request body, either
+        text/plain or already compressed as application/x-xz"""
+        content_type = request.content_type.split(";")[0].strip()
+        if content_type not in ("text/plain", "application/x-xz"):
+            raise UnsupportedMediaType(content_type)
+        result = self.get_object()
+        entry = result.log_entry or LogEntry()
+        try:
+            entry.read_from(
+                request.stream or io.BytesIO(),
+                compressed=content_type == "application/x-xz",
+            )
+        except ValueError as e:
+            raise ParseError(str(e))
+        entry.save()
+        result.log_entry = entry
+        result.save()
+        return Response(self.get_serializer(result).data)
+
 
 class ProjectResultsViewSet(ResultsViewSet):
     def get_queryset(self):
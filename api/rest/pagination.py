@@ -8,8 +8,13 @@
 # This work is licensed under the MIT License.  Please see the LICENSE file or
 # http://opensource.org/licenses/MIT.
 
+from django.template import loader
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from api.keyset import KeysetPage
 
 
 # remove count from paginator
@@ -19,6 +24,14 @@ from rest_framework.response import Response
 
 
 class PatchewPagination(LimitOffsetPagination):
+    """Limit/offset pagination without a count.  Views that define
+    get_keyset_fields() are paginated with an opaque "cursor" parameter
+    instead, unless the request asks for an offset explicitly."""
+
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+    cursor_template = "rest_framework/pagination/previous_and_next.html"
+
     def get_paginated_response(self, data):
         return Response(
             {
@@ -29,6 +42,10 @@ class PatchewPagination(LimitOffsetPagination):
         )
 
     def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_page = None
+        get_keyset_fields = getattr(view, "get_keyset_fields", None)
+        if get_keyset_fields and self.offset_query_param not in request.query_params:
+            return self.paginate_keyset(queryset, request, get_keyset_fields())
         self.offset = self.get_offset(request)
         self.limit = self.get_limit(request)
 
@@ -44,6 +61,51 @@ class PatchewPagination(LimitOffsetPagination):
 
         return q
 
+    def paginate_keyset(self, queryset, request, fields):
+        self.limit = self.get_limit(request)
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        try:
+            self.keyset_page = KeysetPage(queryset, fields, cursor, self.limit)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        page = self.keyset_page
+        if page.next_cursor or page.previous_cursor:
+            self.display_page_controls = self.template is not None
+        return page.items
+
+    def get_cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.offset_query_param
+        )
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if self.keyset_page:
+            return self.get_cursor_link(self.keyset_page.next_cursor)
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.keyset_page:
+            return self.get_cursor_link(self.keyset_page.previous_cursor)
+        return super().get_previous_link()
+
+    def get_html_context(self):
+        if self.keyset_page:
+            return {
+                "previous_url": self.get_previous_link(),
+                "next_url": self.get_next_link(),
+            }
+        return super().get_html_context()
+
+    def to_html(self):
+        if self.keyset_page:
+            template = loader.get_template(self.cursor_template)
+            return template.render(self.get_html_context())
+        return super().to_html()
+
     def get_paginated_response_schema(self, schema):
         ret = super().get_paginated_response_schema(schema)
         del ret["properties"]["count"]
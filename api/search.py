@@ -8,20 +8,30 @@
 # This work is licensed under the MIT License.  Please see the LICENSE file or
 # http://opensource.org/licenses/MIT.
 
-from .models import Message, MessageResult, Project, Result, QueuedSeries
+from .models import (
+    Message,
+    MessageResult,
+    Project,
+    Result,
+    QueuedSeries,
+    SearchDocument,
+)
 from collections import namedtuple
+import datetime
+import functools
 from functools import reduce
 import operator
+import re
 
 from django.db import connection
-from django.db.models import Q
+from django.db.models import BooleanField, Case, Q, Value, When
+from django.db.models.expressions import RawSQL
 
-from django.contrib.postgres.search import SearchQuery, SearchVector, SearchVectorField
+from django.contrib.postgres.search import SearchQuery
 from django.db.models import Lookup
 from django.db.models.fields import Field
 
 import abc
-import compynator.core
 
 
 @Field.register_lookup
@@ -39,35 +49,27 @@ class InvalidSearchTerm(Exception):
     pass
 
 
-# Hack alert: Django wraps each argument to to_tsvector with a COALESCE function,
-# and that causes postgres not to use the index.  Monkeypatch as_sql to skip
-# that step, which we do not need since the subject field is not nullable.
-class NonNullSearchVector(SearchVector):
-    function = "to_tsvector"
-    arg_joiner = " || ' ' || "
-    _output_field = SearchVectorField()
-
-    def as_sql(self, compiler, connection, function=None, template=None):
-        config_sql = None
-        config_params = []
-        if template is None:
-            if self.config:
-                config_sql, config_params = compiler.compile(self.config)
-                template = "%(function)s(%(config)s, %(expressions)s)"
-            else:
-                template = self.template
-        sql, params = super(SearchVector, self).as_sql(
-            compiler,
-            connection,
-            function=function,
-            template=template,
-            config=config_sql,
+# Keyword searches use the SearchDocument of the series, and look at the
+# subject or at the body.  On PostgreSQL, a keyword is turned into a
+# SearchQuery that is matched against a tsvector column; on SQLite, it
+# is looked up in the FTS5 table, as a prefix of a word.
+
+
+def _fts_match(column, keyword):
+    phrase = '%s:"%s"*' % (column, keyword.replace('"', '""'))
+    return Q(
+        id__in=RawSQL(
+            "SELECT rowid FROM %s WHERE %s MATCH %%s"
+            % (SearchDocument.FTS_TABLE, SearchDocument.FTS_TABLE),
+            [phrase],
         )
-        extra_params = []
-        if self.weight:
-            weight_sql, extra_params = compiler.compile(self.weight)
-            sql = "setweight({}, {})".format(sql, weight_sql)
-        return sql, config_params + params + extra_params
+    )
+
+
+def _body_query(keyword):
+    if connection.vendor == "postgresql":
+        return Q(search_document__body_vector=SearchQuery(keyword, config="english"))
+    return _fts_match("body", keyword)
 
 
 # The abstract syntax tree of the search.  This allows:
@@ -77,12 +79,29 @@ class NonNullSearchVector(SearchVector):
 #
 # On top of this, SearchMaint and SearchQueue allow to use a singleton parser
 # that does not know about requests, and only resolve the user ("me") later
+#
+# get_fields() returns the names of the Message fields (or related objects)
+# that the expression looks at; this lets callers skip re-evaluating a
+# search when none of those fields have changed.
+
+
+def _q_fields(q):
+    fields = set()
+    for child in q.children:
+        if isinstance(child, Q):
+            fields |= _q_fields(child)
+        else:
+            fields.add(child[0].split("__")[0])
+    return fields
 
 
 class SearchExpression(metaclass=abc.ABCMeta):
     def get_project(self):
         return None
 
+    def get_fields(self):
+        return set()
+
     def get_all_keywords(self):
         return self.get_keywords()
 
@@ -143,6 +162,9 @@ class SearchNot(SearchExpression, namedtuple("SearchNot", ["op"])):
     def get_all_keywords(self):
         return self.op.get_all_keywords()
 
+    def get_fields(self):
+        return self.op.get_fields()
+
     def get_query_no_keywords(self, user, keyword_map, keyword_final):
         return ~self.op.get_query(user, keyword_map, keyword_final)
 
@@ -154,6 +176,9 @@ class SearchBinary(SearchExpression, namedtuple("SearchBinary", ["left", "right"
     def get_all_keywords(self):
         return self.left.get_all_keywords() + self.right.get_all_keywords()
 
+    def get_fields(self):
+        return self.left.get_fields() | self.right.get_fields()
+
 
 class SearchAnd(SearchBinary):
     def get_project(self):
@@ -193,6 +218,9 @@ class SearchTerm(SearchExpression, namedtuple("SearchTerm", ["project", "query"]
     def get_project(self):
         return self.project
 
+    def get_fields(self):
+        return _q_fields(self.query)
+
     def get_query_no_keywords(self, user, keyword_map, keyword_final):
         return self.query
 
@@ -201,17 +229,34 @@ class SearchKeyword(SearchExpression, namedtuple("SearchKeyword", ["keyword"])):
     def get_keywords(self):
         return [self.keyword]
 
+    def get_fields(self):
+        return {"subject"}
+
     def get_query_no_keywords(self, user, keyword_map, keyword_final):
         return Q()
 
 
+class SearchBody(SearchExpression, namedtuple("SearchBody", ["keyword"])):
+    def get_fields(self):
+        return {"search_document"}
+
+    def get_query_no_keywords(self, user, keyword_map, keyword_final):
+        return _body_query(self.keyword)
+
+
 class SearchSubquery(SearchExpression, namedtuple("SearchQueue", ["model", "q"])):
+    def get_fields(self):
+        return {"results"}
+
     def get_query_no_keywords(self, user, keyword_map, keyword_final):
         message_ids = self.model.objects.filter(self.q).values("message_id")
         return Q(id__in=message_ids)
 
 
 class SearchQueue(SearchExpression, namedtuple("SearchQueue", ["queues", "username"])):
+    def get_fields(self):
+        return {"queues"}
+
     def get_query_no_keywords(self, user, keyword_map, keyword_final):
         if self.username == "me":
             if not user.is_authenticated:
@@ -225,6 +270,9 @@ class SearchQueue(SearchExpression, namedtuple("SearchQueue", ["queues", "userna
 
 
 class SearchMaint(SearchExpression, namedtuple("SearchMaint", ["rhs"])):
+    def get_fields(self):
+        return {"maintainers"}
+
     def get_query_no_keywords(self, user, keyword_map, keyword_final):
         if self.rhs == "me":
             if not user.is_authenticated:
@@ -235,187 +283,236 @@ class SearchMaint(SearchExpression, namedtuple("SearchMaint", ["rhs"])):
             return Q(maintainers__icontains=self.rhs)
 
 
-def __parser(_Q):
-    from compynator.core import One, Terminal
-    from compynator.niceties import Digit, Forward, Lookahead
+class SearchProject(SearchExpression, namedtuple("SearchProject", ["project"])):
+    def get_project(self):
+        return self.project
 
-    def Q(**kwargs):
-        return SearchTerm(project=None, query=_Q(**kwargs))
+    def get_fields(self):
+        return {"project"}
 
-    def K(keyword):
-        return SearchKeyword(keyword)
+    def get_query_no_keywords(self, user, keyword_map, keyword_final):
+        return Q(project__pk__in=Project.get_project_ids_by_name(self.project))
 
-    def human_to_seconds(n, unit):
-        unit = unit.lower()
-        if unit == "d":
-            return int(n) * 86400
-        elif unit == "w":
-            return int(n) * 86400 * 7
-        elif unit == "m":
-            return int(n) * 86400 * 30
-        elif unit == "y":
-            return int(n) * 86400 * 365
-        raise Exception("No unit specified")
 
-    def _make_filter_age(cond, sec):
-        import datetime
+class SearchAge(SearchExpression, namedtuple("SearchAge", ["less", "seconds"])):
+    def get_fields(self):
+        return {"date"}
 
-        less = cond == "<"
-        p = datetime.datetime.now() - datetime.timedelta(0, sec)
-        if less:
-            q = Q(date__gte=p)
+    def get_query_no_keywords(self, user, keyword_map, keyword_final):
+        p = datetime.datetime.now() - datetime.timedelta(0, self.seconds)
+        if self.less:
+            return Q(date__gte=p)
         else:
-            q = Q(date__lte=p)
-        return q
-
-    def _make_filter_project(cond):
-        ids = Project.get_project_ids_by_name(cond)
-        return SearchTerm(
-            project=cond,
-            query=_Q(project__pk__in=ids))
-
-    def _make_filter_is(cond):
-        if cond == "complete":
-            return Q(is_complete=True)
-        elif cond == "pull":
-            return K("PULL") & SearchTerm(
-                project=None,
-                query=_Q(subject__contains="[PULL") | _Q(subject__contains="[GIT PULL"),
-            )
-        elif cond == "reviewed":
-            return Q(is_reviewed=True)
-        elif cond in ("obsoleted", "old", "obsolete"):
-            return Q(is_obsolete=True)
-        elif cond == "applied":
-            return SearchSubquery(MessageResult, _Q(name="git", status=Result.SUCCESS))
-        elif cond == "tested":
-            return Q(is_tested=True)
-        elif cond == "merged":
-            return Q(is_merged=True)
-        return None
+            return Q(date__lte=p)
 
-    def _make_filter_not(cond):
-        q = _make_filter_is(cond)
-        if q:
-            q = ~q
-        return q
-
-    def _make_filter_is_or_keyword(cond):
-        return _make_filter_is(cond) or K(cond)
-
-    def _make_subquery_result(term, **kwargs):
-        q = _Q(name=term, **kwargs) | _Q(name__startswith=term + ".", **kwargs)
-        return SearchSubquery(MessageResult, q)
-
-    def _make_filter_result(kind, term):
-        if kind == "failure:":
-            return _make_subquery_result(term, status=Result.FAILURE)
-        if kind == "success:":
-            # What we want is "all results are successes", but the only way to
-            # express it is "there is a result and not (any result is not a success)".
-            return _make_subquery_result(term) & ~_make_subquery_result(
-                term, status__ne=Result.SUCCESS
-            )
-        if kind == "pending:":
-            return _make_subquery_result(term, status=Result.PENDING)
-        if kind == "running:":
-            return _make_subquery_result(term, status=Result.RUNNING)
 
-    def field(terminal, value, field):
-        return Terminal(terminal).then(value).value(lambda x: Q(**{field: x}))
+# The parser.  The result only depends on the search string, so it can be
+# cached; everything that depends on the user, on the current time or on
+# the contents of the database is resolved by get_query().
+
+
+def _term(**kwargs):
+    return SearchTerm(project=None, query=Q(**kwargs))
 
-    def charset(cs, reverse=False, lookahead=False):
-        if reverse:
-            char = One.where(lambda c: c not in cs)
-        else:
-            char = One.where(lambda c: c in cs)
-        if lookahead:
-            return Lookahead(char)
-        else:
-            return char
-
-    WordChar = charset(' \t<>{}()', reverse=True)
-    Space = One.where(lambda c: c == ' ' or c == '\t')
-    Word = WordChar.repeat(lower=1)
-    WordNoColon = Word.filter(lambda x: ':' not in x.value)
-    Spaces = Space.repeat(lower=1, reducer=lambda x, y: None)
-    RemoveBrackets = Terminal('<').repeat(upper=1).then(Word).skip(Terminal('>').repeat(upper=1))
-
-    Maint = (Terminal('maintained-by:') | Terminal('maint:'))
-    ResultOutcome = Terminal('failure:') | Terminal('success:') | Terminal('pending:') | Terminal('running:')
-    Ack = (Terminal('ack:') | Terminal('accept:') | Terminal('accepted:')).value(lambda x: ['accept'])
-    Nack = (Terminal('nack:') | Terminal('reject:') | Terminal('rejected:')).value(lambda x: ['reject'])
-    Review = (Terminal('review:') | Terminal('reviewed:')).value(lambda x: ['accept', 'reject'])
-
-    Timespan = Digit.repeat().then(charset('DWMYdwmy'), human_to_seconds)
-    Age = charset('<>').repeat(upper=1).then(Timespan, _make_filter_age)
-    AgeTerm = (Terminal('age:') | charset('<>', lookahead=True)).then(Age)
-
-    SimpleFieldTerm = (
-            field('from:', Word, 'sender__icontains') |
-            field('to:', Word, 'recipients__icontains') |
-            field('id:', RemoveBrackets, 'message_id') |
-            field('rfcmsg822id:', RemoveBrackets, 'message_id') |
-            Terminal('project:').then(Word).value(_make_filter_project) |
-            Terminal('subject:').then(Word).value(K) |
-            Terminal('queue:').then(Word, lambda _, q: SearchQueue([q], 'me')) |
-            Maint.then(Word).value(SearchMaint) |
-            (Ack | Nack | Review).then(Word, SearchQueue) |
-            ResultOutcome.then(Word, _make_filter_result))
 
+def _make_filter_is(cond):
+    if cond == "complete":
+        return _term(is_complete=True)
+    elif cond == "pull":
+        return SearchKeyword("PULL") & SearchTerm(
+            project=None,
+            query=Q(subject__contains="[PULL") | Q(subject__contains="[GIT PULL"),
+        )
+    elif cond == "reviewed":
+        return _term(is_reviewed=True)
+    elif cond in ("obsoleted", "old", "obsolete"):
+        return _term(is_obsolete=True)
+    elif cond == "applied":
+        return SearchSubquery(MessageResult, Q(name="git", status=Result.SUCCESS))
+    elif cond == "tested":
+        return _term(is_tested=True)
+    elif cond == "merged":
+        return _term(is_merged=True)
+    return None
+
+
+def _make_filter_not(cond):
+    q = _make_filter_is(cond)
+    if q:
+        q = ~q
+    return q
+
+
+def _make_subquery_result(term, **kwargs):
+    q = Q(name=term, **kwargs) | Q(name__startswith=term + ".", **kwargs)
+    return SearchSubquery(MessageResult, q)
+
+
+def _make_filter_result(kind, term):
+    if kind == "failure:":
+        return _make_subquery_result(term, status=Result.FAILURE)
+    if kind == "success:":
+        # What we want is "all results are successes", but the only way to
+        # express it is "there is a result and not (any result is not a success)".
+        return _make_subquery_result(term) & ~_make_subquery_result(
+            term, status__ne=Result.SUCCESS
+        )
+    if kind == "pending:":
+        return _make_subquery_result(term, status=Result.PENDING)
+    if kind == "running:":
+        return _make_subquery_result(term, status=Result.RUNNING)
+
+
+# Terms of the form PREFIX:WORD.  "age:", "has:", "id:" and "rfcmsg822id:"
+# are handled separately because they do not simply take a word.
+_FIELD_TERMS = {
+    "from:": lambda x: _term(sender__icontains=x),
+    "to:": lambda x: _term(recipients__icontains=x),
+    "project:": SearchProject,
+    "subject:": SearchKeyword,
+    "body:": SearchBody,
+    "queue:": lambda x: SearchQueue([x], "me"),
+    "maintained-by:": SearchMaint,
+    "maint:": SearchMaint,
+    "ack:": lambda x: SearchQueue(["accept"], x),
+    "accept:": lambda x: SearchQueue(["accept"], x),
+    "accepted:": lambda x: SearchQueue(["accept"], x),
+    "nack:": lambda x: SearchQueue(["reject"], x),
+    "reject:": lambda x: SearchQueue(["reject"], x),
+    "rejected:": lambda x: SearchQueue(["reject"], x),
+    "review:": lambda x: SearchQueue(["accept", "reject"], x),
+    "reviewed:": lambda x: SearchQueue(["accept", "reject"], x),
+    "failure:": lambda x: _make_filter_result("failure:", x),
+    "success:": lambda x: _make_filter_result("success:", x),
+    "pending:": lambda x: _make_filter_result("pending:", x),
+    "running:": lambda x: _make_filter_result("running:", x),
     # _make_filter_is and _make_filter_not return None if the RHS is not accepted
-    IsTerm = (
-            Terminal('is:').then(Word).value(_make_filter_is) |
-            Terminal('not:').then(Word).value(_make_filter_not)) \
-        .filter(lambda x: x is not None)
-
-    HasTerm = (
-            Terminal('has:replies').value(lambda x: Q(last_comment_date__isnull=False)) |
-            field('has:', Word, 'properties__name'))
-
-    Conjunction = Forward()
-    Disjunction = Forward()
-
-    BooleanTerm = (AgeTerm |
-            SimpleFieldTerm |
-            IsTerm |
-            HasTerm |
-            Conjunction |
-            Disjunction)
-
-    # + and - try to match an "is:" condition, and falls back to a keyword
-    PlusTerm = Terminal('+').then(
-        WordNoColon.value(_make_filter_is_or_keyword) | BooleanTerm)
-    MinusTerm = Terminal('-').then(
-        WordNoColon.value(_make_filter_is_or_keyword) | BooleanTerm).value(operator.invert)
-    BasicTerm = charset('+-!', reverse=True, lookahead=True).then(
-        WordNoColon.value(K) | BooleanTerm)
-    BangTerm = Terminal('!').then(BasicTerm).value(operator.invert)
-
-    AnyTerm = PlusTerm | MinusTerm | BangTerm | BasicTerm
-
-    Rest = Spaces.then(AnyTerm).repeat(value=SearchFalse(), reducer=operator.or_)
-    DisjunctionTerms = AnyTerm.then(Rest, reducer=operator.or_)
-
-    Rest = Spaces.then(AnyTerm).repeat(value=SearchTrue(), reducer=operator.and_)
-    ConjunctionTerms = AnyTerm.then(Rest, reducer=operator.and_)
-
-    Disjunction.is_(Terminal('{').then(DisjunctionTerms).skip(Terminal('}')))
-    Conjunction.is_(Terminal('(').then(ConjunctionTerms).skip(Terminal(')')))
-
-    EmptySearch = Space.repeat(value=SearchTrue(), reducer=lambda x, y: x)
-    return ConjunctionTerms | EmptySearch
-
-def parse(s, the_parser=__parser(Q)):
-    results = the_parser(s)
-    if not isinstance(results, compynator.core.Success):
-        #raise Exception("invalid search terms at '" + s + "'")
-        return SearchFalse()
-    result = next(iter(results))
-    if result.remain:
-        #raise Exception("invalid search terms at '" + result.remain + "'")
-        return SearchFalse()
-    return result.value
+    "is:": _make_filter_is,
+    "not:": _make_filter_not,
+}
+
+_AGE_UNITS = {"d": 86400, "w": 86400 * 7, "m": 86400 * 30, "y": 86400 * 365}
+
+
+class _Parser:
+    """Recursive descent parser for the syntax in SearchEngine's docstring.
+    Each method parses a term starting at @pos, and returns a tuple with
+    the SearchExpression and the position after the term, or None if the
+    term does not match."""
+
+    WORD = re.compile(r"[^ \t<>{}()]+")
+    PREFIX = re.compile(r"[^ \t<>{}():]*:")
+    SPACES = re.compile(r"[ \t]+")
+    AGE = re.compile(r"([<>]?)([0-9]+)([DWMYdwmy])")
+
+    def __init__(self, s):
+        self.s = s
+
+    def word(self, pos):
+        m = self.WORD.match(self.s, pos)
+        return (m.group(), m.end()) if m else None
+
+    def age(self, pos):
+        m = self.AGE.match(self.s, pos)
+        if not m:
+            return None
+        cond, n, unit = m.groups()
+        return SearchAge(cond == "<", int(n) * _AGE_UNITS[unit.lower()]), m.end()
+
+    def message_id(self, pos):
+        if self.s.startswith("<", pos):
+            pos += 1
+        r = self.word(pos)
+        if r and self.s.startswith(">", r[1]):
+            return r[0], r[1] + 1
+        return r
+
+    def field_term(self, pos):
+        c = self.s[pos : pos + 1]
+        if c == "(":
+            return self.group(pos + 1, operator.and_, SearchTrue(), ")")
+        if c == "{":
+            return self.group(pos + 1, operator.or_, SearchFalse(), "}")
+        if c and c in "<>":
+            return self.age(pos)
+        m = self.PREFIX.match(self.s, pos)
+        if not m:
+            return None
+        prefix, pos = m.group(), m.end()
+        if prefix == "age:":
+            return self.age(pos)
+        if prefix == "has:" and self.s.startswith("replies", pos):
+            return _term(last_comment_date__isnull=False), pos + 7
+        if prefix in ("id:", "rfcmsg822id:"):
+            r = self.message_id(pos)
+            return (_term(message_id=r[0]), r[1]) if r else None
+        r = self.word(pos)
+        if r is None:
+            return None
+        if prefix == "has:":
+            return _term(properties__name=r[0]), r[1]
+        make_term = _FIELD_TERMS.get(prefix)
+        term = make_term(r[0]) if make_term else None
+        return (term, r[1]) if term is not None else None
+
+    def keyword_or_field_term(self, pos, make_term):
+        r = self.word(pos)
+        if r and ":" not in r[0]:
+            return make_term(r[0]), r[1]
+        return self.field_term(pos)
+
+    def term(self, pos):
+        c = self.s[pos : pos + 1]
+        if not c:
+            return None
+        if c == "+" or c == "-":
+            # + and - try to match an "is:" condition, and fall back to a keyword
+            r = self.keyword_or_field_term(
+                pos + 1, lambda x: _make_filter_is(x) or SearchKeyword(x)
+            )
+            if r and c == "-":
+                return ~r[0], r[1]
+            return r
+        if c == "!":
+            if self.s[pos + 1 : pos + 2] in ("", "+", "-", "!"):
+                return None
+            r = self.keyword_or_field_term(pos + 1, SearchKeyword)
+            return (~r[0], r[1]) if r else None
+        return self.keyword_or_field_term(pos, SearchKeyword)
+
+    def terms(self, pos, op, empty):
+        r = self.term(pos)
+        if r is None:
+            return None
+        first, pos = r
+        rest = empty
+        while True:
+            m = self.SPACES.match(self.s, pos)
+            r = m and self.term(m.end())
+            if not r:
+                break
+            rest = op(rest, r[0])
+            pos = r[1]
+        return op(first, rest), pos
+
+    def group(self, pos, op, empty, close):
+        r = self.terms(pos, op, empty)
+        if r is None or not self.s.startswith(close, r[1]):
+            return None
+        return r[0], r[1] + 1
+
+    def parse(self):
+        r = self.terms(0, operator.and_, SearchTrue())
+        if r is None:
+            return SearchTrue() if self.s.strip(" \t") == "" else SearchFalse()
+        return r[0] if r[1] == len(self.s) else SearchFalse()
+
+
+@functools.lru_cache(maxsize=1024)
+def parse(s):
+    """Parse the search string @s.  The result is cached, so it must not be
+    modified."""
+    return _Parser(s).parse()
 
 
 class SearchEngine:
@@ -570,10 +667,14 @@ The two prefixes are equivalent.
 ### Search by text
 
  - Syntax: KEYWORD
+ - Syntax: subject:KEYWORD
+ - Syntax: body:KEYWORD
 
-Search text keyword in the email message. Example:
+Search text keyword in the subject of the series, or with "body:" in the
+cover letter and in the commit messages of the patches. Example:
 
     regression
+    body:deadlock
 
 ---
 
@@ -600,28 +701,47 @@ an "AND" using parentheses.
     def project(self):
         return self.q.get_project()
 
-    def search_series(self, queryset=None):
-        if queryset is None:
-            queryset = Message.objects.series_heads()
+    def fields(self):
+        return self.q.get_fields()
 
+    def _get_query(self):
         if connection.vendor == "postgresql":
-            have_keywords = len(self.q.get_all_keywords()) > 0
-            if have_keywords:
-                queryset = queryset.annotate(
-                    subjsearch=NonNullSearchVector("subject", config="english")
-                )
-            q = self.q.get_query(
+            return self.q.get_query(
                 self.user,
                 lambda x: SearchQuery(x, config="english"),
-                lambda x: Q(subjsearch=x),
+                lambda x: Q(search_document__subject_vector=x),
             )
         else:
-            q = self.q.get_query(
-                self.user, lambda x: Q(subject__icontains=x), lambda x: x
+            return self.q.get_query(
+                self.user, lambda x: _fts_match("subject", x), lambda x: x
             )
 
-        return queryset.filter(q)
+    def search_series(self, queryset=None):
+        if queryset is None:
+            queryset = Message.objects.series_heads()
+        return queryset.filter(self._get_query())
 
     def query_test_message(self, message):
         queryset = Message.objects.filter(id=message.id)
         return self.search_series(queryset=queryset).first()
+
+    @classmethod
+    def query_test_message_many(cls, engines, message):
+        """Evaluate several searches against a single message.  All the
+        searches are folded into a single SELECT statement, with one boolean
+        column per search.  Returns a list of booleans in the same order
+        as @engines."""
+        if not engines:
+            return []
+        queryset = Message.objects.filter(id=message.id)
+        columns = {}
+        for i, se in enumerate(engines):
+            columns["match_%d" % i] = Case(
+                When(se._get_query(), then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            )
+        row = queryset.annotate(**columns).values(*columns.keys()).first()
+        if row is None:
+            return [False] * len(engines)
+        return [row["match_%d" % i] for i in range(len(engines))]
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 Red Hat, Inc.
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+"""Values that do not change while the server runs, but are expensive to
+compute, for example because they require running an external program.
+Each is computed once per process, at startup or on first use."""
+
+_constants = {}
+_values = {}
+
+
+def declare_constant(name, compute):
+    """Declare a constant whose value is returned by compute()."""
+    assert name not in _constants
+    _constants[name] = compute
+
+
+def get_constant(name):
+    """Return the value of a constant that was previously declared."""
+    try:
+        return _values[name]
+    except KeyError:
+        value = _values[name] = _constants[name]()
+        return value
+
+
+def compute_constants():
+    """Compute the value of all the constants declared so far."""
+    for name in _constants:
+        get_constant(name)
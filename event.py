@@ -14,14 +14,42 @@ The patchew event framework
 
 _handlers = {}
 
+_deferred_handlers = {}
+
+_handler_filters = {}
+
 _events = {}
 
+_job_queue = None
+
+
+def handler_name(handler):
+    return "%s.%s" % (handler.__module__, handler.__qualname__)
+
 
-def register_handler(event, handler):
+def register_handler(event, handler, deferred=False, wants=None):
     """Register an event hander. It will be called when the event is emitted.
-    If event is None, all events will be dispatched to the handler"""
+    If event is None, all events will be dispatched to the handler.  If
+    deferred is True and a job queue is set, the handler is called later
+    by a worker process instead of in the emitter's process.  If wants is
+    given, it is called with the same arguments as the handler, and the
+    handler is neither called nor queued unless it returns True"""
     _handlers.setdefault(event, [])
-    _handlers[event].append(handler)
+    _handlers[event].append((handler, deferred))
+    if deferred:
+        _deferred_handlers[handler_name(handler)] = handler
+    if wants:
+        _handler_filters[handler] = wants
+
+
+def set_job_queue(enqueue):
+    """Pass the calls to deferred handlers to enqueue(name, event, params)
+    instead of making them.  enqueue() returns False if the call cannot be
+    queued, for example because a parameter cannot be stored, and then the
+    handler is called immediately.  If enqueue is None, all handlers are
+    called immediately."""
+    global _job_queue
+    _job_queue = enqueue
 
 
 def declare_event(event, **params):
@@ -37,8 +65,14 @@ def emit_event(event, **params):
     assert event in _events
     for keyword in params:
         assert keyword in _events[event]
-    for handler in _handlers.get(event, []) + _handlers.get(None, []):
+    for handler, deferred in _handlers.get(event, []) + _handlers.get(None, []):
         try:
+            wants = _handler_filters.get(handler)
+            if wants and not wants(event, **params):
+                continue
+            if deferred and _job_queue:
+                if _job_queue(handler_name(handler), event, params):
+                    continue
             handler(event, **params)
         except:
             import traceback
@@ -46,5 +80,11 @@ def emit_event(event, **params):
             traceback.print_exc()
 
 
+def run_deferred_handler(name, event, params):
+    """Call the deferred handler @name, which was queued when @event was
+    emitted with @params.  Unlike emit_event(), let exceptions propagate."""
+    _deferred_handlers[name](event, **params)
+
+
 def get_events_info():
     return _events.copy()
@@ -12,10 +12,36 @@ import email
 import email.utils
 import email.header
 import datetime
+import functools
 import re
 from rest_framework.fields import DateTimeField
 
 
+# Lines of the diffstat that "git format-patch" writes after the "---" line
+_DIFF_STAT_RE = re.compile(
+    "|".join(
+        "(?:%s)" % p
+        for p in [
+            r"\S*\s*\|\s*[0-9]*( \+*-*)?$",
+            r"\S*\s*\|\s*Bin",
+            r"\S* => \S*\s*|\s*[0-9]* \+*-*$",
+            r"[0-9]* files changed",
+            r"1 file changed",
+            r"(create|delete) mode [0-7]+",
+            r"mode change [0-7]+",
+            r"rename .*\([0-9]+%\)$",
+            r"copy .*\([0-9]+%\)$",
+            r"rewrite .*\([0-9]+%\)$",
+        ]
+    )
+)
+_DIFF_START_RE = re.compile(r"--- \S")
+_DIFF_GIT_RE = re.compile(r"diff --git a/.* b/(.*)$")
+# Body lines that an mboxrd writer quoted so that they are not taken for
+# message separators
+_QUOTED_FROM_RE = re.compile(r">+From ")
+
+
 def _parse_header(header):
     r = ""
     for h, c in email.header.decode_header(header):
@@ -60,17 +86,71 @@ def decode_payload(m):
             raise
 
 
+def split_mbox(data):
+    """Split the text of an mbox file into its messages.  Text that does
+    not start with a "From " line is returned as a single message.
+
+    Only "From " lines that follow an empty line separate messages, and
+    the mboxrd quoting of body lines (">From ", ">>From ", ...) is undone,
+    so that messages with "From " lines in their body survive the round
+    trip."""
+    if not data.startswith("From "):
+        yield data
+        return
+    lines = None
+    prev = ""
+    for l in data.split("\n"):
+        if l.startswith("From ") and prev == "":
+            if lines:
+                yield "\n".join(lines)
+            lines = []
+        elif _QUOTED_FROM_RE.match(l):
+            lines.append(l[1:])
+        else:
+            lines.append(l)
+        prev = l
+    if lines:
+        yield "\n".join(lines)
+
+
+def _cached(func):
+    """Compute the result of an MboxMessage method only once per message
+    and set of arguments.  Lists are copied, so that callers can modify them."""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        key = (func.__name__, args, tuple(kwargs.items()))
+        try:
+            r = self._cache[key]
+        except KeyError:
+            r = self._cache[key] = func(self, *args, **kwargs)
+        return list(r) if isinstance(r, list) else r
+
+    return wrapper
+
+
 class MboxMessage:
-    """Helper class to process mbox"""
+    """Helper class to process mbox.  The message is parsed on first use, and
+    headers and body are only decoded once."""
+
+    __slots__ = ("_parsed", "_status", "_mbox", "_cache")
 
     def __init__(self, m):
-        self._m = email.message_from_string(m)
+        self._parsed = None
         self._status = {}
         self._mbox = m
+        self._cache = {}
+
+    @property
+    def _m(self):
+        if self._parsed is None:
+            self._parsed = email.message_from_string(self._mbox)
+        return self._parsed
 
     def get_mbox(self):
         return self._mbox
 
+    @_cached
     def get_subject(
         self, upper=False, strip_tags=False, suppress_re=None, strip_re=False
     ):
@@ -101,6 +181,7 @@ class MboxMessage:
                 return "Re: ..."
         return r
 
+    @_cached
     def get_from(self, text=False):
         name, addr = parse_address(self._m["from"])
         name = name or addr
@@ -108,6 +189,7 @@ class MboxMessage:
             return _addr_fmt_text(name, addr)
         return name, addr
 
+    @_cached
     def _get_addr_list(self, field, text):
         ret = []
         f = self._m.get_all(field, [])
@@ -147,6 +229,7 @@ class MboxMessage:
         msgid = msgid.replace("/", "._2F")
         return msgid
 
+    @_cached
     def get_in_reply_to(self):
         msgid = self._m["in-reply-to"]
         if not msgid:
@@ -155,6 +238,7 @@ class MboxMessage:
                 msgid = refs.split()[-1]
         return self.clean_message_id(msgid)
 
+    @_cached
     def get_date(self, timestamp=False):
         tup = email.utils.parsedate_tz(self._m["date"])
         if tup:
@@ -163,9 +247,11 @@ class MboxMessage:
                 return stamp
             return datetime.datetime.utcfromtimestamp(stamp)
 
+    @_cached
     def get_message_id(self):
         return self.clean_message_id(self._m["message-id"])
 
+    @_cached
     def get_prefixes(self, upper=False):
         """Return tags extracted from the leading "[XXX] [YYY ZZZ]... in subject"""
         r = []
@@ -178,6 +264,7 @@ class MboxMessage:
                 s = s[s.find("]") + 1 :].strip()
         return r
 
+    @_cached
     def get_version(self):
         v = 1
         for tag in self.get_prefixes(True):
@@ -195,6 +282,7 @@ class MboxMessage:
         s = set([x.upper() for x in tags])
         return s.intersection(self.get_prefixes(upper=True))
 
+    @_cached
     def get_body(self):
         def _get_message_text(m):
             payload = m.get_payload(decode=not self._m.is_multipart())
@@ -209,6 +297,7 @@ class MboxMessage:
         body = _get_message_text(self._m)
         return body
 
+    @_cached
     def get_preview(self, maxchar=1000):
         r = ""
         quote = False
@@ -224,6 +313,33 @@ class MboxMessage:
                 break
         return r
 
+    @_cached
+    def get_diff_stat(self):
+        """Return the diffstat of the patch, or of the series if this is a
+        cover letter, or an empty string if there is none"""
+        cur = []
+        ret = []
+        for l in self.get_body().splitlines():
+            line = l.strip()
+            if _DIFF_STAT_RE.match(line):
+                cur.append(line)
+                ret = cur
+            else:
+                cur = []
+                if ret and _DIFF_START_RE.match(line):
+                    break
+        return "\n".join(ret)
+
+    @_cached
+    def get_files(self):
+        """Return the names of the files that the patch modifies"""
+        files = []
+        for l in self.get_body().splitlines():
+            match = _DIFF_GIT_RE.match(l)
+            if match and match.group(1) not in files:
+                files.append(match.group(1))
+        return files
+
     def _find_line(self, pattern):
         rexp = re.compile(pattern)
         for l in self.get_body().splitlines():
@@ -239,6 +355,7 @@ class MboxMessage:
         else:
             return None
 
+    @_cached
     def get_num(self):
         cur, total = None, None
         for tag in self.get_prefixes():
@@ -272,6 +389,7 @@ class MboxMessage:
                 i += 1
         return i == len(lines)
 
+    @_cached
     def is_patch(self):
         """Return true if the email body is a patch"""
         body = self.get_body()
@@ -285,6 +403,7 @@ class MboxMessage:
             or self._has_lines(body, "---", "diff ", "rename from", "rename to")
         )
 
+    @_cached
     def is_series_head(self):
         """Create and return a Series from Message if it is one, otherwise
         return None"""
@@ -42,17 +42,36 @@ class PatchewModule:
     default_config = ""  # The default config string
     project_config_schema = None
 
+    _config_version = None
+
+    def _load_config(self):
+        # The configuration can be updated in-flight by another process, so
+        # check the version in the shared cache, which module_config_changed()
+        # resets, and only read the DB again if it has changed.
+        # The INI parsing is left to get_config_obj(), because some modules
+        # (e.g. footer) do not use the INI format.
+        version = _get_config_version(self.name)
+        if version != self._config_version:
+            self._model = _module_init_config(self.__class__)
+            self._config = None
+            self._config_version = version
+
     def get_model(self):
-        # ALways read from DB to accept configuration update in-flight
-        return _module_init_config(self.__class__)
+        self._load_config()
+        return self._model
 
     def get_config_raw(self):
         return self.get_model().config or ""
 
     def get_config_obj(self):
-        config = configparser.ConfigParser()
-        config.read_string(self.get_config_raw())
-        return config
+        """Return the parsed configuration.  The object is shared by all
+        callers and must not be modified."""
+        self._load_config()
+        if self._config is None:
+            config = configparser.ConfigParser()
+            config.read_string(self._model.config or "")
+            self._config = config
+        return self._config
 
     def get_config(self, section, field, getmethod="get", default=None):
         cfg = self.get_config_obj()
@@ -185,6 +204,23 @@ def _module_init_config(cls):
     return mod
 
 
+def _config_version_key(name):
+    return "module-config:" + name
+
+
+def _get_config_version(name):
+    from api.models import get_shared_version
+
+    return get_shared_version(_config_version_key(name))
+
+
+def module_config_changed(name):
+    """Tell all processes to read the configuration of module @name again"""
+    from api.models import reset_shared_version
+
+    reset_shared_version(_config_version_key(name))
+
+
 def load_modules():
     _module_path = settings.MODULE_DIR
     sys.path.append(_module_path)
@@ -17,9 +17,13 @@ from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_POST
 from django.conf import settings
 from mod import PatchewModule
+import functools
 import smtplib
 import email
 import email.utils
+import sys
+import threading
+import time
 import uuid
 from api.models import Message, Project
 from event import register_handler, get_events_info
@@ -38,8 +42,85 @@ from = your@email.com
 
 
 class DebugSMTP:
-    def sendmail(*args):
-        print("SMPT: debug mode, not sending\n" + "\n".join([str(x) for x in args]))
+    """Stand-in for smtplib.SMTP that is used in debug mode.  It prints the
+    emails to @output instead of sending them, or drops them if @output is
+    None, so that it can also be used for benchmarks."""
+
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.sent = 0
+
+    def sendmail(self, *args):
+        self.sent += 1
+        if self.output:
+            print(
+                "SMPT: debug mode, not sending\n" + "\n".join([str(x) for x in args]),
+                file=self.output,
+            )
+
+    def noop(self):
+        return (250, b"OK")
+
+    def quit(self):
+        pass
+
+
+class SMTPPool:
+    """SMTP connections that are kept open between emails, so that sending
+    an email does not require a new connection and login.  Connections are
+    checked with NOOP before they are reused, and closed after being idle
+    for MAX_IDLE seconds."""
+
+    MAX_IDLE = 60
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.lock = threading.Lock()
+        # (key, smtp, last use)
+        self.idle = []
+
+    def _close(self, smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            pass
+
+    def _get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            expired = [
+                x for x in self.idle if x[0] != key or x[2] < now - self.MAX_IDLE
+            ]
+            self.idle = [x for x in self.idle if x not in expired]
+            smtp = self.idle.pop()[1] if self.idle else None
+        for x in expired:
+            self._close(x[1])
+        if smtp:
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp
+            except Exception:
+                pass
+            self._close(smtp)
+        return self.connect()
+
+    def send(self, key, from_addr, messages):
+        """Send the (recipients, text) pairs in @messages over a connection
+        for @key, which identifies the server configuration"""
+        smtp = self._get(key)
+        try:
+            for recipients, text in messages:
+                smtp.sendmail(from_addr, recipients, text)
+        except Exception:
+            self._close(smtp)
+            raise
+        with self.lock:
+            self.idle.append((key, smtp, time.monotonic()))
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_template(text):
+    return Template(text)
 
 
 class EmailModule(PatchewModule):
@@ -49,7 +130,8 @@ class EmailModule(PatchewModule):
 Documentation
 -------------
 
-Email information is configured in "INI" style:
+Email information is configured in "INI" style.  If "debug = True" is
+set in the smtp section, emails are printed instead of being sent:
 
 """
         + _default_config
@@ -135,7 +217,16 @@ Email information is configured in "INI" style:
     )
 
     def __init__(self):
-        register_handler(None, self.on_event)
+        # Where DebugSMTP prints the emails
+        self.debug_output = sys.stdout
+        self._smtp_pool = SMTPPool(self._get_smtp)
+        register_handler(None, self.on_event, deferred=True, wants=self.wants_event)
+
+    def _get_smtp_key(self):
+        return tuple(
+            self.get_config("smtp", x)
+            for x in ("server", "port", "ssl", "auth", "username", "password", "debug")
+        )
 
     def _get_smtp(self):
         server = self.get_config("smtp", "server")
@@ -143,8 +234,8 @@ Email information is configured in "INI" style:
         username = self.get_config("smtp", "username")
         password = self.get_config("smtp", "password")
         ssl = self.get_config("smtp", "ssl", "getboolean")
-        if settings.DEBUG:
-            return DebugSMTP()
+        if settings.DEBUG or self.get_config("smtp", "debug", "getboolean"):
+            return DebugSMTP(self.debug_output)
         elif ssl:
             smtp = smtplib.SMTP_SSL(server, port)
         else:
@@ -153,13 +244,27 @@ Email information is configured in "INI" style:
             smtp.login(username, password)
         return smtp
 
-    def _send_series_recurse(self, sendmethod, s):
+    def _send_series_recurse(self, sendmethod, s, thread=None):
+        if thread is None:
+            thread = s.get_thread_replies()
         sendmethod(s)
-        for i in s.get_replies():
-            self._send_series_recurse(sendmethod, i)
+        for i in thread[s.message_id]:
+            self._send_series_recurse(sendmethod, i, thread)
 
     def _smtp_send(self, to, cc, message):
+        self._smtp_send_many([(to, cc, message)])
+
+    def _smtp_send_many(self, emails):
+        """Send the (to, cc, message) triples in @emails over a single
+        connection"""
         from_addr = self.get_config("smtp", "from")
+        messages = [
+            self._prepare_message(from_addr, to, cc, message)
+            for to, cc, message in emails
+        ]
+        self._smtp_pool.send(self._get_smtp_key(), from_addr, messages)
+
+    def _prepare_message(self, from_addr, to, cc, message):
         message["Resent-From"] = message["From"]
         for k, v in [("From", from_addr), ("To", to), ("Cc", cc)]:
             if not v:
@@ -170,7 +275,6 @@ Email information is configured in "INI" style:
                 message.replace_header(k, v)
             except KeyError:
                 message[k] = v
-        smtp = self._get_smtp()
         recipients = []
         for x in [to, cc]:
             if not x:
@@ -179,7 +283,7 @@ Email information is configured in "INI" style:
                 recipients += [x]
             elif isinstance(x, list):
                 recipients += x
-        smtp.sendmail(from_addr, recipients, message.as_string())
+        return recipients, message.as_string()
 
     @method_decorator(require_POST)
     def www_view_email_bounce(self, request, message_id):
@@ -189,12 +293,15 @@ Email information is configured in "INI" style:
         if not m:
             raise Http404("Series not found: " + message_id)
 
+        emails = []
+
         def send_one(m):
             msg = m.get_mbox()
             message = email.message_from_string(msg)
-            self._smtp_send(request.user.email, None, message)
+            emails.append((request.user.email, None, message))
 
         self._send_series_recurse(send_one, m)
+        self._smtp_send_many(emails)
         return HttpResponse("email bounced")
 
     def www_url_hook(self, urlpatterns):
@@ -230,13 +337,12 @@ Email information is configured in "INI" style:
             if sec.startswith("mail ") and conf.get(sec, "event") == event:
                 yield sec
 
-    def _send_email(self, to, cc, headers, body):
+    def _make_email(self, headers, body):
         message = email.message.Message()
         for k, v in headers.items():
             message[k] = v
         message.set_payload(body, charset="utf-8")
-
-        self._smtp_send(to, cc, message)
+        return message
 
     def gen_message_id(self):
         return "<%s@patchew.org>" % uuid.uuid1()
@@ -244,22 +350,34 @@ Email information is configured in "INI" style:
     def get_notifications(self, project):
         return self.get_project_config(project).get("notifications", {})
 
+    def _get_event_objects(self, params):
+        # Return the project and the message that an event is about
+        for v in list(params.values()):
+            if isinstance(v, Message):
+                return v.project, v
+            elif isinstance(v, Project):
+                return v, None
+        return None, None
+
+    def wants_event(self, event, **params):
+        """Return whether the project of the event has a notification for
+        it, so that events without one do not go through the job queue"""
+        po, mo = self._get_event_objects(params)
+        if not po:
+            return False
+        return any(
+            nt["enabled"] and nt["event"] == event
+            for nt in self.get_notifications(po).values()
+        )
+
     def on_event(self, event, **params):
         class EmailCancelled(Exception):
             pass
 
-        po = None
-        mo = None
-        for v in list(params.values()):
-            if isinstance(v, Message):
-                mo = v
-                po = mo.project
-                break
-            elif isinstance(v, Project):
-                po = v
-                break
+        po, mo = self._get_event_objects(params)
         if not po:
             return
+        emails = []
         for nt in list(self.get_notifications(po).values()):
             headers = {}
             if not nt["enabled"]:
@@ -275,10 +393,10 @@ Email information is configured in "INI" style:
             ctx = Context(params, autoescape=False)
 
             try:
-                subject = Template(nt["subject_template"]).render(ctx).strip()
-                body = Template(nt["body_template"]).render(ctx).strip()
-                to = [x.strip() for x in Template(nt["to"]).render(ctx).strip().split()]
-                cc = [x.strip() for x in Template(nt["cc"]).render(ctx).strip().split()]
+                subject = _compile_template(nt["subject_template"]).render(ctx).strip()
+                body = _compile_template(nt["body_template"]).render(ctx).strip()
+                to = _compile_template(nt["to"]).render(ctx).split()
+                cc = _compile_template(nt["cc"]).render(ctx).split()
             except EmailCancelled:
                 continue
             if mo:
@@ -302,7 +420,9 @@ Email information is configured in "INI" style:
                 continue
             headers["Subject"] = subject
             headers["Message-ID"] = email.utils.make_msgid()
-            self._send_email(to, cc, headers, body)
+            emails.append((to, cc, self._make_email(headers, body)))
+        if emails:
+            self._smtp_send_many(emails)
 
     def prepare_project_hook(self, request, project):
         if not project.maintained_by(request.user):
@@ -98,8 +98,8 @@ class GitModule(PatchewModule):
         subprocess.check_output(["git", "version"])
         declare_event("ProjectGitUpdate", project="the updated project name")
         declare_event("SeriesApplied", series="the object of applied series")
-        register_handler("SeriesComplete", self.on_series_update)
-        register_handler("TagsUpdate", self.on_tags_update)
+        register_handler("SeriesComplete", self.on_series_update, deferred=True)
+        register_handler("TagsUpdate", self.on_tags_update, deferred=True)
 
     def mark_as_pending_apply(self, series, data={}):
         r = series.git_result or series.create_result(name="git")
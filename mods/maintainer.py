@@ -16,18 +16,63 @@ from django.http import (
     Http404,
     HttpResponse,
     HttpResponseBadRequest,
+    StreamingHttpResponse,
 )
 from django.urls import reverse
 from django.utils.decorators import method_decorator
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from mod import PatchewModule, www_authenticated_op
-from api.models import Message, QueuedSeries, Project, WatchedQuery
+from api.models import Message, QueuedSeries, Project, WatchedQuery, iter_join
 from django.shortcuts import render
 from api.search import SearchEngine
 from event import declare_event, register_handler, emit_event
 from www.views import render_series_list_page
 
+# Searches that look at these fields can change result without any change
+# to the series itself (e.g. "age:<1w"), so they are always re-evaluated.
+VOLATILE_FIELDS = {"date"}
+
+
+class WatchedQueryIndex:
+    """Per-process cache of parsed watched queries.  Each query is parsed
+    once and kept together with the set of fields it looks at, so that
+    an event only needs to re-evaluate the queries it can affect."""
+
+    def __init__(self):
+        self._compiled = {}
+
+    def _compile(self, wq):
+        entry = self._compiled.get(wq.id)
+        if entry is None or entry[0] != wq.query:
+            se = SearchEngine([wq.query], wq.user)
+            entry = (wq.query, se, se.fields())
+            self._compiled[wq.id] = entry
+        return entry
+
+    def affected(self, changed_fields=None):
+        """Return a list of (WatchedQuery, SearchEngine) tuples for the
+        users that have a query whose result can be flipped by a change to
+        @changed_fields.  All the queries of those users are returned,
+        because a series is watched if any of them matches.  If
+        @changed_fields is None, all watched queries are returned."""
+        entries = []
+        users = set()
+        seen = set()
+        for wq in WatchedQuery.objects.select_related("user"):
+            seen.add(wq.id)
+            query, se, fields = self._compile(wq)
+            se.user = wq.user
+            entries.append((wq, se))
+            if changed_fields is None or fields & (changed_fields | VOLATILE_FIELDS):
+                users.add(wq.user_id)
+        ret = [(wq, se) for wq, se in entries if wq.user_id in users]
+        # Worker threads can share the index, so another thread may have
+        # dropped the entry already
+        for stale in self._compiled.keys() - seen:
+            self._compiled.pop(stale, None)
+        return ret
+
 
 class MaintainerModule(PatchewModule):
     """Project maintainer related tasks"""
@@ -35,12 +80,13 @@ class MaintainerModule(PatchewModule):
     name = "maintainer"
 
     def __init__(self):
-        register_handler("ResultUpdate", self.on_result_update)
-        register_handler("MessageQueued", self.on_queue_change)
-        register_handler("MessageDropped", self.on_queue_change)
-        register_handler("SeriesComplete", self.on_series_complete)
-        register_handler("SeriesMerged", self.on_series_merged)
-        register_handler("SeriesReviewed", self.on_series_reviewed)
+        self.watched_index = WatchedQueryIndex()
+        register_handler("ResultUpdate", self.on_result_update, deferred=True)
+        register_handler("MessageQueued", self.on_queue_change, deferred=True)
+        register_handler("MessageDropped", self.on_queue_change, deferred=True)
+        register_handler("SeriesComplete", self.on_series_complete, deferred=True)
+        register_handler("SeriesMerged", self.on_series_merged, deferred=True)
+        register_handler("SeriesReviewed", self.on_series_reviewed, deferred=True)
         declare_event(
             "MessageQueued",
             message="Message added",
@@ -67,24 +113,40 @@ class MaintainerModule(PatchewModule):
         events = [{"user": q.user, "message": q.message, "queue": q} for q in query]
         query.delete()
         for ev in events:
+            # Like Model.delete(), so that the event is not queued for a
+            # worker that would not find the row
+            ev["queue"].pk = None
             emit_event("MessageDropped", **ev)
 
     def _drop_from_queue(self, user, msgs, queue):
         query = QueuedSeries.objects.filter(user=user, message__in=msgs, name=queue)
         self._drop_all_from_queue(query)
 
-    def _update_watch_queue(self, series):
-        for wq in WatchedQuery.objects.all():
-            se = SearchEngine([wq.query], wq.user)
-            if se.query_test_message(series):
-                self._add_to_queue(wq.user, [series], "watched")
-            else:
-                self._drop_from_queue(wq.user, [series], "watched")
+    def _update_watch_queue(self, series, changed_fields=None):
+        candidates = self.watched_index.affected(changed_fields)
+        if not candidates:
+            return
+        matches = SearchEngine.query_test_message_many(
+            [se for wq, se in candidates], series
+        )
+        wanted = {}
+        for (wq, se), match in zip(candidates, matches):
+            wanted[wq.user] = wanted.get(wq.user, False) or match
+        watched = QueuedSeries.objects.filter(message=series, name="watched")
+        queued_users = set(watched.values_list("user_id", flat=True))
+        to_drop = []
+        for user, match in wanted.items():
+            if match and user.id not in queued_users:
+                self._add_to_queue(user, [series], "watched")
+            elif not match and user.id in queued_users:
+                to_drop.append(user.id)
+        if to_drop:
+            self._drop_all_from_queue(watched.filter(user_id__in=to_drop))
 
     def on_queue_change(self, evt, user, message, queue):
         # Handle changes to e.g. "-nack:me"
-        if queue != "watched":
-            self._update_watch_queue(message)
+        if queue.name != "watched":
+            self._update_watch_queue(message, {"queues"})
 
     def on_result_update(self, evt, obj, old_status, result):
         if not isinstance(obj, Message):
@@ -92,14 +154,14 @@ class MaintainerModule(PatchewModule):
         if result == obj.git_result and result.status != result.PENDING:
             # By the time of git result update we should have calculated
             # maintainers so redo the watched queue
-            self._update_watch_queue(obj)
+            self._update_watch_queue(obj, {"results", "maintainers"})
 
     def on_series_complete(self, evt, project, series):
         self._update_watch_queue(series)
 
     def on_series_reviewed(self, evt, series):
         # Handle changes to "is:reviewed"
-        self._update_watch_queue(series)
+        self._update_watch_queue(series, {"is_reviewed"})
 
     def on_series_merged(self, evt, project, series):
         # This is a bit of a hack for now.  We probably should hide merged
@@ -110,7 +172,7 @@ class MaintainerModule(PatchewModule):
         )
         self._drop_all_from_queue(query)
         # Handle changes to "is:merged"
-        self._update_watch_queue(series)
+        self._update_watch_queue(series, {"is_merged"})
 
     def _update_review_state(self, request, project, message_id, accept):
         msg = Message.objects.find_series(message_id, project)
@@ -209,11 +271,14 @@ class MaintainerModule(PatchewModule):
 
     def www_download_queue_mbox(self, request, project, name):
         query = self.query_queue(request, project, name).filter(is_complete=True)
-        mbox_list = []
-        for s in query:
-            mbox_list.extend(s.get_mboxes_with_tags())
-        mbox = b"\n".join(mbox_list)
-        return HttpResponse(mbox, content_type="text/plain")
+
+        def mboxes():
+            for s in query.iterator():
+                yield from s.get_mboxes_with_tags()
+
+        return StreamingHttpResponse(
+            iter_join(b"\n", mboxes()), content_type="text/plain"
+        )
 
     def www_view_queue(self, request, project, name):
         query = self.query_queue(request, project, name, can_be_empty=True)
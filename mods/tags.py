@@ -13,6 +13,7 @@ from mbox import addr_db_to_rest, parse_address
 from event import register_handler, emit_event, declare_event
 from api.models import Message
 from api.rest import PluginMethodField
+from www.cache import invalidate
 
 from django.urls import reverse
 from django.utils.html import format_html
@@ -56,7 +57,7 @@ series cover letter, patch mail body and their replies.
     default_config = _default_config
 
     def __init__(self):
-        register_handler("MessageAdded", self.on_message_added)
+        register_handler("MessageAdded", self.on_message_added, deferred=True)
         declare_event("TagsUpdate", series="message object that is updated")
         declare_event(
             "SeriesReviewed",
@@ -71,19 +72,73 @@ series cover letter, patch mail body and their replies.
             [x.strip() for x in tagsconfig.split(",") if x.strip()] + BUILT_IN_TAGS
         )
 
-    def update_tags(self, s):
-        old = s.tags
-        new = self.look_for_tags(s, s)
-        if set(old) != set(new):
-            s.tags = list(set(new))
-            s.save()
-            return True
+    def _get_tag_owner(self, m, messages):
+        """Return the patch or series head whose tags include those
+        of @m, or None if it is not known yet"""
+        while m and not m.is_patch and not m.is_series_head:
+            m = messages.get(m.in_reply_to)
+        return m
+
+    def update_tags(self, series, recompute=False):
+        """Parse the tags of the messages in @series that have not been
+        parsed yet, and add them to the tags of the patch or cover letter
+        that they reply to.  If @recompute is True, parse all messages again
+        and rebuild the tags from scratch.  Return the patches of the series
+        and whether any tags changed."""
+        tag_prefixes = self.get_tag_prefixes()
+        thread = series.get_thread_replies()
+        messages = {m.message_id: m for replies in thread.values() for m in replies}
+        # Use the caller's instance, so that it sees the updates
+        messages[series.message_id] = series
+
+        new_tags = {}
+        changed = set()
+        for m in messages.values():
+            if m != series and m.series_head_id != series.id:
+                continue
+            if m.body_tags is not None and not recompute:
+                continue
+            m.body_tags = self.parse_message_tags(m, tag_prefixes)
+            changed.add(m.message_id)
+            owner = self._get_tag_owner(m, messages)
+            if owner:
+                new_tags.setdefault(owner.message_id, set()).update(m.body_tags)
+
+        updated = False
+        for msgid, tags in new_tags.items():
+            owner = messages[msgid]
+            if not recompute:
+                tags = tags.union(owner.tags)
+            if set(owner.tags) == tags:
+                continue
+            if owner == series:
+                for tag in tags.difference(owner.tags):
+                    if tag.lower().startswith(SUPERSEDES_PREFIX.lower()):
+                        self.process_supersedes(series, tag)
+            owner.tags = list(tags)
+            changed.add(msgid)
+            updated = True
+        if series.message_id in changed:
+            changed.remove(series.message_id)
+            series.save()
+        Message.objects.bulk_update(
+            [messages[x] for x in changed], ["body_tags", "tags"]
+        )
+
+        c, n = series.get_num()
+        if c == n and series.is_patch:
+            patches = [series]
+        else:
+            patches = [m for m in thread[series.message_id] if m.is_patch]
+        return patches, updated
 
     def on_message_added(self, event, message):
         series = message.get_series_head()
         if not series:
             return
+        self.update_series(series)
 
+    def update_series(self, series, recompute=False):
         def newer_than(m1, m2):
             if m1 == m2:
                 return False
@@ -98,11 +153,7 @@ series cover letter, patch mail body and their replies.
                 return False
             return m1.date > m2.date
 
-        updated = self.update_tags(series)
-
-        for p in series.get_patches():
-            updated = updated or self.update_tags(p)
-
+        patches, updated = self.update_tags(series, recompute)
         reviewers = set()
         num_reviewed = 0
 
@@ -114,7 +165,7 @@ series cover letter, patch mail body and their replies.
                 ret.add(parse_address(rev_tag[len(REV_BY_PREFIX) :]))
             return ret
 
-        for p in series.get_patches():
+        for p in patches:
             first = True
             this_reviewers = _find_reviewers(p)
             if this_reviewers:
@@ -126,9 +177,7 @@ series cover letter, patch mail body and their replies.
         reviewers = reviewers.union(series_reviewers)
         if num_reviewed == series.get_num()[1] or series_reviewers:
             need_event = not series.is_reviewed
-            series.is_reviewed = True
-            series.save()
-            series.set_property("reviewers", list(reviewers))
+            series.update_properties({"reviewers": list(reviewers)}, is_reviewed=True)
             if need_event:
                 emit_event("SeriesReviewed", series=series)
         if updated:
@@ -138,9 +187,13 @@ series cover letter, patch mail body and their replies.
             series.topic.latest = series
             series.topic.save()
         for m in series.get_alternative_revisions():
-            if not m.is_obsolete and m.topic.latest != m:
-                m.is_obsolete = True
+            # A newer revision can be imported before the handlers for an
+            # older one run, and be marked obsolete by them; set it back.
+            is_obsolete = m.topic.latest != m
+            if m.is_obsolete != is_obsolete:
+                m.is_obsolete = is_obsolete
                 m.save()
+                invalidate(project=m.project, series=m)
 
     def process_supersedes(self, series, tag):
         old = Message.objects.find_series_from_tag(tag, series.project)
@@ -153,32 +206,18 @@ series cover letter, patch mail body and their replies.
                 old.topic.save()
             old.is_obsolete = True
             old.save()
+            invalidate(project=old.project, series=old)
             series.topic.merge_with(old.topic)
 
-    def parse_message_tags(self, series, m, tag_prefixes):
+    def parse_message_tags(self, m, tag_prefixes):
         r = []
         for l in m.get_body().splitlines():
             line = l.lower()
             for p in tag_prefixes:
                 if line.startswith(p.lower()):
-                    if line.startswith("supersedes:"):
-                        self.process_supersedes(series, l)
                     r.append(l)
         return r
 
-    def _look_for_tags(self, series, m, tag_prefixes):
-        # Incorporate tags from non-patch replies
-        r = self.parse_message_tags(series, m, tag_prefixes)
-        for x in m.get_replies():
-            if x.is_patch:
-                continue
-            r += self._look_for_tags(series, x, tag_prefixes)
-        return r
-
-    def look_for_tags(self, series, m):
-        tag_prefixes = self.get_tag_prefixes()
-        return self._look_for_tags(series, m, tag_prefixes)
-
     def prepare_message_hook(self, request, message, for_message_view):
         if not message.is_series_head:
             return
@@ -11,7 +11,8 @@
 from django.conf.urls import url
 from django.http import HttpResponseForbidden, Http404, HttpResponseRedirect
 from django.core.exceptions import PermissionDenied
-from django.db.models import Q
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
 from django.urls import reverse
 from django.utils.html import format_html
 from django.utils.decorators import method_decorator
@@ -144,23 +145,26 @@ class TestingModule(PatchewModule):
             if "tester" in result.data:
                 po = obj if isinstance(obj, Project) else obj.project
                 _instance.tester_check_in(po, result.data["tester"])
+            properties = {}
+            fields = {}
             if not self.get_testing_results(
                 obj, status__in=(Result.PENDING, Result.RUNNING)
             ).exists():
-                obj.set_property("testing.tested-head", result.data["head"])
+                properties["testing.tested-head"] = result.data["head"]
                 if isinstance(obj, Message):
-                    obj.is_tested = True
-                    obj.save()
-                    obj.set_property("testing.tested-base", self.get_msg_base_tags(obj))
+                    fields["is_tested"] = True
+                    properties["testing.tested-base"] = self.get_msg_base_tags(obj)
             if isinstance(obj, Project):
                 # cache the last result so that badges are not affected by RUNNING state
-                failures = obj.get_property("testing.failures", [])
+                failures = list(obj.get_property("testing.failures", []))
                 if result.status == result.SUCCESS and result.name in failures:
                     failures.remove(result.name)
-                    obj.set_property("testing.failures", list(failures))
+                    properties["testing.failures"] = failures
                 if result.status == result.FAILURE and result.name not in failures:
                     failures.append(result.name)
-                    obj.set_property("testing.failures", list(failures))
+                    properties["testing.failures"] = failures
+            if properties:
+                obj.update_properties(properties, **fields)
 
         if result.name != "git":
             return
@@ -206,7 +210,7 @@ class TestingModule(PatchewModule):
             is_tested = len(all_tests) and len(done_tests) == len(all_tests)
             if is_tested != obj.is_tested:
                 obj.is_tested = is_tested
-                obj.save()
+                obj.save(update_fields=["is_tested"])
 
     def project_recalc_pending_tests(self, project):
         self.recalc_pending_tests(project)
@@ -220,10 +224,10 @@ class TestingModule(PatchewModule):
             self.recalc_pending_tests(obj)
 
     def clear_and_start_testing(self, obj, test=""):
-        obj.set_property("testing.tested-head", None)
         if isinstance(obj, Message):
-            obj.is_tested = False
-            obj.save()
+            obj.update_properties({"testing.tested-head": None}, is_tested=False)
+        else:
+            obj.delete_property("testing.tested-head")
         if test:
             r = self.get_testing_result(obj, test)
             if r:
@@ -524,29 +528,53 @@ class GetTestViewMixin:
             test=test,
         )
 
-    def _find_applicable_test(self, queryset, user, po, tester, capabilities):
-        # Prefer non-running tests, or tests that started the earliest
-        one_hour_ago = datetime.datetime.now() - datetime.timedelta(0, 3600)
-        where = Q(status=Result.PENDING)
-        where = where | Q(status=Result.RUNNING, last_update__lt=one_hour_ago)
-        where = where & Q(name__startswith="testing.")
-        q = queryset.filter(where).order_by("status", "last_update")
-        tests = _instance.get_tests(po)
-        for r in q:
-            if isinstance(r, MessageResult) and not r.message.git_result.is_success():
-                continue
-            tn = _instance.get_test_name(r)
-            t = tests.get(tn, None)
-            # Shouldn't happen, but let's protect against it
-            if not t:
-                continue
+    def _find_applicable_tests(self, po, capabilities):
+        """Return the tests of @po whose requirements are all satisfied by
+        @capabilities, as a dictionary indexed by result name"""
+        ret = {}
+        for tn, t in _instance.get_tests(po).items():
             reqs = t.get("requirements", "")
             for req in [x.strip() for x in reqs.split(",") if x]:
                 if req not in capabilities:
                     break
             else:
                 t["name"] = tn
-                yield r, t
+                ret["testing." + tn] = t
+        return ret
+
+    def _claim_test(self, queryset, po, capabilities):
+        """Pick the next test to run from @queryset and mark it as running.
+        The claim is atomic, so that two testers never get the same result"""
+        tests = self._find_applicable_tests(po, capabilities)
+        if not tests:
+            return None
+        # Prefer non-running tests, or tests that started the earliest
+        one_hour_ago = datetime.datetime.now() - datetime.timedelta(0, 3600)
+        where = Q(status=Result.PENDING)
+        where = where | Q(status=Result.RUNNING, last_update__lt=one_hour_ago)
+        q = queryset.filter(where, project=po, name__in=tests.keys()).order_by(
+            "status", "last_update"
+        )
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                # Rows that another tester is claiming are simply skipped
+                q = q.select_for_update(skip_locked=True, of=("self", "result_ptr"))
+                r = q.first()
+            else:
+                # No row locks (SQLite); claim the row by bumping last_update,
+                # and only if nobody has touched it since we read it.
+                for r in q[:10]:
+                    if Result.objects.filter(
+                        pk=r.pk, status=r.status, last_update=r.last_update
+                    ).update(last_update=datetime.datetime.utcnow()):
+                        break
+                else:
+                    r = None
+            if r is None:
+                return None
+            r.status = Result.RUNNING
+            r.save()
+        return r, tests[r.name]
 
     def _find_project_test(self, request, po, tester, capabilities):
         head = po.get_property("git.head")
@@ -554,33 +582,29 @@ class GetTestViewMixin:
         tested = po.get_property("testing.tested-head")
         if not head or not repo:
             return None
-        candidates = self._find_applicable_test(
-            ProjectResult.objects.filter(project=po),
-            request.user,
-            po,
-            tester,
-            capabilities,
+        candidate = self._claim_test(ProjectResult.objects, po, capabilities)
+        if not candidate:
+            return None
+        r, test = candidate
+        td = self._generate_project_test_data(
+            request, po.name, repo, head, tested, r, test
         )
-        for r, test in candidates:
-            td = self._generate_project_test_data(
-                request, po.name, repo, head, tested, r, test
-            )
-            return r, po, td
-        return None
+        return r, po, td
 
     def _find_series_test(self, request, po, tester, capabilities):
-        candidates = self._find_applicable_test(
-            MessageResult.objects.filter(message__project=po),
-            request.user,
-            po,
-            tester,
-            capabilities,
+        # Only series that were applied successfully can be tested
+        git_applied = MessageResult.objects.filter(
+            message=OuterRef("message"), name="git", status=Result.SUCCESS
+        )
+        candidate = self._claim_test(
+            MessageResult.objects.filter(Exists(git_applied)), po, capabilities
         )
-        for r, test in candidates:
-            s = r.message
-            td = self._generate_series_test_data(request, s, r, test)
-            return r, s, td
-        return None
+        if not candidate:
+            return None
+        r, test = candidate
+        s = r.message
+        td = self._generate_series_test_data(request, s, r, test)
+        return r, s, td
 
     def _do_testing_get(self, request, po, tester, capabilities):
         # Try project head test first
@@ -591,8 +615,6 @@ class GetTestViewMixin:
         if not candidate:
             return None
         r, obj, test_data = candidate
-        r.status = Result.RUNNING
-        r.save()
         return test_data
 
 
@@ -9,10 +9,18 @@
 
 import re
 import abc
+import codecs
+import itertools
 import sys
 
 from django.views import View
-from django.http import HttpResponse, StreamingHttpResponse, Http404
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    StreamingHttpResponse,
+    Http404,
+)
+from django.utils.cache import get_conditional_response
 from django.utils.safestring import mark_safe
 
 
@@ -43,49 +51,78 @@ class ANSIProcessor:
         self.strike = 0
 
     def _reset(self):
-        self.line = []
-        self.class_ids = []
+        self.spans = []
+        self.line = None
+        self.class_ids = None
+        self.line_len = 0
         self.pos = 0
         self.lazy_contents = ""
         self.lazy_accumulate = True
 
-    # self.line and self.class_ids hold the characters and style respectively
-    # for the current line.  Writing can overwrite some characters if self.pos
-    # is not pointing to the end of the line, and then appends.  Moving the
-    # cursor right can add spaces to the end, but those are never styled.
+    # The current line is usually written from left to right, so it is kept
+    # as a list of (text, class_id) spans in self.spans.  Moving the cursor
+    # right can add spaces to the end, but those are never styled.
+    #
+    # Only if a write overwrites some characters without reaching the end
+    # of the line, the line is split into single characters: self.line and
+    # self.class_ids then hold the characters and style respectively, until
+    # the line is flushed or cleared.
+
+    def _split_line(self):
+        self.line = list("".join(text for text, _ in self.spans))
+        self.class_ids = []
+        for text, class_id in self.spans:
+            self.class_ids += [class_id] * len(text)
+        self.spans = None
+
+    def _truncate(self):
+        if self.pos == 0:
+            self.spans = []
+            self.line = None
+            self.class_ids = None
+        elif self.line is not None:
+            del self.line[self.pos :]
+            del self.class_ids[self.pos :]
+        else:
+            while self.line_len > self.pos:
+                text, class_id = self.spans.pop()
+                self.line_len -= len(text)
+            if self.line_len < self.pos:
+                self.spans.append((text[: self.pos - self.line_len], class_id))
+        self.line_len = self.pos
 
     def _write(self, chars, class_id):
         assert not self.lazy_accumulate or self.lazy_contents == ""
         self.lazy_accumulate = False
-        classes = [class_id] * len(chars)
-        cur_len = len(self.line)
-        if self.pos < cur_len:
-            last = min(cur_len - self.pos, len(chars))
-            self.line[self.pos : self.pos + last] = list(chars[0:last])
-            self.class_ids[self.pos : self.pos + last] = classes[0:last]
+        end = self.pos + len(chars)
+        if self.line is None and end < self.line_len:
+            self._split_line()
+        if self.line is not None:
+            # slow path, overwrite character by character
+            if end > self.line_len:
+                self.line += [" "] * (end - self.line_len)
+                self.class_ids += [0] * (end - self.line_len)
+            self.line[self.pos : end] = chars
+            self.class_ids[self.pos : end] = [class_id] * len(chars)
         else:
-            last = 0
-
-        if len(chars) > last:
-            self.line += list(chars[last:])
-            self.class_ids += classes[last:]
-        self.pos += len(chars)
+            if self.pos < self.line_len:
+                self._truncate()
+            self.spans.append((chars, class_id))
+        self.pos = end
+        self.line_len = max(self.line_len, end)
 
     def _set_pos(self, pos):
+        if pos > self.line_len:
+            self.pos = self.line_len
+            self._write(" " * (pos - self.line_len), 0)
         self.pos = pos
-        if self.pos > len(self.line):
-            assert not self.lazy_accumulate or self.lazy_contents == ""
-            self.lazy_accumulate = False
-            num = self.pos - len(self.line)
-            self.line += [" "] * num
-            self.class_ids += [0] * num
 
     @abc.abstractmethod
     def _write_span(self, text, class_id):
         pass
 
-    # Flushing a line locates spans that have the same style, and prints those
-    # with a <span> tag if they are styled.
+    # Flushing a line merges adjacent spans that have the same style, and
+    # prints them with a <span> tag if they are styled.
 
     def _write_line(self, suffix):
         # If the line consists of a single string of text with no escapes or
@@ -97,15 +134,12 @@ class ANSIProcessor:
             self._reset()
             return
 
-        self.class_ids.append(-1)
-        start = 0
-        class_id = self.class_ids[0]
-        for i in range(1, len(self.class_ids)):
-            if self.class_ids[i] != class_id:
-                text = "".join(self.line[start:i])
-                yield from self._write_span(text, class_id)
-                start = i
-                class_id = self.class_ids[i]
+        if self.line is not None:
+            spans = zip(self.line, self.class_ids)
+        else:
+            spans = self.spans
+        for class_id, group in itertools.groupby(spans, key=lambda x: x[1]):
+            yield from self._write_span("".join(text for text, _ in group), class_id)
         yield suffix
         self._reset()
 
@@ -208,10 +242,9 @@ class ANSIProcessor:
         arg = next(it)
         if arg == 0 or arg == 2:
             assert not self.lazy_accumulate or self.lazy_contents == ""
-            if self.pos < len(self.line):
+            if self.pos < self.line_len:
                 assert not self.lazy_accumulate
-                del self.line[self.pos :]
-                del self.class_ids[self.pos :]
+                self._truncate()
                 if self.pos == 0:
                     self.lazy_accumulate = True
                     return
@@ -258,7 +291,7 @@ class ANSIProcessor:
             else:
                 seq = m.group(2)
                 # _write_line can deal with lazy storage.  Everything else
-                # must be flushed to self.line with _write.
+                # must be flushed to the line with _write.
                 if seq == "\n" or seq == "\r\n":
                     yield from self._write_line("\n")
                     continue
@@ -489,6 +522,10 @@ def ansi2html(input, white_bg=False):
     yield from c.finish()
 
 
+class RangeNotSatisfiable(Exception):
+    pass
+
+
 class LogView(View, metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def get_result(request, **kwargs):
@@ -520,18 +557,105 @@ if (parent.jQuery && parent.jQuery.colorbox) {
 }</script><body>"""
     )
 
-    def generate_html(self, log):
+    def generate_html(self, chunks):
         yield self.HTML_PROLOG
-        yield from ansi2html(log)
+        yield from self.render_html(chunks)
+
+    def render_html(self, chunks):
+        c = ANSI2HTMLConverter()
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        partial = ""
+        for chunk in chunks:
+            # Only convert complete lines, so that escape sequences are
+            # not split
+            text = partial + decoder.decode(chunk)
+            lines, nl, partial = text.rpartition("\n")
+            if nl:
+                yield from c.convert(lines + nl)
+        yield from c.convert(partial + decoder.decode(b"", final=True))
+        yield from c.finish()
+
+    def parse_range(self, request, entry, html=False):
+        """Return the (start, end) byte offsets that the query parameters
+        or Range header of @request select, and whether it is a range
+        request.  The Range header refers to the plain text log, so it is
+        ignored if @html is True."""
+        size = entry.size
+        if "tail" in request.GET:
+            tail = int(request.GET["tail"])
+            if tail < 0:
+                raise ValueError("invalid tail")
+            return entry.line_offset(entry.count_lines() - tail), None, False
+        if "lines" in request.GET:
+            first, _, last = request.GET["lines"].partition("-")
+            first = int(first)
+            last = int(last) if last else None
+            if first < 1 or (last is not None and last < first):
+                raise ValueError("invalid lines")
+            end = entry.line_offset(last) if last is not None else None
+            return entry.line_offset(first - 1), end, False
+        m = re.fullmatch(r"bytes=([0-9]*)-([0-9]*)", request.META.get("HTTP_RANGE", ""))
+        if not m or html or size is None or m.groups() == ("", ""):
+            return 0, None, False
+        if m.group(1):
+            start = int(m.group(1))
+            end = int(m.group(2)) + 1 if m.group(2) else size
+        else:
+            start, end = max(size - int(m.group(2)), 0), size
+        if start >= size or end <= start:
+            raise RangeNotSatisfiable
+        return start, min(end, size), True
 
     def get(self, request, **kwargs):
         result = self.get_result(request, **kwargs)
-        if result is None or not result.is_completed() or result.log is None:
+        if result is None or not result.is_completed() or result.log_entry is None:
             raise Http404("No log found")
-        if request.GET.get("html", None) != "1":
-            return HttpResponse(result.log, content_type="text/plain; charset=utf-8")
-
-        return StreamingHttpResponse(self.generate_html(result.log))
+        entry = result.log_entry
+        html = request.GET.get("html", None) == "1"
+        try:
+            start, end, partial = self.parse_range(request, entry, html)
+        except ValueError:
+            return HttpResponseBadRequest("Invalid log range")
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = "bytes */%d" % entry.size
+            return response
+        full = start == 0 and end is None
+        etag = None
+        if full:
+            # The log only changes if the result is reset
+            etag = '"%s%s"' % (entry.get_digest(), "-html" if html else "")
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                return response
+
+        if html:
+            if full:
+                body = itertools.chain(
+                    [self.HTML_PROLOG.encode("utf-8")],
+                    entry.iter_html(self.render_html),
+                )
+            else:
+                body = self.generate_html(entry.iter_bytes(start, end))
+            response = StreamingHttpResponse(body)
+        else:
+            response = StreamingHttpResponse(
+                entry.iter_bytes(start, end), content_type="text/plain; charset=utf-8"
+            )
+        if etag:
+            response["ETag"] = etag
+        if html:
+            return response
+
+        if entry.size is not None:
+            response["Accept-Ranges"] = "bytes"
+            if end is None:
+                end = entry.size
+            response["Content-Length"] = str(end - start)
+        if partial:
+            response.status_code = 206
+            response["Content-Range"] = "bytes %d-%d/%d" % (start, end - 1, entry.size)
+        return response
 
 
 if __name__ == "__main__":
@@ -161,6 +161,28 @@ MEDIA_URL = "/media/"
 if not os.path.isdir(MEDIA_ROOT):
     os.makedirs(MEDIA_ROOT)
 
+# Cache for the pages rendered for anonymous users (see www/cache.py).  In
+# production there are several server processes, which must share the cache
+# in order to see each other's invalidations.
+if DEBUG:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.path.join(DATA_DIR, "cache"),
+            "TIMEOUT": 600,
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        }
+    }
+
+# If the PATCHEW_EVENT_QUEUE env var is set, the slower event handlers (for
+# example the ones that send email) are queued in the database and called by
+# "manage.py worker" instead of the process that emitted the event.
+EVENT_QUEUE = bool(os.environ.get("PATCHEW_EVENT_QUEUE"))
+
 # If the PATCHEW_ADMIN_EMAIL env var is set, let Django send error reporting to
 # the address.
 admin_email = os.environ.get("PATCHEW_ADMIN_EMAIL")
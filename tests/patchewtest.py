@@ -21,6 +21,7 @@ import gzip
 import django
 import django.test as dj_test
 from django.contrib.auth.models import User, Group
+from django.core.cache import cache
 import rest_framework.test
 
 from api.models import Message, Result, Project
@@ -52,6 +53,11 @@ class PatchewTestCase(dj_test.LiveServerTestCase):
         super().__init__(name)
         self.need_logout = False
 
+    def _pre_setup(self):
+        super()._pre_setup()
+        # Cached pages refer to objects by id, which are reused across tests
+        cache.clear()
+
     def get_tmpdir(self):
         if not hasattr(self, "_tmpdir"):
             self._tmpdir = tempfile.mkdtemp()
@@ -359,6 +359,17 @@ class ANSI2HTMLTest(unittest.TestCase):
             "abc\x1b[7m\x1b[1Kabc", '   <span class="WHI BBLK">abc</span>'
         )
 
+    # overwriting part of the styled text
+    def test_overwrite_spans(self):
+        self.assertBlackBg("10%\r20%\r100%", "100%")
+        self.assertBlackBg("ab\x1b[31mcd\b\bxyz", 'ab<span class="HIR">xyz</span>')
+        self.assertBlackBg("ab\x1b[31mcd\b\b\bxyz", 'a<span class="HIR">xyz</span>')
+        self.assertBlackBg("ab\x1b[31mcd\r\x1b[0mx", 'xb<span class="HIR">cd</span>')
+        self.assertBlackBg(
+            "ab\x1b[31mcd\b\b\b\x1b[0mx", 'ax<span class="HIR">cd</span>'
+        )
+        self.assertBlackBg("abc\x1b[31md\b\b\x1b[0mxy", "abxy")
+
 
 class ANSI2TextTest(unittest.TestCase):
     def assertAnsi(self, test, expected, **kwargs):
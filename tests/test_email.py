@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 Red Hat, Inc.
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+import base64
+import io
+import sys
+
+from mod import get_module
+
+from .patchewtest import PatchewTestCase, main
+
+
+class EmailTest(PatchewTestCase):
+    def setUp(self):
+        self.create_superuser()
+        self.p = self.add_project("QEMU", "qemu-devel@nongnu.org")
+        self.p.config = {
+            "email": {
+                "notifications": {
+                    "test": {
+                        "event": "SetProperty",
+                        "enabled": True,
+                        "reply_to_all": False,
+                        "in_reply_to": True,
+                        "set_reply_to": True,
+                        "reply_subject": True,
+                        "to_user": False,
+                        "to": "{% if name == 'skip' %}{{ cancel }}{% endif %}a@b.org",
+                        "cc": "",
+                        "subject_template": "{{ name }} is now {{ value }}",
+                        "body_template": "Project {{ obj.name }}",
+                    }
+                }
+            }
+        }
+        self.p.save()
+        self.email = get_module("email")
+        model = self.email.get_model()
+        model.config = "[smtp]\ndebug = True\nfrom = patchew@example.org\n"
+        model.save()
+        self.output = io.StringIO()
+        self.email.debug_output = self.output
+        self.addCleanup(setattr, self.email, "debug_output", sys.stdout)
+        self.email._smtp_pool.idle.clear()
+
+    def test_notification(self):
+        self.p.set_property("foo", "one")
+        self.p.set_property("skip", "two")
+        self.p.set_property("bar", "three")
+        output = self.output.getvalue()
+        self.assertIn("Subject: foo is now one", output)
+        self.assertNotIn("skip", output)
+        self.assertIn("Subject: bar is now three", output)
+        self.assertIn(base64.b64encode(b"Project QEMU").decode(), output)
+
+        # One connection was reused for both emails
+        pool = self.email._smtp_pool
+        self.assertEqual(len(pool.idle), 1)
+        self.assertEqual(pool.idle[0][1].sent, 2)
+
+    def test_template_cache(self):
+        compile_template = sys.modules[type(self.email).__module__]._compile_template
+        self.p.set_property("foo", "one")
+        misses = compile_template.cache_info().misses
+        self.p.set_property("bar", "two")
+        self.assertEqual(compile_template.cache_info().misses, misses)
+
+
+if __name__ == "__main__":
+    main()
@@ -153,7 +153,7 @@ class GitTest(PatchewTestCase):
         self.assertEqual("tag" in resp.data, False)
         log = self.client.get(resp.data["log_url"])
         self.assertEqual(log.status_code, 200)
-        self.assertEqual(log.content.decode(), resp.data["log"])
+        self.assertEqual(log.getvalue().decode(), resp.data["log"])
 
     def test_rest_apply_success(self):
         self.cli_import("0013-foo-patch.mbox.gz")
@@ -172,7 +172,7 @@ class GitTest(PatchewTestCase):
         )
         log = self.client.get(resp.data["log_url"])
         self.assertEqual(log.status_code, 200)
-        self.assertEqual(log.content.decode(), resp.data["log"])
+        self.assertEqual(log.getvalue().decode(), resp.data["log"])
 
     def test_result_data_automatic_url(self):
         self.cli_import("0001-simple-patch.mbox.gz")
@@ -9,6 +9,7 @@
 # http://opensource.org/licenses/MIT.
 
 from api.models import Message, WatchedQuery, QueuedSeries
+from api.search import SearchEngine
 
 from .patchewtest import PatchewTestCase, main
 
@@ -116,6 +117,55 @@ class MaintainerQueueTest(PatchewTestCase):
         q = query.first()
         assert not q
 
+    def test_watched_query_many_users(self):
+        other = self.create_user("other", "1234")
+        WatchedQuery(user=self.testuser, query="to:qemu-block@nongnu.org").save()
+        WatchedQuery(user=other, query="to:nobody@nongnu.org").save()
+        self.cli_import("0001-simple-patch.mbox.gz")
+        msg = Message.objects.first()
+        query = QueuedSeries.objects.filter(message=msg, name="watched")
+        self.assertEqual([q.user for q in query], [self.testuser])
+
+        WatchedQuery.objects.filter(user=other).update(query="is:merged")
+        msg.set_merged()
+        query = QueuedSeries.objects.filter(message=msg, name="watched")
+        self.assertEqual(
+            set(q.user for q in query), set([self.testuser, other])
+        )
+
+    def test_watched_query_many_queries(self):
+        # One of the queries is affected by the change in the queues, but
+        # the other one still matches the series
+        WatchedQuery(user=self.testuser, query="nack:me").save()
+        WatchedQuery(user=self.testuser, query="from:famz").save()
+        self.cli_import("0001-simple-patch.mbox.gz")
+        msg = Message.objects.first()
+        query = QueuedSeries.objects.filter(user=self.testuser, name="watched")
+        self.assertEqual([q.message for q in query], [msg])
+
+        self.client.post("/login/", {"username": "test", "password": "1234"})
+        self.client.post(
+            "/QEMU/" + msg.message_id + "/mark-as-accepted/", {"next": "/"}
+        )
+        self.assertEqual([q.message for q in query], [msg])
+
+    def test_query_test_message_many(self):
+        self.cli_import("0001-simple-patch.mbox.gz")
+        msg = Message.objects.first()
+        engines = [
+            SearchEngine([q], self.testuser)
+            for q in ["to:qemu-block@nongnu.org", "is:merged", "quorum", "-quorum"]
+        ]
+        with self.assertNumQueries(1):
+            matches = SearchEngine.query_test_message_many(engines, msg)
+        self.assertEqual(matches, [True, False, True, False])
+
+    def test_search_fields(self):
+        se = SearchEngine(["to:foo -is:merged {nack:me age:<1w} bar"], None)
+        self.assertEqual(
+            se.fields(), {"recipients", "is_merged", "queues", "date", "subject"}
+        )
+
 
 if __name__ == "__main__":
     main()
@@ -98,6 +98,47 @@ Virtualization:  qemu.org | libvirt.org
         self.assertTrue("Signed-off-by" in msg.get_body())
         self.assertTrue(msg.is_patch())
 
+    def test_cached(self):
+        dp = self.get_data_path("0001-simple-patch.mbox.gz")
+        with open(dp, "r") as f:
+            msg = mbox.MboxMessage(f.read())
+        prefixes = msg.get_prefixes()
+        self.assertEqual(prefixes, ["Qemu-devel", "PATCH"])
+        prefixes.append("RFC")
+        self.assertEqual(msg.get_prefixes(), ["Qemu-devel", "PATCH"])
+        self.assertEqual(msg.get_prefixes(upper=True), ["QEMU-DEVEL", "PATCH"])
+        self.assertIs(msg.get_body(), msg.get_body())
+
+    def test_split_mbox_from_in_body(self):
+        data = (
+            "From 1@example.com Thu Jan  1 00:00:00 1970\n"
+            "Message-Id: <1@example.com>\n"
+            "Subject: one\n"
+            "\n"
+            "line 1\n"
+            "From the start, this was unescaped\n"
+            "\n"
+            ">From here, this was escaped\n"
+            ">>From here too\n"
+            "\n"
+            "From 2@example.com Thu Jan  1 00:00:00 1970\n"
+            "Message-Id: <2@example.com>\n"
+            "Subject: two\n"
+            "\n"
+            "line 2\n"
+        )
+        one, two = mbox.split_mbox(data)
+        msg = mbox.MboxMessage(one)
+        self.assertEqual(msg.get_message_id(), "1@example.com")
+        self.assertEqual(
+            msg.get_body().strip(),
+            "line 1\nFrom the start, this was unescaped\n\n"
+            "From here, this was escaped\n>From here too",
+        )
+        msg = mbox.MboxMessage(two)
+        self.assertEqual(msg.get_message_id(), "2@example.com")
+        self.assertEqual(msg.get_body().strip(), "line 2")
+
 
 if __name__ == "__main__":
     main()
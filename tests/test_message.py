@@ -8,13 +8,20 @@
 # This work is licensed under the MIT License.  Please see the LICENSE file or
 # http://opensource.org/licenses/MIT.
 
+import html
+import io
 import json
+import re
 import time
 import datetime
+from unittest import mock
+
+from django.core.management import call_command
 
 from .patchewtest import PatchewTestCase, main
 
-from api.models import Message
+from api.models import Message, MessageText
+from mod import get_module
 
 
 class MessageTest(PatchewTestCase):
@@ -64,6 +71,143 @@ class MessageTest(PatchewTestCase):
         )
         self.assertNotEqual(m1.topic, n.topic)
 
+    def test_cached_pages(self):
+        self.cli_login()
+        self.cli_import("0001-simple-patch.mbox.gz")
+        self.cli_logout()
+        self.client.logout()
+        MESSAGE_ID = "20160628014747.20971-1-famz@redhat.com"
+        s = Message.objects.find_series(MESSAGE_ID)
+        for url in ["/QEMU/", "/QEMU/" + MESSAGE_ID + "/", "/search?q=project:QEMU"]:
+            self.assertContains(self.client.get(url), "quorum: Only compile")
+
+        # Changes that do not emit events are not seen...
+        Message.objects.filter(pk=s.pk).update(subject="[PATCH] cached subject")
+        for url in ["/QEMU/", "/QEMU/" + MESSAGE_ID + "/", "/search?q=project:QEMU"]:
+            self.assertContains(self.client.get(url), "quorum: Only compile")
+
+        # ... until an event invalidates the project and the series
+        s.refresh_from_db()
+        s.set_property("test", "value")
+        for url in ["/QEMU/", "/QEMU/" + MESSAGE_ID + "/", "/search?q=project:QEMU"]:
+            self.assertContains(self.client.get(url), "cached subject")
+
+        self.client.login(username=self.user, password=self.password)
+        Message.objects.filter(pk=s.pk).update(subject="[PATCH] logged in")
+        self.assertContains(self.client.get("/QEMU/"), "logged in")
+        self.client.logout()
+
+    def test_footer(self):
+        model = get_module("footer").get_model()
+        model.config = '<p id="test-footer">Footer</p>'
+        model.save()
+        self.assertContains(self.client.get("/"), '<p id="test-footer">Footer</p>')
+
+    def test_message_text(self):
+        self.cli_login()
+        self.cli_import("0004-multiple-patch-reviewed.mbox.gz")
+        self.cli_logout()
+        MESSAGE_ID = "1469192015-16487-1-git-send-email-berrange@redhat.com"
+        s = Message.objects.find_series(MESSAGE_ID)
+        self.assertEqual(MessageText.objects.count(), Message.objects.count())
+        p = s.get_patches()[0]
+        self.assertIn("crypto/block-luks.c", p.get_files())
+        self.assertIn("5 files changed", p.get_text().diff_stat)
+
+        # Series pages do not look at the mbox
+        self.client.login(username=self.user, password=self.password)
+        with mock.patch.object(Message, "get_mbox_obj", side_effect=AssertionError):
+            for url in ["/QEMU/", "/QEMU/" + MESSAGE_ID + "/"]:
+                self.assertContains(self.client.get(url), "specific info for LUKS")
+
+        # Messages without a MessageText fall back to the mbox, and the
+        # management command fills it in
+        texts = {t.message_id: (t.body, t.diff_stat) for t in MessageText.objects.all()}
+        MessageText.objects.all().delete()
+        s = Message.objects.get(pk=s.pk)
+        self.assertEqual(s.get_body(), texts[s.id][0])
+        self.assertFalse(MessageText.objects.exists())
+        out = io.StringIO()
+        call_command("rebuild_message_text", stdout=out)
+        self.assertIn("Updated %d messages" % len(texts), out.getvalue())
+        self.assertEqual(
+            texts,
+            {t.message_id: (t.body, t.diff_stat) for t in MessageText.objects.all()},
+        )
+
+    @mock.patch("www.views.PAGE_SIZE", 1)
+    def test_cached_counts(self):
+        self.cli_login()
+        self.cli_import("0001-simple-patch.mbox.gz")
+        self.cli_import("0021-mode-only-patch.mbox.gz")
+        self.cli_logout()
+        self.client.login(username=self.user, password=self.password)
+        for url in ["/QEMU/", "/search?q=project:QEMU"]:
+            self.assertContains(self.client.get(url), "?page=2")
+
+        # The count is not recomputed until an event invalidates it
+        s1, s2 = Message.objects.series_heads().order_by("id")
+        Message.objects.filter(pk=s2.pk).update(topic=None)
+        for url in ["/QEMU/", "/search?q=project:QEMU", "/search?q=+project:QEMU"]:
+            self.assertContains(self.client.get(url), "?page=2")
+
+        s1.set_property("test", "value")
+        for url in ["/QEMU/", "/search?q=project:QEMU"]:
+            self.assertNotContains(self.client.get(url), "?page=2")
+
+    @mock.patch("www.views.PAGE_SIZE", 2)
+    def test_series_list_older_newer(self):
+        self.cli_login()
+        for f in [
+            "0001-simple-patch.mbox.gz",
+            "0003-single-patch-reviewed.mbox.gz",
+            "0004-multiple-patch-reviewed.mbox.gz",
+            "0008-complex-diffstat.mbox.gz",
+            "0021-mode-only-patch.mbox.gz",
+        ]:
+            self.cli_import(f)
+        self.cli_logout()
+
+        def get_page(url):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            text = resp.content.decode()
+            links = {}
+            for url, title in re.findall(r'href="(\?cursor=[^"]*)">(\S+)', text):
+                links[title] = "/QEMU/" + html.unescape(url)
+            ids = re.findall(r'href="/QEMU/([^/"]+)/"', text)
+            return ids, links.get("Older"), links.get("&laquo;")
+
+        for sort in ["date", "replied"]:
+            expected = [
+                s.message_id
+                for s in Message.objects.series_heads().order_by("-date", "-id")
+            ]
+            ids, older, newer = get_page("/QEMU/?sort=" + sort)
+            self.assertIsNone(newer)
+            pages = [ids]
+            while older:
+                ids, older, newer = get_page(older)
+                self.assertIn("sort=" + sort, newer)
+                pages.append(ids)
+            self.assertEqual(len(pages), 3)
+            if sort == "date":
+                self.assertEqual(sum(pages, []), expected)
+            n = len(pages)
+            while newer:
+                n -= 1
+                ids, older, newer = get_page(newer)
+                self.assertEqual(ids, pages[n - 1])
+            self.assertEqual(n, 1)
+
+            # page numbers continue with cursors
+            ids, older, newer = get_page("/QEMU/?page=2&sort=" + sort)
+            self.assertEqual(ids, pages[1])
+            self.assertEqual(get_page(newer)[0], pages[0])
+            self.assertEqual(get_page(older)[0], pages[2])
+
+        self.assertEqual(self.client.get("/QEMU/?cursor=bogus").status_code, 404)
+
 
 if __name__ == "__main__":
     main()
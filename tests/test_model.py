@@ -8,11 +8,30 @@
 # This work is licensed under the MIT License.  Please see the LICENSE file or
 # http://opensource.org/licenses/MIT.
 
-from api.models import Message
+import importlib
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api.models import LogEntry, Message, MessageResult, Result
+from event import register_handler, _handlers
+from mbox import split_mbox
 
 from .patchewtest import PatchewTestCase, main
 
 
+def make_mbox(message_id, subject, in_reply_to=None):
+    mbox = "From: Foo <foo@example.com>\n"
+    mbox += "To: qemu-devel@nongnu.org\n"
+    mbox += "Date: Mon, 1 Jan 2018 00:00:00 +0000\n"
+    mbox += "Subject: %s\n" % subject
+    mbox += "Message-Id: <%s>\n" % message_id
+    if in_reply_to:
+        mbox += "In-Reply-To: <%s>\n" % in_reply_to
+    return mbox + "\nbody\n"
+
+
 class ImportTest(PatchewTestCase):
     def setUp(self):
         self.create_superuser()
@@ -79,6 +98,161 @@ mode change 100644 => 100755 tests/qemu-iotests/205
         self.maxDiff = 100000
         self.assertMultiLineEqual(expected.strip(), msg.get_diff_stat())
 
+    def get_thread_index(self):
+        return {
+            m.message_id: (
+                m.thread_root and m.thread_root.message_id,
+                m.thread_depth,
+                m.series_head and m.series_head.message_id,
+            )
+            for m in Message.objects.all()
+        }
+
+    def test_thread_index(self):
+        dp = self.get_data_path("0004-multiple-patch-reviewed.mbox.gz")
+        with open(dp, "r") as f:
+            mboxes = list(split_mbox(f.read()))
+        # Replies arrive before the message they reply to
+        mboxes.reverse()
+        mboxes.insert(
+            0, make_mbox("reply@example.com", "Re: ping", "5792265A.5070507@redhat.com")
+        )
+        for mbox in mboxes:
+            Message.objects.add_messages_from_mbox_many([mbox])
+
+        head = "1469192015-16487-1-git-send-email-berrange@redhat.com"
+        s = Message.objects.find_series(head, "QEMU")
+        self.assertTrue(s.is_complete)
+        self.assertEqual(
+            self.get_thread_index(),
+            {
+                head: (None, 0, None),
+                "1469192015-16487-2-git-send-email-berrange@redhat.com": (
+                    head,
+                    1,
+                    head,
+                ),
+                "1469192015-16487-3-git-send-email-berrange@redhat.com": (
+                    head,
+                    1,
+                    head,
+                ),
+                "5792265A.5070507@redhat.com": (head, 1, head),
+                "e0858c00-ccb6-e533-ee3e-9ba84ca45a7b@redhat.com": (head, 1, head),
+                "reply@example.com": (head, 2, head),
+            },
+        )
+        thread = s.get_thread_replies()
+        self.assertEqual(len(thread[head]), 4)
+        self.assertEqual(
+            [m.message_id for m in thread["5792265A.5070507@redhat.com"]],
+            ["reply@example.com"],
+        )
+
+        # The migration rebuilds the same index
+        index = self.get_thread_index()
+        Message.objects.update(thread_root=None, thread_depth=0, series_head=None)
+        migration = importlib.import_module("api.migrations.0073_populate_thread_index")
+        migration.populate_thread_index(apps, None)
+        self.assertEqual(self.get_thread_index(), index)
+
+        Message.objects.delete_subthread(s)
+        self.assertFalse(Message.objects.exists())
+
+    def test_result_save(self):
+        self.cli_import("0001-simple-patch.mbox.gz")
+        s = Message.objects.series_heads().get()
+        events = []
+
+        def on_result_update(evt, obj, old_status, result):
+            events.append((obj, old_status, result.status))
+
+        register_handler("ResultUpdate", on_result_update)
+        self.addCleanup(_handlers["ResultUpdate"].remove, (on_result_update, False))
+
+        r = MessageResult(
+            message=s, project=s.project, name="foo", status=Result.PENDING
+        )
+        r.save()
+        r.log = "log"
+        r.save()
+        self.assertEqual(events, [(s, None, "pending"), (s, "pending", "pending")])
+
+        def result_queries():
+            # Ignore the queries made by the ResultUpdate handlers
+            keys = ['"api_result"."id" = %d' % r.pk, '"result_ptr_id" = %d' % r.pk]
+            return [
+                q["sql"]
+                for q in ctx.captured_queries
+                if any(k in q["sql"] for k in keys)
+            ]
+
+        r = MessageResult.objects.get(pk=r.pk)
+        r.status = Result.RUNNING
+        with CaptureQueriesContext(connection) as ctx:
+            r.save()
+        self.assertEqual(len(result_queries()), 1)
+        self.assertEqual(events[-1], (s, "pending", "running"))
+
+        # update_fields is honored, and the status that was not saved
+        # is still considered the old status
+        r.status = Result.SUCCESS
+        r.data = {"foo": "bar"}
+        r.save(update_fields=["data"])
+        self.assertEqual(events[-1], (s, "running", "success"))
+        r.save()
+        self.assertEqual(events[-1], (s, "running", "success"))
+        r = MessageResult.objects.get(pk=r.pk)
+        self.assertEqual((r.status, r.data, r.log), ("success", {"foo": "bar"}, "log"))
+
+        # Clearing the log deletes the log entry
+        entry_id = r.log_entry_id
+        r.log = None
+        r.save()
+        self.assertFalse(LogEntry.objects.filter(pk=entry_id).exists())
+        self.assertIsNone(MessageResult.objects.get(pk=r.pk).log_entry)
+
+        # Objects that were not loaded from the database fetch the old values
+        r2 = MessageResult.objects.only("name").get(pk=r.pk)
+        r2.status = Result.FAILURE
+        r2.save()
+        self.assertEqual(events[-1], (s, "success", "failure"))
+
+    def test_update_properties(self):
+        self.cli_import("0001-simple-patch.mbox.gz")
+        s = Message.objects.series_heads().get()
+        s.set_property("foo.bar", 1)
+        events = []
+
+        def on_set_property(evt, obj, name, value, old_value):
+            events.append((name, value, old_value))
+
+        register_handler("SetProperty", on_set_property)
+        self.addCleanup(_handlers["SetProperty"].remove, (on_set_property, False))
+
+        with CaptureQueriesContext(connection) as ctx:
+            with transaction.atomic():
+                s.update_properties(
+                    {"foo.bar": None, "foo.baz": 2, "missing": None}, is_tested=True
+                )
+                self.assertEqual(events, [])
+        self.assertEqual(events, [("foo.bar", None, 1), ("foo.baz", 2, None)])
+        updates = [q["sql"] for q in ctx.captured_queries if "UPDATE" in q["sql"]]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"properties"', updates[0])
+        self.assertIn('"is_tested"', updates[0])
+        self.assertNotIn('"mbox_bytes"', updates[0])
+
+        s = Message.objects.get(pk=s.pk)
+        self.assertEqual(s.properties, {"foo": {"baz": 2}})
+        self.assertTrue(s.is_tested)
+
+        # Deleting a property that does not exist does nothing
+        with CaptureQueriesContext(connection) as ctx:
+            s.delete_property("foo.bar")
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(len(events), 2)
+
 
 if __name__ == "__main__":
     main()
@@ -8,6 +8,9 @@
 # This work is licensed under the MIT License.  Please see the LICENSE file or
 # http://opensource.org/licenses/MIT.
 
+from api.models import Project
+from mbox import MboxMessage
+
 from .patchewtest import PatchewTestCase, main
 
 
@@ -77,6 +80,26 @@ class ProjectTest(PatchewTestCase):
         self.assertFalse(p.maintained_by(u1))
         self.assertFalse(p.maintained_by(u2))
 
+    def test_recognizing(self):
+        p1 = self.add_project("QEMU", "qemu-devel@nongnu.org")
+        p2 = self.add_project("QEMU Block", "qemu-block@nongnu.org")
+        p3 = self.add_project("QEMU Web", "qemu-devel@nongnu.org")
+        p3.prefix_tags = "qemu-web"
+        p3.save()
+        with open(self.get_data_path("0001-simple-patch.mbox.gz"), "r") as f:
+            m = MboxMessage(f.read())
+        self.assertEqual(Project.objects.recognizing(m), [p1, p2])
+        with self.assertNumQueries(1):
+            self.assertEqual(Project.objects.recognizing(m), [p1, p2])
+
+        p2.mailing_list = "qemu-arm@nongnu.org"
+        p2.save()
+        p3.prefix_tags = "!/qemu-w.*"
+        p3.save()
+        self.assertEqual(Project.objects.recognizing(m), [p1, p3])
+        for p in [p1, p2, p3]:
+            self.assertEqual(p.recognizes(m), p != p2)
+
 
 if __name__ == "__main__":
     main()
@@ -9,12 +9,16 @@
 # http://opensource.org/licenses/MIT.
 
 from collections import OrderedDict
+import io
 import json
 
 from django.contrib.auth.models import User
+from django.core.management import call_command
 
-from api.models import Message
+from api.models import Message, SearchDocument
 from api.rest import AddressSerializer
+from event import register_handler, _handlers
+from mbox import split_mbox
 
 from .patchewtest import PatchewTestCase, main
 
@@ -379,6 +383,54 @@ class RestTest(PatchewTestCase):
         resp = self.api_client.get(self.REST_BASE + "projects/12345/series/")
         self.assertEqual(resp.status_code, 404)
 
+    def test_series_list_cursor(self):
+        self.cli_login()
+        for f in [
+            "0001-simple-patch.mbox.gz",
+            "0003-single-patch-reviewed.mbox.gz",
+            "0004-multiple-patch-reviewed.mbox.gz",
+            "0008-complex-diffstat.mbox.gz",
+            "0021-mode-only-patch.mbox.gz",
+        ]:
+            self.cli_import(f)
+        self.cli_logout()
+        # Make the cursors deal with ties and NULLs
+        heads = Message.objects.series_heads()
+        self.assertEqual(heads.count(), 5)
+        first, second = heads.order_by("id")[:2]
+        heads.filter(id=second.id).update(date=first.date)
+        heads.filter(id__in=[first.id, second.id]).update(last_reply_date=None)
+
+        def get_ids(resp):
+            return [x["message_id"] for x in resp.data["results"]]
+
+        for ordering in ["date", "last_reply_date", "id"]:
+            url = self.PROJECT_BASE + "series/?ordering=" + ordering
+            resp = self.api_client.get(url + "&offset=0&limit=100")
+            self.assertNotIn("cursor", resp.data["next"] or "")
+            expected = get_ids(resp)
+            self.assertEqual(len(expected), 5)
+
+            # walk to the oldest series and back
+            pages = []
+            url += "&limit=2"
+            while url:
+                resp = self.api_client.get(url)
+                pages.append(get_ids(resp))
+                self.assertEqual(resp.data["previous"] is None, len(pages) == 1)
+                previous = resp.data["previous"]
+                url = resp.data["next"]
+            self.assertEqual(sum(pages, []), expected)
+            while previous:
+                pages.pop()
+                resp = self.api_client.get(previous)
+                self.assertEqual(get_ids(resp), pages[-1])
+                previous = resp.data["previous"]
+            self.assertEqual(len(pages), 1)
+
+        resp = self.api_client.get(self.PROJECT_BASE + "series/?cursor=foo")
+        self.assertEqual(resp.status_code, 404)
+
     def test_series_results_list(self):
         resp1 = self.apply_and_retrieve(
             "0001-simple-patch.mbox.gz",
@@ -432,6 +484,41 @@ class RestTest(PatchewTestCase):
         )
         self.assertEqual(resp.status_code, 404)
 
+    def test_series_search_body(self):
+        resp1 = self.apply_and_retrieve(
+            "0004-multiple-patch-reviewed.mbox.gz",
+            self.p.id,
+            "1469192015-16487-1-git-send-email-berrange@redhat.com",
+        )
+        self.apply_and_retrieve(
+            "0001-simple-patch.mbox.gz",
+            self.p.id,
+            "20160628014747.20971-1-famz@redhat.com",
+        )
+        doc = SearchDocument.objects.get(series__message_id=resp1.data["message_id"])
+        self.assertEqual(doc.num_patches, 2)
+
+        def search(q):
+            resp = self.api_client.get(self.REST_BASE + "series/", {"q": q})
+            return [r["message_id"] for r in resp.data["results"]]
+
+        # cover letter
+        self.assertEqual(search("body:technically"), [resp1.data["message_id"]])
+        self.assertEqual(search("technically"), [])
+        # commit message of a patch, but not the diff
+        self.assertEqual(search("body:QCryptoBlockInfo"), [resp1.data["message_id"]])
+        self.assertEqual(search("body:cipheralg"), [])
+        self.assertEqual(search("body:luks -body:QCryptoBlockInfo"), [])
+        self.assertEqual(search("body:luks LUKS"), [resp1.data["message_id"]])
+
+        out = io.StringIO()
+        call_command("rebuild_search_index", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Updated 2 series")
+        self.assertEqual(search("body:technically"), [resp1.data["message_id"]])
+
+        Message.objects.filter(message_id=resp1.data["message_id"]).delete()
+        self.assertEqual(search("body:technically"), [])
+
     def test_series_delete(self):
         test_message_id = "1469192015-16487-1-git-send-email-berrange@redhat.com"
         series = self.apply_and_retrieve(
@@ -700,6 +787,52 @@ class RestTest(PatchewTestCase):
         )
         self.assertEqual(resp_get2.status_code, 200)
 
+    def test_bulk_create_messages(self):
+        dp = self.get_data_path("0004-multiple-patch-reviewed.mbox.gz")
+        with open(dp, "r") as f:
+            data = f.read()
+        added = []
+
+        def on_message_added(evt, message):
+            added.append(message.message_id)
+
+        register_handler("MessageAdded", on_message_added)
+        self.addCleanup(_handlers["MessageAdded"].remove, (on_message_added, False))
+        self.api_client.login(username=self.user, password=self.password)
+        resp = self.api_client.post(
+            self.REST_BASE + "messages/bulk/", data, content_type="application/mbox"
+        )
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(len(resp.data["results"]), 5)
+        self.assertEqual(
+            sorted(added), sorted(m["message_id"] for m in resp.data["results"])
+        )
+        series = Message.objects.series_heads(self.p.id).get()
+        self.assertTrue(series.is_complete)
+        self.assertTrue(series.is_reviewed)
+        self.assertEqual(series.num_patches, 2)
+
+        # Duplicates are skipped
+        data = "".join(json.dumps({"mbox": mbox}) + "\n" for mbox in split_mbox(data))
+        resp = self.api_client.post(
+            self.REST_BASE + "messages/bulk/", data, content_type="application/x-ndjson"
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.data["results"]), 0)
+
+    def test_non_maintainer_bulk_create_messages(self):
+        self.create_user(username="test", password="userpass")
+        self.api_client.login(username="test", password="userpass")
+        dp = self.get_data_path("0023-multiple-project-patch.mbox.gz")
+        with open(dp, "r") as f:
+            data = f.read()
+        data = json.dumps({"mbox": data}) + "\n"
+        resp = self.api_client.post(
+            self.REST_BASE + "messages/bulk/", data, content_type="application/x-ndjson"
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.data["results"]), 0)
+
     def test_message(self):
         series = self.apply_and_retrieve(
             "0001-simple-patch.mbox.gz",
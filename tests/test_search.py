@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 Red Hat, Inc.
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+import datetime
+import json
+from unittest import mock
+
+from django.core.exceptions import EmptyResultSet, FieldError
+from django.db.models import Q
+
+from api.models import Message
+from api.search import parse
+
+from .patchewtest import PatchewTestCase, main
+
+
+class FrozenDatetime(datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2020, 1, 1, 12, 0, 0)
+
+
+class SearchParserTest(PatchewTestCase):
+    # What the compynator grammar that was used before the hand-written
+    # parser returned for a few fixed strings and for random combinations
+    # of search terms.  Strings that it failed to parse are not included.
+    OLD_PARSER_RESULTS = "0039-search-parse-results.json.gz"
+
+    def setUp(self):
+        self.testuser = self.create_user("test", "1234")
+        self.project = self.add_project("QEMU", "qemu-devel@nongnu.org")
+
+    def get_sql(self, expr):
+        """Return the WHERE clause of the query for @expr, with the ids
+        of the test user and project replaced by names"""
+        q = expr.get_query(
+            self.testuser, lambda x: Q(subject__icontains=x), lambda x: x
+        )
+        try:
+            sql = str(Message.objects.filter(q).query)
+        except EmptyResultSet:
+            return None
+        except FieldError:
+            # "has:" does not work with SQLite
+            return "FieldError"
+        sql = sql.partition(" WHERE ")[2]
+        sql = sql.replace('"user_id" = %d)' % self.testuser.id, '"user_id" = USER)')
+        return sql.replace(
+            '"project_id" IN (%d)' % self.project.id, '"project_id" IN (QEMU)'
+        )
+
+    def describe(self, expr):
+        return [
+            expr.get_project(),
+            sorted(expr.get_all_keywords()),
+            sorted(expr.get_fields()),
+            self.get_sql(expr),
+        ]
+
+    @mock.patch("datetime.datetime", FrozenDatetime)
+    def test_old_parser_equivalence(self):
+        with open(self.get_data_path(self.OLD_PARSER_RESULTS), "r") as f:
+            expected = json.load(f)
+        for s, result in expected.items():
+            self.assertEqual(self.describe(parse(s)), result, repr(s))
+
+    def test_query_time(self):
+        # The parse tree is cached, so project: and age: are resolved
+        # when the query is built
+        q = parse("project:Test age:<1d")
+        self.assertIs(parse("project:Test age:<1d"), q)
+        with mock.patch("datetime.datetime", FrozenDatetime):
+            self.assertEqual(
+                q.get_query(None, None, None),
+                Q(project__pk__in=[])
+                & Q(date__gte=datetime.datetime(2019, 12, 31, 12)),
+            )
+        p = self.add_project("Test", "test@example.com")
+        self.assertIn(
+            ("project__pk__in", [p.id]), q.get_query(None, None, None).children
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -11,8 +11,14 @@
 import email
 import email.parser
 import email.policy
-from mbox import decode_payload
-from api.models import Message
+import io
+from unittest import mock
+
+from mbox import decode_payload, split_mbox
+from django.core.management import call_command
+from api.models import Message, Module
+from event import emit_event
+from mod import get_module
 
 from .patchewtest import PatchewTestCase, main
 
@@ -60,19 +66,83 @@ class ImportTest(PatchewTestCase):
             message = self.api_client.get(uri)
             self.assertEquals(message.data["tags"], [])
 
+    def test_body_tags(self):
+        self.cli_login()
+        self.cli_import("0004-multiple-patch-reviewed.mbox.gz")
+        self.cli_logout()
+        MESSAGE_ID = "1469192015-16487-1-git-send-email-berrange@redhat.com"
+        TAG = "Reviewed-by: Eric Blake <eblake@redhat.com>"
+        s = Message.objects.find_series(MESSAGE_ID, self.p.name)
+        self.assertEqual(s.tags, [TAG])
+        self.assertEqual(s.body_tags, [])
+        reply = Message.objects.get(message_id="5792265A.5070507@redhat.com")
+        self.assertEqual(reply.body_tags, [TAG])
+
+        Message.objects.filter(pk=s.pk).update(tags=[])
+        call_command("recompute_tags", "--project", self.p.name, stdout=io.StringIO())
+        s = Message.objects.find_series(MESSAGE_ID, self.p.name)
+        self.assertEqual(s.tags, [TAG])
+        self.assertTrue(s.is_reviewed)
+
+    def test_config_cache(self):
+        tags = get_module("tags")
+        self.assertIn("Tested-by", tags.get_tag_prefixes())
+        with self.assertNumQueries(0):
+            self.assertIn("Tested-by", tags.get_tag_prefixes())
+        m = Module.objects.get(name="tags")
+        m.config = "[default]\ntags = Regressed-by"
+        m.save()
+        self.assertIn("Regressed-by", tags.get_tag_prefixes())
+        self.assertNotIn("Tested-by", tags.get_tag_prefixes())
+
     def test_mbox_with_8bit_tags(self):
         self.cli_login()
         self.cli_import("0028-tags-need-8bit-encoding.mbox.gz")
         self.cli_logout()
-        mbox = self.client.get("/QEMU/20181126152836.25379-1-rkagan@virtuozzo.com/mbox")
+        resp = self.client.get("/QEMU/20181126152836.25379-1-rkagan@virtuozzo.com/mbox")
         parser = email.parser.BytesParser(policy=email.policy.SMTP)
-        msg = parser.parsebytes(mbox.content)
+        msg = parser.parsebytes(b"".join(resp.streaming_content))
         payload = decode_payload(msg)
         self.assertIn("SynICState *synic = get_synic(cs);", payload)
         self.assertIn(
             "Reviewed-by: Philippe Mathieu-Daudé <philmd@redhat.com>", payload
         )
 
+    def test_mbox_cache(self):
+        self.cli_login()
+        self.cli_import("0004-multiple-patch-reviewed.mbox.gz")
+        self.cli_logout()
+        MESSAGE_ID = "1469192015-16487-1-git-send-email-berrange@redhat.com"
+        TAG = "Reviewed-by: Eric Blake <eblake@redhat.com>"
+        url = "%sseries/%s/mbox/" % (self.PROJECT_BASE, MESSAGE_ID)
+        resp = self.client.get(url)
+        mbox = b"".join(resp.streaming_content)
+        self.assertEqual(mbox.count(TAG.encode()), 2)
+
+        build = mock.patch.object(
+            Message,
+            "_build_mbox_with_tags",
+            autospec=True,
+            side_effect=Message._build_mbox_with_tags,
+        )
+        with build as m:
+            resp = self.client.get(url)
+            self.assertEqual(b"".join(resp.streaming_content), mbox)
+            self.assertEqual(m.call_count, 0)
+
+            # A change to the tags of a patch changes the key
+            patch = Message.objects.get(message_id=MESSAGE_ID.replace("-1-", "-2-"))
+            patch.tags = patch.tags + ["Tested-by: Foo <foo@example.com>"]
+            patch.save()
+            resp = self.client.get(url)
+            self.assertIn(b"Tested-by: Foo", b"".join(resp.streaming_content))
+            self.assertEqual(m.call_count, 1)
+
+            emit_event("TagsUpdate", series=Message.objects.find_series(MESSAGE_ID))
+            resp = self.client.get(url)
+            b"".join(resp.streaming_content)
+            self.assertEqual(m.call_count, 3)
+
     def test_case_insensitive(self):
         self.cli_login()
         self.cli_import("0002-unusual-cased-tags.mbox.gz")
@@ -130,6 +200,17 @@ class ImportTest(PatchewTestCase):
             "20200114092606.1761-1-quintela@redhat.com",
         )
 
+    def test_obsoleted_page_cache(self):
+        with open(self.get_data_path("0030-obsolete-by-v3.mbox.gz")) as f:
+            v1, *newer = split_mbox(f.read())
+        Message.objects.add_messages_from_mbox_many([v1])
+        url = "/QEMU/20160628014747.20971-1-famz@redhat.com/"
+        self.assertNotContains(self.client.get(url), "newer version</a>")
+        self.assertNotContains(self.client.get("/QEMU/"), "Has a newer version")
+        Message.objects.add_messages_from_mbox_many(newer)
+        self.assertContains(self.client.get(url), "newer version</a>")
+        self.assertContains(self.client.get("/QEMU/"), "Has a newer version")
+
     def test_supersedes_separate(self):
         self.cli_login()
         self.cli_import("0032-supersedes-separate.mbox.gz")
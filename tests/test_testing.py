@@ -9,9 +9,10 @@
 # http://opensource.org/licenses/MIT.
 
 import abc
+import lzma
 import subprocess
 
-from api.models import Message, Result
+from api.models import LogEntry, Message, Result
 
 from .patchewtest import PatchewTestCase, main
 
@@ -109,6 +110,27 @@ class TestingTestCase(PatchewTestCase, metaclass=abc.ABCMeta):
         resp = self.get_test_result("a")
         self.assertEquals(resp.data["status"], "running")
 
+    def test_claim_once(self):
+        create_test(self.p, "b", "foo")
+        self.api_login()
+        resp = self.api_client.post(
+            self.PROJECT_BASE + "get-test/",
+            {"tester": "dummy tester", "capabilities": []},
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["test"]["name"], "a")
+        resp = self.api_client.post(
+            self.PROJECT_BASE + "get-test/",
+            {"tester": "other tester", "capabilities": []},
+        )
+        self.assertEqual(resp.status_code, 204)
+        resp = self.api_client.post(
+            self.PROJECT_BASE + "get-test/",
+            {"tester": "other tester", "capabilities": ["foo"]},
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["test"]["name"], "b")
+
     def test_done(self):
         self.do_testing_done()
         self.api_login()
@@ -129,7 +151,7 @@ class TestingTestCase(PatchewTestCase, metaclass=abc.ABCMeta):
         self.assertEquals(resp.data["log"], "everything good!")
         log = self.client.get(resp.data["log_url"])
         self.assertEquals(log.status_code, 200)
-        self.assertEquals(log.content, b"everything good!")
+        self.assertEquals(log.getvalue(), b"everything good!")
 
     def test_rest_done_failure(self):
         self.do_testing_done(log="sorry no good", status=Result.FAILURE)
@@ -138,7 +160,7 @@ class TestingTestCase(PatchewTestCase, metaclass=abc.ABCMeta):
         self.assertEquals(resp.data["log"], "sorry no good")
         log = self.client.get(resp.data["log_url"])
         self.assertEquals(log.status_code, 200)
-        self.assertEquals(log.content, b"sorry no good")
+        self.assertEquals(log.getvalue(), b"sorry no good")
 
     def test_api_report_success(self):
         self.api_login()
@@ -149,7 +171,7 @@ class TestingTestCase(PatchewTestCase, metaclass=abc.ABCMeta):
         log = self.client.get(resp.data["log_url"])
         self.assertEquals(resp.data["log"], "everything good!")
         self.assertEquals(log.status_code, 200)
-        self.assertEquals(log.content, b"everything good!")
+        self.assertEquals(log.getvalue(), b"everything good!")
 
     def test_api_report_failure(self):
         self.api_login()
@@ -160,7 +182,97 @@ class TestingTestCase(PatchewTestCase, metaclass=abc.ABCMeta):
         self.assertEquals(resp.data["log"], "sorry no good")
         log = self.client.get(resp.data["log_url"])
         self.assertEquals(log.status_code, 200)
-        self.assertEquals(log.content, b"sorry no good")
+        self.assertEquals(log.getvalue(), b"sorry no good")
+
+    def test_api_upload_log(self):
+        self.api_login()
+        resp = self.api_client.post(
+            self.PROJECT_BASE + "get-test/",
+            {"tester": "dummy tester", "capabilities": []},
+        )
+        r = resp.data
+        log_uri = r["result_uri"] + "log/"
+        resp = self.api_client.put(
+            log_uri, "everything good!\n" * 1000, content_type="text/plain"
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["status"], "running")
+        resp = self.get_test_result("a")
+        self.assertEqual(resp.data["log"], "everything good!\n" * 1000)
+
+        resp = self.api_client.put(
+            log_uri, lzma.compress(b"sorry no good"), content_type="application/x-xz"
+        )
+        self.assertEqual(resp.status_code, 200)
+        resp = self.api_client.put(
+            log_uri, b"sorry no good", content_type="application/x-xz"
+        )
+        self.assertEqual(resp.status_code, 400)
+        resp = self.api_client.put(log_uri, b"{}", content_type="application/json")
+        self.assertEqual(resp.status_code, 415)
+
+        data = {"head": r["head"], "is_timeout": False, "tester": "dummy_tester"}
+        resp = self.api_client.put(
+            r["result_uri"], {"status": "failure", "data": data}, format="json"
+        )
+        self.assertEqual(resp.data["log"], "sorry no good")
+        log = self.client.get(resp.data["log_url"])
+        self.assertEqual(log.getvalue(), b"sorry no good")
+
+    def test_log_range(self):
+        log = "".join("line %d\n" % i for i in range(1, 101))
+        self.do_testing_done(log=log, status=Result.SUCCESS)
+        log_url = self.get_test_result("a").data["log_url"]
+        resp = self.client.get(log_url, {"tail": 2})
+        self.assertEqual(resp.getvalue(), b"line 99\nline 100\n")
+        resp = self.client.get(log_url, {"lines": "10-11"})
+        self.assertEqual(resp.getvalue(), b"line 10\nline 11\n")
+        resp = self.client.get(log_url, {"lines": "0-1"})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get(log_url, HTTP_RANGE="bytes=5-9")
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp["Content-Range"], "bytes 5-9/%d" % len(log))
+        self.assertEqual(resp.getvalue(), b"1\nlin")
+        resp = self.client.get(log_url, HTTP_RANGE="bytes=-9")
+        self.assertEqual(resp.getvalue(), b"line 100\n")
+        resp = self.client.get(log_url, HTTP_RANGE="bytes=%d-" % len(log))
+        self.assertEqual(resp.status_code, 416)
+        resp = self.client.get(log_url, {"tail": 1, "html": 1})
+        self.assertIn(b"line 100", resp.getvalue())
+        self.assertNotIn(b"line 99", resp.getvalue())
+
+        # Range refers to the text log, and is ignored for the HTML one
+        resp = self.client.get(log_url, {"html": 1}, HTTP_RANGE="bytes=5-9")
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(resp.has_header("Content-Range"))
+        body = resp.getvalue()
+        self.assertIn(b">line 1\n", body)
+        self.assertIn(b"line 100", body)
+
+    def test_log_html_cache(self):
+        self.do_testing_done(log="\x1b[31mred\x1b[0m\n", status=Result.SUCCESS)
+        log_url = self.get_test_result("a").data["log_url"]
+        entry = LogEntry.objects.order_by("id").last()
+        self.assertIsNone(entry.html_xz)
+        resp = self.client.get(log_url, {"html": 1})
+        html = resp.getvalue()
+        self.assertIn(b"red", html)
+        etag = resp["ETag"]
+        entry.refresh_from_db()
+        self.assertIsNotNone(entry.html_xz)
+        resp = self.client.get(log_url, {"html": 1})
+        self.assertEqual(resp.getvalue(), html)
+        resp = self.client.get(log_url, {"html": 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        resp = self.client.get(log_url)
+        self.assertNotEqual(resp["ETag"], etag)
+
+        self.do_testing_done(log="blue\n", status=Result.SUCCESS)
+        entry.refresh_from_db()
+        self.assertIsNone(entry.html_xz)
+        resp = self.client.get(log_url, {"html": 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"blue", resp.getvalue())
 
 
 class MessageTestingTest(TestingTestCase):
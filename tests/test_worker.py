@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 Red Hat, Inc.
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+import datetime
+import io
+
+from django.core.management import call_command
+
+import event
+from api.models import Job, Message, QueuedSeries, WatchedQuery
+
+from .patchewtest import PatchewTestCase, main
+
+
+class WorkerTest(PatchewTestCase):
+    def setUp(self):
+        self.create_superuser()
+        self.p = self.add_project("QEMU", "qemu-devel@nongnu.org")
+        event.set_job_queue(Job.objects.enqueue)
+        self.addCleanup(event.set_job_queue, None)
+
+    def add_handler(self, handler):
+        event.register_handler("SetProperty", handler, deferred=True)
+        self.addCleanup(event._handlers["SetProperty"].remove, (handler, True))
+
+    def run_worker(self):
+        stderr = io.StringIO()
+        call_command("worker", "--oneshot", stderr=stderr)
+        return stderr.getvalue()
+
+    def test_import(self):
+        self.cli_login()
+        self.cli_import("0004-multiple-patch-reviewed.mbox.gz")
+        self.cli_logout()
+        MESSAGE_ID = "1469192015-16487-1-git-send-email-berrange@redhat.com"
+        TAG = "Reviewed-by: Eric Blake <eblake@redhat.com>"
+        s = Message.objects.find_series(MESSAGE_ID, self.p.name)
+        self.assertEqual(s.tags, [])
+        handler = "tags.SeriesTagsModule.on_message_added"
+        self.assertTrue(Job.objects.filter(handler=handler).exists())
+
+        self.assertEqual(self.run_worker(), "")
+        self.assertFalse(Job.objects.exists())
+        s = Message.objects.find_series(MESSAGE_ID, self.p.name)
+        self.assertEqual(s.tags, [TAG])
+        self.assertTrue(s.is_reviewed)
+
+    def test_order_and_retry(self):
+        self.cli_login()
+        self.cli_import("0001-simple-patch.mbox.gz")
+        self.cli_import("0021-mode-only-patch.mbox.gz")
+        self.cli_logout()
+        self.run_worker()
+        s1, s2 = Message.objects.series_heads().order_by("id")
+
+        calls = []
+
+        def on_set_property(evt, obj, name, value, old_value):
+            if name == "fail" and not calls:
+                calls.append("failed")
+                raise Exception("first attempt fails")
+            calls.append((obj.id, name, value))
+
+        self.add_handler(on_set_property)
+        s1.set_property("fail", 1)
+        s1.set_property("after", 2)
+        s2.set_property("other", 3)
+        self.assertEqual(calls, [])
+        jobs = Job.objects.filter(handler=event.handler_name(on_set_property))
+        self.assertEqual(jobs.count(), 3)
+
+        # The second job for s1 waits until the first succeeds
+        self.assertIn("first attempt fails", self.run_worker())
+        self.assertEqual(calls, ["failed", (s2.id, "other", 3)])
+        self.assertEqual(jobs.count(), 2)
+        job = jobs.order_by("id").first()
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, datetime.datetime.now())
+        self.assertIn("first attempt fails", job.last_error)
+        jobs.update(run_after=datetime.datetime.now())
+        self.assertEqual(self.run_worker(), "")
+        self.assertEqual(calls[2:], [(s1.id, "fail", 1), (s1.id, "after", 2)])
+        self.assertFalse(Job.objects.exists())
+
+    def test_deleted_object(self):
+        self.cli_login()
+        self.cli_import("0001-simple-patch.mbox.gz")
+        self.cli_logout()
+        self.run_worker()
+        calls = []
+        self.add_handler(lambda evt, obj, name, value, old_value: calls.append(name))
+        s = Message.objects.series_heads().get()
+        s.set_property("foo", "bar")
+        s.delete()
+        self.assertEqual(self.run_worker(), "")
+        self.assertEqual(calls, [])
+        self.assertFalse(Job.objects.exists())
+
+    def test_dropped_from_queue(self):
+        user = self.create_user("test", "1234")
+        self.cli_login()
+        self.cli_import("0001-simple-patch.mbox.gz")
+        self.cli_logout()
+        self.run_worker()
+        msg = Message.objects.series_heads().get()
+        WatchedQuery(user=user, query="to:qemu-block@nongnu.org -nack:test").save()
+        self.client.post("/login/", {"username": "test", "password": "1234"})
+        self.client.post(
+            "/QEMU/" + msg.message_id + "/mark-as-rejected/", {"next": "/"}
+        )
+        self.run_worker()
+        watched = QueuedSeries.objects.filter(user=user, name="watched")
+        self.assertFalse(watched.exists())
+
+        # The queue entry is gone, so MessageDropped cannot be queued
+        self.client.post("/QEMU/" + msg.message_id + "/clear-reviewed/", {"next": "/"})
+        self.assertEqual(self.run_worker(), "")
+        self.assertTrue(watched.filter(message=msg).exists())
+
+    def test_email_not_configured(self):
+        # Without a notification for the event, nothing is queued for email
+        self.p.set_property("foo", "bar")
+        self.assertFalse(Job.objects.filter(handler__startswith="email.").exists())
+        self.p.config = {
+            "email": {
+                "notifications": {
+                    "test": {
+                        "event": "SetProperty",
+                        "enabled": True,
+                        "reply_to_all": False,
+                        "in_reply_to": True,
+                        "set_reply_to": True,
+                        "reply_subject": True,
+                        "to_user": False,
+                        "to": "a@b.org",
+                        "cc": "",
+                        "subject_template": "{{ name }}",
+                        "body_template": "{{ value }}",
+                    }
+                }
+            }
+        }
+        self.p.save()
+        self.p.set_property("foo", "baz")
+        self.assertTrue(Job.objects.filter(handler__startswith="email.").exists())
+
+    def test_no_queue(self):
+        calls = []
+        self.add_handler(lambda evt, obj, name, value, old_value: calls.append(name))
+        event.set_job_queue(None)
+        self.p.set_property("foo", "bar")
+        self.assertEqual(calls, ["foo"])
+        self.assertFalse(Job.objects.exists())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 Red Hat, Inc.
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+"""Cache for the pages that are shown to anonymous users, and for the
+number of results in the series lists.
+
+Each cached page or count depends on a set of generations: one per project,
+one per series and one for the search results.  When an event reports a
+change to a project or a series, its generation is dropped; a new one is
+created on the next access, so that the pages rendered before the change
+are not found anymore and eventually expire."""
+
+import hashlib
+import uuid
+
+from django.core.cache import cache
+
+from api.models import Message, Project
+from event import register_handler
+
+PAGE_KEY_PREFIX = "www-page:"
+GENERATION_KEY_PREFIX = "www-gen:"
+COUNT_KEY_PREFIX = "www-count:"
+COUNT_TIMEOUT = 600
+
+
+def _generation_key(kind, id=""):
+    return "%s%s:%s" % (GENERATION_KEY_PREFIX, kind, id)
+
+
+def _get_generations(keys):
+    gens = cache.get_many(keys)
+    missing = {k: uuid.uuid4().hex for k in keys if k not in gens}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        gens.update(missing)
+    return [gens[k] for k in keys]
+
+
+def _cache_key(prefix, data, projects, series, search):
+    keys = [_generation_key("project", x) for x in projects]
+    keys += [_generation_key("series", x) for x in series]
+    if search:
+        keys.append(_generation_key("search"))
+    data = repr((_get_generations(keys), data))
+    return prefix + hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def cached_page(request, render, projects=(), series=(), search=False):
+    """Return the response of render(), reusing the response of an earlier
+    call if the request is anonymous and none of @projects (ids), @series
+    (ids) and, if @search is True, the search results have changed since."""
+    if request.method != "GET" or request.user.is_authenticated:
+        return render()
+    key = _cache_key(PAGE_KEY_PREFIX, request.get_full_path(), projects, series, search)
+    response = cache.get(key)
+    if response is None:
+        response = render()
+        if response.status_code == 200:
+            cache.set(key, response)
+    return response
+
+
+def cached_count(query, data, projects=(), search=False):
+    """Return query.count(), reusing the result of an earlier call with the
+    same @data if neither @projects (ids) nor, if @search is True, the search
+    results have changed since.  Unlike pages, counts are cached for logged
+    in users too, so they also expire after COUNT_TIMEOUT seconds."""
+    key = _cache_key(COUNT_KEY_PREFIX, data, projects, (), search)
+    count = cache.get(key)
+    if count is None:
+        count = query.count()
+        cache.set(key, count, timeout=COUNT_TIMEOUT)
+    return count
+
+
+def invalidate(project=None, series=None):
+    """Drop the cached pages that show @project or @series"""
+    keys = [_generation_key("search")]
+    if project:
+        keys.append(_generation_key("project", project.id))
+        if project.parent_project_id:
+            keys.append(_generation_key("project", project.parent_project_id))
+    if series:
+        keys.append(_generation_key("series", series.id))
+    cache.delete_many(keys)
+
+
+def _invalidate_obj(obj):
+    if isinstance(obj, Project):
+        invalidate(project=obj)
+    elif isinstance(obj, Message):
+        invalidate(project=obj.project, series=obj.get_series_head())
+
+
+def on_message_added(event, message):
+    _invalidate_obj(message)
+
+
+def on_obj_update(event, obj, **params):
+    _invalidate_obj(obj)
+
+
+def on_series_update(event, series, project=None):
+    invalidate(project=project or series.project, series=series)
+
+
+register_handler("MessageAdded", on_message_added)
+register_handler("ResultUpdate", on_obj_update)
+register_handler("SetProperty", on_obj_update)
+register_handler("TagsUpdate", on_series_update)
+register_handler("SeriesMerged", on_series_update)
+register_handler("SeriesComplete", on_series_update)
+register_handler("SeriesReviewed", on_series_update)
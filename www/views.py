@@ -10,15 +10,24 @@
 import urllib
 
 from django.shortcuts import render
-from django.http import HttpResponse, Http404
-from django.db.models import Exists, F, OuterRef
+from django.http import HttpResponse, Http404, StreamingHttpResponse
+from django.db.models import Exists, OuterRef
 from django.urls import reverse
 from django.utils.html import format_html
 from django.conf import settings
+from api.keyset import (
+    SERIES_ORDERINGS,
+    KeysetPage,
+    encode_cursor,
+    get_key,
+    order_queryset,
+)
 from api.models import Project, Message
 import api
+from constants import declare_constant, get_constant
 from mod import dispatch_module_hook
 from patchew.logviewer import LogView
+from www.cache import cached_count, cached_page
 import subprocess
 
 PAGE_SIZE = 50
@@ -28,14 +37,23 @@ def try_get_git_head():
     try:
         return (
             "-"
-            + subprocess.check_output(["git", "rev-parse", "--short", "HEAD"]).decode()
+            + subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=settings.BASE_DIR,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
         )
     except Exception:
         return ""
 
 
+declare_constant("patchew_version", lambda: settings.VERSION + try_get_git_head())
+
+
 def render_page(request, template_name, **data):
-    data["patchew_version"] = settings.VERSION + try_get_git_head()
+    data["patchew_version"] = get_constant("patchew_version")
     dispatch_module_hook("render_page_hook", request=request, context_data=data)
     return render(request, template_name, context=data)
 
@@ -92,12 +110,13 @@ def prepare_patches(request, m, max_depth=None):
 def prepare_series(request, s, skip_patches=False):
     r = []
     project = s.project
+    thread = s.get_thread_replies(with_text=True)
 
     def add_msg_recurse(m, skip_patches, depth=0):
         a = prepare_message(request, project, m, True)
         a.indent_level = min(depth, 4)
         r.append(a)
-        replies = m.get_replies()
+        replies = thread[m.message_id]
         non_patches = [x for x in replies if not x.is_patch]
         patches = []
         if not skip_patches:
@@ -134,13 +153,20 @@ def view_project_list(request):
     return render_page(request, "project-list.html", projects=prepare_projects())
 
 
-def gen_page_links(query, cur_page, pagesize, extra_params):
+def gen_page_links(query, cur_page, pagesize, extra_params, count_cache=None):
     # stop a little after the current page
     limit = max(cur_page + 3, 10)
 
     # include one extra record in the limit, so that the final "..." can be printed,
     # but do not go all the way to the end
-    total = query[: pagesize * limit + 1].count()
+    query = query[: pagesize * limit + 1]
+    if count_cache is None:
+        total = query.count()
+    else:
+        # count_cache has the arguments of cached_count(), which are
+        # completed with the number of records that are counted
+        data = (count_cache["data"], pagesize * limit + 1)
+        total = cached_count(query, **dict(count_cache, data=data))
     max_page = int((total + pagesize - 1) / pagesize)
     start = 10 if max_page <= 10 else 3
 
@@ -197,10 +223,11 @@ def render_series_list_page(
     button_url=None,
     button_data=None,
     button_text=None,
+    count_cache=None,
 ):
     sort = request.GET.get("sort")
-    cur_page = get_page_from_request(request)
-    start = (cur_page - 1) * PAGE_SIZE
+    cursor = request.GET.get("cursor")
+    cur_page = 0 if cursor else get_page_from_request(request)
     params = ""
     if sort:
         params += "&" + urllib.parse.urlencode({"sort": sort})
@@ -216,18 +243,41 @@ def render_series_list_page(
     else:
         search = "project:%s" % project
         nav_path = prepare_navigate_list(project)
-    page_links = gen_page_links(base_query, cur_page, PAGE_SIZE, params)
+    if count_cache is not None:
+        data = (" ".join(search.split()), request.user.id)
+        count_cache = dict(count_cache, data=data)
+    page_links = gen_page_links(base_query, cur_page, PAGE_SIZE, params, count_cache)
 
     if sort == "replied":
-        query = base_query.order_by(F("last_reply_date").desc(nulls_last=True), "-date")
+        fields = SERIES_ORDERINGS["last_reply_date"]
         order_by_reply = True
     else:
-        query = base_query.order_by("-date")
+        fields = SERIES_ORDERINGS["date"]
         order_by_reply = False
-    query = query.prefetch_related("topic", "results")
-    series = query[start : start + PAGE_SIZE]
-    if not series and cur_page > 1:
+    # The list only shows the headers and the results, not the mbox
+    query = base_query.prefetch_related("topic", "results").defer("mbox_bytes")
+    if cursor:
+        try:
+            page = KeysetPage(query, fields, cursor, PAGE_SIZE)
+        except ValueError:
+            raise Http404("Page not found")
+        series = page.items
+        older, newer = page.next_cursor, page.previous_cursor
+    else:
+        # Page numbers are only linked for the first few pages, and the
+        # older/newer links switch to cursors from there on
+        start = (cur_page - 1) * PAGE_SIZE
+        series = list(order_queryset(query, fields)[start : start + PAGE_SIZE + 1])
+        older = newer = None
+        if len(series) > PAGE_SIZE:
+            del series[PAGE_SIZE:]
+            older = encode_cursor(fields, get_key(series[-1], fields))
+        if series and cur_page > 1:
+            newer = encode_cursor(fields, get_key(series[0], fields), reverse=True)
+    if not series and (cursor or cur_page > 1):
         raise Http404("Page not found")
+    older_url = older and "?cursor=" + older + params
+    newer_url = newer and "?cursor=" + newer + params
 
     if project:
         title += " for " + project
@@ -236,6 +286,8 @@ def render_series_list_page(
         "series-list.html",
         series=prepare_series_list(request, series),
         page_links=page_links,
+        older_url=older_url,
+        newer_url=newer_url,
         search=search,
         is_search=is_search,
         title=title,
@@ -289,48 +341,68 @@ def view_search(request):
     from api.search import SearchEngine
 
     search = request.GET.get("q", "").strip()
-    se = SearchEngine([search], request.user)
-    query = se.search_series()
-    return render_series_list_page(
-        request,
-        query,
-        search=search,
-        project=se.project(),
-        keywords=se.last_keywords(),
-        is_search=True,
-    )
+
+    def render():
+        se = SearchEngine([search], request.user)
+        query = se.search_series()
+        return render_series_list_page(
+            request,
+            query,
+            search=search,
+            project=se.project(),
+            keywords=se.last_keywords(),
+            is_search=True,
+            count_cache={"search": True},
+        )
+
+    return cached_page(request, render, search=True)
 
 
 def view_series_list(request, project):
     prj = api.models.Project.objects.filter(name=project).first()
     if not prj:
         raise Http404("Project not found")
-    query = api.models.Message.objects.series_heads(prj.id)
-    return render_series_list_page(
-        request,
-        query,
-        project=project,
-        title="All series",
-        link_icon="fa fa-list",
-        link_url=reverse("project_detail", kwargs={"project": project}),
-        link_text="More information about " + project + "...",
-    )
+
+    def render():
+        query = api.models.Message.objects.series_heads(prj.id)
+        return render_series_list_page(
+            request,
+            query,
+            project=project,
+            title="All series",
+            link_icon="fa fa-list",
+            link_url=reverse("project_detail", kwargs={"project": project}),
+            link_text="More information about " + project + "...",
+            count_cache={"projects": [prj.id]},
+        )
+
+    return cached_page(request, render, projects=[prj.id])
 
 
 def view_mbox(request, project, message_id):
     s = api.models.Message.objects.find_message(message_id, project)
     if not s:
         raise Http404("Series not found")
-    mbox = s.get_mbox_with_tags()
-    if not mbox:
+    mboxes = s.get_mboxes_with_tags()
+    if mboxes is None:
         raise Http404("Series not complete")
-    return HttpResponse(mbox, content_type="text/plain")
+    return StreamingHttpResponse(
+        api.models.iter_join(b"\n", mboxes), content_type="text/plain"
+    )
 
 
 def view_series_detail(request, project, message_id):
     s = api.models.Message.objects.find_series(message_id, project)
     if not s:
         raise Http404("Series not found")
+    return cached_page(
+        request,
+        lambda: render_series_detail(request, project, message_id, s),
+        series=[s.id],
+    )
+
+
+def render_series_detail(request, project, message_id, s):
     nav_path = prepare_navigate_list(
         "View series", ("series_list", {"project": project}, project)
     )